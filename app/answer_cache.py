@@ -0,0 +1,248 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from graphrag.query.structured_search.base import SearchResult
+
+from artifact_store import IndexArtifacts
+from embedding_cache import get_cached_text_embedder
+
+log = logging.getLogger(__name__)
+
+ANSWER_CACHE_PATH = os.environ.get(
+    "GRAPHRAG_ANSWER_CACHE_PATH", "./cache/query_answers.sqlite"
+)
+ANSWER_CACHE_TTL = float(os.environ.get("GRAPHRAG_ANSWER_CACHE_TTL", 7 * 24 * 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("GRAPHRAG_ANSWER_CACHE_MAX_ENTRIES", 5000))
+# cosine similarity a paraphrased question needs to reuse a cached answer, off by
+# default: clinical paraphrases and negations ("Is the patient on X?" vs "Was the
+# patient taken off X?") score above 0.97 and would get each other's answers
+ANSWER_CACHE_SEMANTIC_THRESHOLD = float(
+    os.environ.get("GRAPHRAG_ANSWER_CACHE_SEMANTIC_THRESHOLD", 0)
+)
+
+# answers used to be pickled SearchResults, context tables and all; the file is
+# shared across replicas, so a pickle in it is code every reader would run
+_SCHEMA = """
+DROP TABLE IF EXISTS answers;
+CREATE TABLE IF NOT EXISTS answer_results (
+    key TEXT PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    question TEXT NOT NULL,
+    embedding BLOB,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answer_results_namespace ON answer_results (namespace);
+CREATE INDEX IF NOT EXISTS answer_results_accessed_at ON answer_results (accessed_at);
+"""
+
+
+def dump_result(result: SearchResult) -> str:
+    """The answer and its usage, the retrieved patient context is not kept."""
+    return json.dumps(
+        {
+            "response": result.response,
+            "llm_calls": result.llm_calls,
+            "prompt_tokens": result.prompt_tokens,
+            "completion_time": result.completion_time,
+        }
+    )
+
+
+def load_result(payload: str) -> SearchResult:
+    fields = json.loads(payload)
+    return SearchResult(
+        response=fields["response"],
+        context_data={},
+        context_text="",
+        completion_time=fields["completion_time"],
+        llm_calls=fields["llm_calls"],
+        prompt_tokens=fields["prompt_tokens"],
+    )
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+def answer_namespace(
+    artifacts: IndexArtifacts, search_type: str, model: str, params: dict
+) -> str:
+    """Digest of everything besides the question that determines an answer."""
+    payload = json.dumps(
+        {
+            "artifacts": artifacts.content_hash,
+            "community_level": artifacts.community_level,
+            "search_type": search_type,
+            "model": model,
+            "params": params,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """SQLite-backed SearchResult cache with TTL and LRU eviction and an optional semantic-match tier."""
+
+    def __init__(
+        self,
+        path: str = ANSWER_CACHE_PATH,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        semantic_threshold: float = ANSWER_CACHE_SEMANTIC_THRESHOLD,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.semantic_threshold = semantic_threshold
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    with sqlite3.connect(self.path, timeout=30) as conn:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.executescript(_SCHEMA)
+                    self._initialized = True
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def _key(namespace: str, question: str) -> str:
+        return hashlib.sha256(
+            f"{namespace}:{normalize_question(question)}".encode("utf-8")
+        ).hexdigest()
+
+    def get(
+        self, namespace: str, question: str, embedding: np.ndarray | None = None
+    ) -> SearchResult | None:
+        now = time.time()
+        key = self._key(namespace, question)
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute(
+                    "SELECT result, created_at FROM answer_results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] > self.ttl:
+                    conn.execute("DELETE FROM answer_results WHERE key = ?", (key,))
+                    row = None
+
+                if row is None and embedding is not None:
+                    candidates = conn.execute(
+                        "SELECT key, embedding, result FROM answer_results"
+                        " WHERE namespace = ? AND embedding IS NOT NULL AND created_at >= ?",
+                        (namespace, now - self.ttl),
+                    ).fetchall()
+                    if candidates:
+                        matrix = np.stack(
+                            [np.frombuffer(c[1], dtype=np.float32) for c in candidates]
+                        )
+                        scores = matrix @ embedding
+                        best = int(np.argmax(scores))
+                        if scores[best] >= self.semantic_threshold:
+                            key = candidates[best][0]
+                            row = (candidates[best][2], None)
+
+                if row is None:
+                    return None
+                conn.execute(
+                    "UPDATE answer_results SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+        finally:
+            conn.close()
+        return load_result(row[0])
+
+    def set(
+        self,
+        namespace: str,
+        question: str,
+        result: SearchResult,
+        embedding: np.ndarray | None = None,
+    ):
+        # failed searches come back with an empty response, never keep those
+        if not result.response:
+            return
+
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO answer_results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        self._key(namespace, question),
+                        namespace,
+                        question,
+                        embedding.tobytes() if embedding is not None else None,
+                        dump_result(result),
+                        now,
+                        now,
+                    ),
+                )
+                conn.execute(
+                    "DELETE FROM answer_results WHERE created_at < ?", (now - self.ttl,)
+                )
+                conn.execute(
+                    "DELETE FROM answer_results WHERE key IN ("
+                    " SELECT key FROM answer_results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        finally:
+            conn.close()
+
+    def clear(self):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM answer_results")
+        finally:
+            conn.close()
+
+    async def _embed(self, question: str) -> np.ndarray | None:
+        if self.semantic_threshold <= 0:
+            return None
+        # the embedding cache also keeps the vector of a miss for when the answer is stored
+        try:
+            vector = await get_cached_text_embedder().aembed(
+                normalize_question(question)
+            )
+        except Exception:
+            log.warning("Could not embed question for the answer cache", exc_info=True)
+            return None
+        return np.asarray(vector, dtype=np.float32) if vector else None
+
+    async def aget(
+        self, namespace: str, question: str, semantic=True
+    ) -> SearchResult | None:
+        """The cached answer to question, with semantic a close paraphrase's answer too."""
+        result = await asyncio.to_thread(self.get, namespace, question)
+        if result is not None or not semantic or self.semantic_threshold <= 0:
+            return result
+        embedding = await self._embed(question)
+        if embedding is None:
+            return None
+        return await asyncio.to_thread(self.get, namespace, question, embedding)
+
+    async def aset(
+        self, namespace: str, question: str, result: SearchResult, semantic=True
+    ):
+        """Store an answer, only with semantic can paraphrases of question match it."""
+        embedding = await self._embed(question) if semantic else None
+        await asyncio.to_thread(self.set, namespace, question, result, embedding)
+
+
+answer_cache = AnswerCache()
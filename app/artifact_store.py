@@ -0,0 +1,177 @@
+import hashlib
+import os
+import threading
+from dataclasses import dataclass, replace
+
+import pandas as pd
+
+from graphrag.model import CommunityReport, Entity, Relationship, TextUnit
+from graphrag.query.indexer_adapters import (
+    read_indexer_entities,
+    read_indexer_relationships,
+    read_indexer_reports,
+    read_indexer_text_units,
+)
+
+from columnar import IndexColumns, compact_artifacts
+
+# parquet files generated from indexing pipeline
+INPUT_DIR = "./output/20240825-115048/artifacts"
+
+COMMUNITY_REPORT_TABLE = "create_final_community_reports"
+ENTITY_TABLE = "create_final_nodes"
+ENTITY_EMBEDDING_TABLE = "create_final_entities"
+RELATIONSHIP_TABLE = "create_final_relationships"
+# COVARIATE_TABLE = "create_final_covariates"
+TEXT_UNIT_TABLE = "create_final_text_units"
+
+ARTIFACT_TABLES = [
+    ENTITY_TABLE,
+    ENTITY_EMBEDDING_TABLE,
+    RELATIONSHIP_TABLE,
+    COMMUNITY_REPORT_TABLE,
+    TEXT_UNIT_TABLE,
+]
+
+# community level in the Leiden community hierarchy from which we will load the community reports
+# higher value means we use reports from more fine-grained communities (at the cost of higher computation cost)
+COMMUNITY_LEVEL = 2
+
+
+@dataclass
+class IndexArtifacts:
+    """Parsed query-time objects for one artifacts directory."""
+
+    input_dir: str
+    community_level: int
+    version: str
+    # content digest of the tables, stable across copies of the same index run
+    content_hash: str
+    entities: list[Entity]
+    relationships: list[Relationship]
+    reports: list[CommunityReport]
+    text_units: list[TextUnit]
+    report_count: int
+    # float32 embeddings, interned ids and index arrays over the lists above
+    columns: IndexColumns
+
+    def global_reports(self) -> list[CommunityReport]:
+        # GlobalCommunityContext writes the community weight into each report's
+        # attributes, so global search gets its own shallow copies to keep that
+        # column out of the local search community table.
+        return [
+            replace(
+                report,
+                attributes=dict(report.attributes) if report.attributes else None,
+            )
+            for report in self.reports
+        ]
+
+
+def artifact_version(input_dir: str = INPUT_DIR) -> str:
+    """Cheap fingerprint of the parquet tables, changes whenever one is rewritten."""
+    parts = []
+    for table in ARTIFACT_TABLES:
+        stat = os.stat(f"{input_dir}/{table}.parquet")
+        parts.append(f"{table}:{stat.st_mtime_ns}:{stat.st_size}")
+    return "|".join(parts)
+
+
+def artifact_content_hash(input_dir: str = INPUT_DIR) -> str:
+    digest = hashlib.sha256()
+    for table in ARTIFACT_TABLES:
+        with open(f"{input_dir}/{table}.parquet", "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def load_artifacts(
+    input_dir: str = INPUT_DIR, community_level: int = COMMUNITY_LEVEL
+) -> IndexArtifacts:
+    version = artifact_version(input_dir)
+
+    # read nodes table to get community and degree data
+    entity_df = pd.read_parquet(f"{input_dir}/{ENTITY_TABLE}.parquet")
+    entity_embedding_df = pd.read_parquet(
+        f"{input_dir}/{ENTITY_EMBEDDING_TABLE}.parquet"
+    )
+    entities = read_indexer_entities(entity_df, entity_embedding_df, community_level)
+    print(f"Entity count: {len(entity_df)}")
+
+    relationship_df = pd.read_parquet(f"{input_dir}/{RELATIONSHIP_TABLE}.parquet")
+    relationships = read_indexer_relationships(relationship_df)
+    print(f"Relationship count: {len(relationship_df)}")
+
+    # NOTE: covariates are turned off by default, because they generally need prompt tuning to be valuable
+    # Please see the GRAPHRAG_CLAIM_* settings
+
+    report_df = pd.read_parquet(f"{input_dir}/{COMMUNITY_REPORT_TABLE}.parquet")
+    reports = read_indexer_reports(report_df, entity_df, community_level)
+    print(f"Total report count: {len(report_df)}")
+    print(
+        f"Report count after filtering by community level {community_level}: {len(reports)}"
+    )
+
+    text_unit_df = pd.read_parquet(f"{input_dir}/{TEXT_UNIT_TABLE}.parquet")
+    text_units = read_indexer_text_units(text_unit_df)
+    print(f"Text unit records: {len(text_unit_df)}")
+
+    # the description embeddings are the bulk of an index, keep them as float32
+    # arrays instead of lists of Python floats on every entity
+    columns = compact_artifacts(entities, relationships, text_units)
+
+    return IndexArtifacts(
+        input_dir=input_dir,
+        community_level=community_level,
+        version=version,
+        content_hash=artifact_content_hash(input_dir),
+        entities=entities,
+        relationships=relationships,
+        reports=reports,
+        text_units=text_units,
+        report_count=len(report_df),
+        columns=columns,
+    )
+
+
+class ArtifactStore:
+    """Process-wide cache of parsed artifacts, reloaded only when the parquet files change."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._artifacts: dict[tuple[str, int], IndexArtifacts] = {}
+
+    def get(
+        self, input_dir: str = INPUT_DIR, community_level: int = COMMUNITY_LEVEL
+    ) -> IndexArtifacts:
+        key = (os.path.abspath(input_dir), community_level)
+        version = artifact_version(input_dir)
+        artifacts = self._artifacts.get(key)
+        if artifacts is not None and artifacts.version == version:
+            return artifacts
+
+        with self._lock:
+            # another thread may have finished the reload while we waited
+            artifacts = self._artifacts.get(key)
+            if artifacts is None or artifacts.version != version:
+                artifacts = load_artifacts(input_dir, community_level)
+                self._artifacts[key] = artifacts
+            return artifacts
+
+    def evict(self, input_dir: str, community_level: int = COMMUNITY_LEVEL):
+        with self._lock:
+            self._artifacts.pop((os.path.abspath(input_dir), community_level), None)
+
+    def clear(self):
+        with self._lock:
+            self._artifacts.clear()
+
+
+artifact_store = ArtifactStore()
+
+
+def get_artifacts(
+    input_dir: str = INPUT_DIR, community_level: int = COMMUNITY_LEVEL
+) -> IndexArtifacts:
+    return artifact_store.get(input_dir, community_level)
@@ -0,0 +1,64 @@
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+# with GRAPHRAG_QUERY_API_URL set the UI is a thin client of query_api.py,
+# otherwise searches run in this process
+QUERY_API_URL = os.environ.get("GRAPHRAG_QUERY_API_URL")
+# preload the default index and clients in the background when the app starts
+WARM_UP = os.environ.get("GRAPHRAG_WARM_UP", "1") == "1"
+
+# this module is imported by the Streamlit script and must stay light, graphrag,
+# pandas, tiktoken and the OpenAI SDK are only imported by get_query_backend
+_lock = threading.Lock()
+_backend = None
+_warm_up_lock = threading.Lock()
+_warm_up_thread: threading.Thread | None = None
+
+
+def get_query_backend():
+    """The process-wide query backend, its modules are imported on first use."""
+    global _backend
+    with _lock:
+        if _backend is None:
+            if QUERY_API_URL:
+                from query_client import QueryAPIClient
+
+                _backend = QueryAPIClient(QUERY_API_URL)
+            else:
+                from metrics import start_metrics_server
+                from query_service import get_query_service
+
+                # serves /metrics when GRAPHRAG_METRICS_PORT is set
+                start_metrics_server()
+
+                # one background event loop per server process runs every search,
+                # shared by all sessions
+                _backend = get_query_service()
+        return _backend
+
+
+def _warm_up():
+    try:
+        backend = get_query_backend()
+        if hasattr(backend, "warm_up"):
+            backend.warm_up().result()
+        log.info("Query backend warmed up")
+    except Exception:
+        # the first search loads whatever is missing
+        log.exception("Query backend warm-up failed")
+
+
+def start_warm_up():
+    """Import the search modules and load the default index on a background thread, once per process."""
+    global _warm_up_thread
+    if not WARM_UP:
+        return
+    with _warm_up_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(
+                target=_warm_up, name="query-warm-up", daemon=True
+            )
+            _warm_up_thread.start()
@@ -0,0 +1,75 @@
+import asyncio
+import os
+
+from global_query import execute_global_query
+from local_query import execute_local_query
+from query_router import execute_auto_query
+
+# number of searches allowed in flight at once, each global search fans out
+# to its own concurrent_coroutines map calls on top of this
+BATCH_MAX_CONCURRENCY = int(os.environ.get("GRAPHRAG_BATCH_CONCURRENCY", 4))
+
+
+async def execute_query(
+    question: str,
+    search_type: str,
+    mock=False,
+    use_cache=True,
+    index_id: str | None = None,
+):
+    if search_type == "global":
+        return await execute_global_query(
+            question=question, mock=mock, use_cache=use_cache, index_id=index_id
+        )
+    elif search_type == "local":
+        return await execute_local_query(
+            question=question, mock=mock, use_cache=use_cache, index_id=index_id
+        )
+    elif search_type == "auto":
+        return await execute_auto_query(
+            question=question, mock=mock, use_cache=use_cache, index_id=index_id
+        )
+    raise ValueError(f"Unknown search type: {search_type}")
+
+
+async def execute_batch_queries(
+    queries: list[tuple[str, str]],
+    max_concurrency: int = BATCH_MAX_CONCURRENCY,
+    mock=False,
+    use_cache=True,
+    index_id: str | None = None,
+) -> list:
+    """Run (question, type) pairs concurrently on the current event loop.
+
+    Results come back in the order of queries, a failed question yields its exception.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _run(question: str, search_type: str):
+        async with semaphore:
+            return await execute_query(
+                question, search_type, mock=mock, use_cache=use_cache, index_id=index_id
+            )
+
+    return await asyncio.gather(
+        *[_run(question, search_type) for question, search_type in queries],
+        return_exceptions=True,
+    )
+
+
+def run_batch_queries(
+    queries: list[tuple[str, str]],
+    max_concurrency: int = BATCH_MAX_CONCURRENCY,
+    mock=False,
+    use_cache=True,
+    index_id: str | None = None,
+) -> list:
+    return asyncio.run(
+        execute_batch_queries(
+            queries,
+            max_concurrency=max_concurrency,
+            mock=mock,
+            use_cache=use_cache,
+            index_id=index_id,
+        )
+    )
@@ -0,0 +1,304 @@
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# questions for the single-query scenarios, one specific and one broad
+LOCAL_QUESTION = "What medication is the patient taking?"
+GLOBAL_QUESTION = "Provide a short summary of the treatment this patient has received in the past."
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Mock LLM server did not start on port {port}")
+
+
+def start_mock_server(args) -> tuple[subprocess.Popen, str]:
+    """Run mock_llm_server.py in a child process so its threads don't compete for our GIL."""
+    port = _free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(APP_DIR, "mock_llm_server.py"),
+            f"--port={port}",
+            f"--chat-latency={args.chat_latency}",
+            f"--embedding-latency={args.embedding_latency}",
+            f"--token-latency={args.token_latency}",
+            f"--jitter={args.jitter}",
+            f"--rate-limit-probability={args.rate_limit_probability}",
+            f"--retry-after={args.retry_after}",
+            f"--seed={args.seed}",
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    _wait_for_port(port)
+    return process, f"http://127.0.0.1:{port}"
+
+
+def configure_environment(api_base: str, cache_dir: str, warm_caches: bool):
+    """Point the app at the mock endpoints and at throwaway caches, before any app module is imported."""
+    os.environ["GRAPHRAG_API_BASE"] = api_base
+    os.environ["GRAPHRAG_EMBEDDING_API_BASE"] = api_base
+    os.environ["GRAPHRAG_API_KEY"] = "mock"
+    os.environ["GRAPHRAG_LLM_MODEL"] = "gpt-4o-mini"
+    os.environ["GRAPHRAG_EMBEDDING_MODEL"] = "text-embedding-ada-002"
+    os.environ["GRAPHRAG_ANSWER_CACHE_PATH"] = os.path.join(cache_dir, "answers.sqlite")
+    os.environ["GRAPHRAG_MAP_CACHE_PATH"] = os.path.join(cache_dir, "map_results.sqlite")
+    os.environ["GRAPHRAG_EMBEDDING_CACHE_PATH"] = os.path.join(
+        cache_dir, "embeddings.sqlite"
+    )
+    if not warm_caches:
+        # every map call goes to the LLM
+        os.environ["GRAPHRAG_MAP_CACHE_MAX_ENTRIES"] = "0"
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _registry_totals() -> dict[str, int]:
+    from metrics import registry
+
+    totals: dict[str, int] = {}
+    for (_, name), value in registry.counters.items():
+        totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+def summarize(
+    name: str,
+    latencies: list[float],
+    wall_time: float,
+    queries: int,
+    llm_calls: int,
+    counters_before: dict[str, int],
+    errors: int = 0,
+) -> dict:
+    counters = _registry_totals()
+    retries = sum(
+        value - counters_before.get(key, 0)
+        for key, value in counters.items()
+        if key.endswith("_retries")
+    )
+    p50, p95, p99 = (
+        np.percentile(latencies, [50, 95, 99]).tolist() if latencies else (0, 0, 0)
+    )
+    return {
+        "scenario": name,
+        "samples": len(latencies),
+        "queries": queries,
+        "errors": errors,
+        "p50_s": round(p50, 4),
+        "p95_s": round(p95, 4),
+        "p99_s": round(p99, 4),
+        "throughput_qps": round(queries / wall_time, 3) if wall_time else 0.0,
+        "llm_calls": llm_calls,
+        "http_retries": retries,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+async def bench_single(search_type: str, question: str, iterations: int, use_cache: bool) -> dict:
+    """Sequential queries of one type, one at a time."""
+    from batch_query import execute_query
+
+    counters_before = _registry_totals()
+    latencies, llm_calls = [], 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        query_start = time.perf_counter()
+        result = await execute_query(question, search_type, use_cache=use_cache)
+        latencies.append(time.perf_counter() - query_start)
+        llm_calls += result.llm_calls
+    wall_time = time.perf_counter() - start
+    return summarize(
+        f"single_{search_type}", latencies, wall_time, iterations, llm_calls, counters_before
+    )
+
+
+async def bench_batch(iterations: int, max_concurrency: int, use_cache: bool) -> dict:
+    """The eight startup questions, latency measured per whole batch."""
+    from batch_query import execute_batch_queries
+    from questions import INTAKE_QUESTIONS
+
+    queries = [(q["question"], q["type"]) for q in INTAKE_QUESTIONS]
+    counters_before = _registry_totals()
+    latencies, llm_calls, errors = [], 0, 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        batch_start = time.perf_counter()
+        results = await execute_batch_queries(
+            queries, max_concurrency=max_concurrency, use_cache=use_cache
+        )
+        latencies.append(time.perf_counter() - batch_start)
+        for result in results:
+            if isinstance(result, Exception):
+                errors += 1
+            else:
+                llm_calls += result.llm_calls
+    wall_time = time.perf_counter() - start
+    return summarize(
+        "startup_batch",
+        latencies,
+        wall_time,
+        iterations * len(queries),
+        llm_calls,
+        counters_before,
+        errors,
+    )
+
+
+async def bench_sessions(sessions: int, questions_per_session: int, use_cache: bool) -> dict:
+    """Concurrent users, each asking the intake questions one after another."""
+    from batch_query import execute_query
+    from questions import INTAKE_QUESTIONS
+
+    counters_before = _registry_totals()
+    latencies: list[float] = []
+    llm_calls, errors = 0, 0
+
+    async def _session(offset: int):
+        nonlocal llm_calls, errors
+        for i in range(questions_per_session):
+            q = INTAKE_QUESTIONS[(offset + i) % len(INTAKE_QUESTIONS)]
+            query_start = time.perf_counter()
+            try:
+                result = await execute_query(q["question"], q["type"], use_cache=use_cache)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - query_start)
+            llm_calls += result.llm_calls
+
+    start = time.perf_counter()
+    await asyncio.gather(*[_session(offset) for offset in range(sessions)])
+    wall_time = time.perf_counter() - start
+    return summarize(
+        f"sessions_{sessions}",
+        latencies,
+        wall_time,
+        sessions * questions_per_session,
+        llm_calls,
+        counters_before,
+        errors,
+    )
+
+
+async def run_benchmarks(args) -> list[dict]:
+    from batch_query import execute_query
+
+    for _ in range(args.warmup):
+        # load artifacts, open the vector store and precount tokens outside the measurements
+        await execute_query(LOCAL_QUESTION, "local", use_cache=False)
+        await execute_query(GLOBAL_QUESTION, "global", use_cache=False)
+
+    use_cache = args.warm_caches
+    results = [
+        await bench_single("local", LOCAL_QUESTION, args.iterations, use_cache),
+        await bench_single("global", GLOBAL_QUESTION, args.iterations, use_cache),
+        await bench_batch(args.batch_iterations, args.batch_concurrency, use_cache),
+    ]
+    for sessions in args.sessions:
+        results.append(
+            await bench_sessions(sessions, args.questions_per_session, use_cache)
+        )
+    return results
+
+
+def print_results(results: list[dict]):
+    columns = list(results[0])
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in results:
+        print("  ".join(str(row[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+def compare_to_baseline(results: list[dict], baseline_path: str, max_regression: float) -> list[str]:
+    """Scenarios whose p95 latency grew by more than max_regression over the baseline."""
+    with open(baseline_path) as f:
+        baseline = {row["scenario"]: row for row in json.load(f)["results"]}
+    regressions = []
+    for row in results:
+        before = baseline.get(row["scenario"])
+        if before and before["p95_s"] and row["p95_s"] > before["p95_s"] * (1 + max_regression):
+            regressions.append(
+                f"{row['scenario']}: p95 {before['p95_s']}s -> {row['p95_s']}s"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="benchmark local and global search against a mock LLM, run from the repository root"
+    )
+    parser.add_argument("--iterations", type=int, default=10, help="queries per single-query scenario")
+    parser.add_argument("--batch-iterations", type=int, default=3)
+    parser.add_argument("--batch-concurrency", type=int, default=4)
+    parser.add_argument("--sessions", type=int, nargs="*", default=[4, 16], help="concurrent session counts to run")
+    parser.add_argument("--questions-per-session", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured local+global query pairs to run first")
+    parser.add_argument("--warm-caches", action="store_true", help="keep answer and map caches on, measures cache hits instead of the pipeline")
+    parser.add_argument("--mock-url", help="use an already running mock server instead of starting one")
+    parser.add_argument("--chat-latency", type=float, default=0.5)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare p95 latencies against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed relative p95 increase over the baseline")
+    args = parser.parse_args()
+
+    server = None
+    api_base = args.mock_url
+    if api_base is None:
+        server, api_base = start_mock_server(args)
+
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            configure_environment(api_base, cache_dir, args.warm_caches)
+            sys.path.insert(0, APP_DIR)
+            results = asyncio.run(run_benchmarks(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,173 @@
+import asyncio
+import os
+import threading
+from functools import lru_cache
+
+import httpx
+import tiktoken
+from openai import AsyncAzureOpenAI, AzureOpenAI
+
+from graphrag.query.llm.oai.base import OpenAILLMImpl
+from graphrag.query.llm.oai.chat_openai import ChatOpenAI
+from graphrag.query.llm.oai.embedding import OpenAIEmbedding
+from graphrag.query.llm.oai.typing import OpenaiApiType
+
+from metrics import ASYNC_HTTP_EVENT_HOOKS, HTTP_EVENT_HOOKS
+from rate_limit import AsyncRateLimitedTransport, RateLimitedTransport, limiters
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+ENCODING_NAME = "cl100k_base"
+
+# the API bases can be pointed elsewhere, e.g. at mock_llm_server.py for benchmarks
+LLM_API_BASE = os.environ.get(
+    "GRAPHRAG_API_BASE",
+    "https://theraflow-openai.openai.azure.com/openai/deployments/gpt-4o-mini/chat/completions?api-version=2024-02-15-preview",
+)
+LLM_API_VERSION = "2024-02-15-preview"
+EMBEDDING_API_BASE = os.environ.get(
+    "GRAPHRAG_EMBEDDING_API_BASE",
+    "https://theraflow-openai.openai.azure.com/openai/deployments/text-embedding-ada-002/embeddings?api-version=2023-05-15",
+)
+EMBEDDING_API_VERSION = "2023-05-15"
+
+MAX_RETRIES = 20
+REQUEST_TIMEOUT = 180.0
+
+# keep enough idle connections around for a full GlobalSearch map phase (concurrent_coroutines=32)
+POOL_LIMITS = httpx.Limits(
+    max_connections=64, max_keepalive_connections=32, keepalive_expiry=120.0
+)
+
+_lock = threading.Lock()
+_clients: dict[tuple[str, str, str, str], OpenAILLMImpl] = {}
+# event loop each cached async client was created on
+_client_loops: dict[tuple[str, str, str, str], asyncio.AbstractEventLoop | None] = {}
+
+
+@lru_cache(maxsize=None)
+def get_token_encoder(encoding_name: str = ENCODING_NAME) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(encoding_name)
+
+
+def _running_loop() -> asyncio.AbstractEventLoop | None:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _kind(client: OpenAILLMImpl) -> str:
+    return "embedding" if isinstance(client, OpenAIEmbedding) else "chat"
+
+
+def _sync_client(client: OpenAILLMImpl) -> AzureOpenAI:
+    return AzureOpenAI(
+        api_key=client.api_key,
+        organization=client.organization,
+        api_version=client.api_version,
+        azure_endpoint=client.api_base,
+        azure_deployment=client.deployment_name,
+        timeout=client.request_timeout,
+        max_retries=client.max_retries,
+        http_client=httpx.Client(
+            transport=RateLimitedTransport(
+                httpx.HTTPTransport(limits=POOL_LIMITS), limiters[_kind(client)]
+            ),
+            timeout=client.request_timeout,
+            event_hooks=HTTP_EVENT_HOOKS,
+        ),
+    )
+
+
+def _async_client(client: OpenAILLMImpl) -> AsyncAzureOpenAI:
+    return AsyncAzureOpenAI(
+        api_key=client.api_key,
+        organization=client.organization,
+        api_version=client.api_version,
+        azure_endpoint=client.api_base,
+        azure_deployment=client.deployment_name,
+        timeout=client.request_timeout,
+        max_retries=client.max_retries,
+        # every request waits for the process-wide RPM/TPM budget and in-flight limit
+        http_client=httpx.AsyncClient(
+            transport=AsyncRateLimitedTransport(
+                httpx.AsyncHTTPTransport(limits=POOL_LIMITS), limiters[_kind(client)]
+            ),
+            timeout=client.request_timeout,
+            event_hooks=ASYNC_HTTP_EVENT_HOOKS,
+        ),
+    )
+
+
+def _pooled(key: tuple[str, str, str, str], factory) -> OpenAILLMImpl:
+    """Return the registered client for key, creating it with factory on first use.
+
+    The sync client lives for the whole process. httpx ties async connections to
+    the event loop that opened them, so the async client is recreated whenever the
+    caller runs on a different loop than the one it was built on.
+    """
+    loop = _running_loop()
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = factory()
+            client.set_clients(
+                sync_client=_sync_client(client), async_client=_async_client(client)
+            )
+            _clients[key] = client
+            _client_loops[key] = loop
+        elif loop is not None and _client_loops[key] is not loop:
+            client.async_client = _async_client(client)
+            _client_loops[key] = loop
+        return client
+
+
+def get_chat_llm(
+    model: str | None = None,
+    api_base: str = LLM_API_BASE,
+    api_version: str = LLM_API_VERSION,
+) -> ChatOpenAI:
+    api_key = os.environ["GRAPHRAG_API_KEY"]
+    model = model or os.environ["GRAPHRAG_LLM_MODEL"]
+    # api_key = st.secrets["GRAPHRAG_API_KEY"]
+    # llm_model = st.secrets["GRAPHRAG_LLM_MODEL"]
+
+    return _pooled(
+        ("chat", model, api_base, api_version),
+        lambda: ChatOpenAI(
+            api_key=api_key,
+            model=model,
+            api_type=OpenaiApiType.AzureOpenAI,  # OpenaiApiType.OpenAI or OpenaiApiType.AzureOpenAI
+            api_base=api_base,
+            api_version=api_version,
+            max_retries=MAX_RETRIES,
+            request_timeout=REQUEST_TIMEOUT,
+        ),
+    )
+
+
+def get_text_embedder(
+    model: str | None = None,
+    api_base: str = EMBEDDING_API_BASE,
+    api_version: str = EMBEDDING_API_VERSION,
+) -> OpenAIEmbedding:
+    api_key = os.environ["GRAPHRAG_API_KEY"]
+    model = model or os.environ["GRAPHRAG_EMBEDDING_MODEL"]
+    # embedding_model = st.secrets["GRAPHRAG_EMBEDDING_MODEL"]
+
+    return _pooled(
+        ("embedding", model, api_base, api_version),
+        lambda: OpenAIEmbedding(
+            api_key=api_key,
+            api_type=OpenaiApiType.AzureOpenAI,
+            api_base=api_base,
+            api_version=api_version,
+            model=model,
+            deployment_name=model,
+            max_retries=MAX_RETRIES,
+            request_timeout=REQUEST_TIMEOUT,
+        ),
+    )
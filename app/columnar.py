@@ -0,0 +1,267 @@
+import sys
+from dataclasses import dataclass
+
+import numpy as np
+
+from graphrag.model import Entity, Relationship, TextUnit
+
+
+def _intern_ids(values) -> list[str] | None:
+    if values is None:
+        return None
+    return [sys.intern(str(value)) for value in values]
+
+
+def _csr(groups: list[list[int]]) -> tuple[np.ndarray, np.ndarray]:
+    """Row pointers and column indices of a ragged list of int lists."""
+    indptr = np.zeros(len(groups) + 1, dtype=np.int32)
+    np.cumsum([len(group) for group in groups], out=indptr[1:])
+    indices = np.fromiter(
+        (index for group in groups for index in group),
+        dtype=np.int32,
+        count=int(indptr[-1]),
+    )
+    return indptr, indices
+
+
+class _Vocabulary:
+    """Interned id strings numbered in order of first appearance."""
+
+    def __init__(self, ids: list[str] | None = None):
+        self.ids: list[str] = []
+        self.index: dict[str, int] = {}
+        for id_ in ids or []:
+            self.add(id_)
+
+    def add(self, id_: str) -> int:
+        index = self.index.get(id_)
+        if index is None:
+            index = len(self.ids)
+            id_ = sys.intern(id_)
+            self.ids.append(id_)
+            self.index[id_] = index
+        return index
+
+
+@dataclass
+class EntityColumns:
+    ids: list[str]
+    row: dict[str, int]
+    # relationships refer to entities by title
+    title_row: dict[str, int]
+    # one float32 row per entity, zero where the entity has no embedding
+    description_embeddings: np.ndarray
+    has_description_embedding: np.ndarray
+    rank: np.ndarray
+    # entity -> positions in IndexColumns.text_unit_ids
+    text_unit_indptr: np.ndarray
+    text_unit_indices: np.ndarray
+    # entity -> positions in IndexColumns.community_ids
+    community_indptr: np.ndarray
+    community_indices: np.ndarray
+    # entity -> relationship rows with the entity at either end, by rank then weight
+    relationship_indptr: np.ndarray
+    relationship_indices: np.ndarray
+
+    def text_units_of(self, row: int) -> np.ndarray:
+        return self.text_unit_indices[
+            self.text_unit_indptr[row] : self.text_unit_indptr[row + 1]
+        ]
+
+    def communities_of(self, row: int) -> np.ndarray:
+        return self.community_indices[
+            self.community_indptr[row] : self.community_indptr[row + 1]
+        ]
+
+    def relationships_of(self, row: int) -> np.ndarray:
+        return self.relationship_indices[
+            self.relationship_indptr[row] : self.relationship_indptr[row + 1]
+        ]
+
+
+@dataclass
+class RelationshipColumns:
+    ids: list[str]
+    # entity rows, -1 where the title is not a loaded entity
+    source: np.ndarray
+    target: np.ndarray
+    weight: np.ndarray
+    rank: np.ndarray
+
+
+@dataclass
+class TextUnitColumns:
+    ids: list[str]
+    row: dict[str, int]
+    n_tokens: np.ndarray
+    # text unit -> entity rows
+    entity_indptr: np.ndarray
+    entity_indices: np.ndarray
+
+
+@dataclass
+class IndexColumns:
+    """Array-backed view of the entities, relationships and text units of one index.
+
+    Rows follow the order of the object lists in IndexArtifacts. text_unit_ids
+    starts with the loaded text units in row order, followed by any ids entities
+    reference that are not in the text unit table, so a position below
+    len(text_units.ids) is also a text unit row.
+    """
+
+    entities: EntityColumns
+    relationships: RelationshipColumns
+    text_units: TextUnitColumns
+    text_unit_ids: list[str]
+    community_ids: list[str]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            value.nbytes
+            for columns in (self.entities, self.relationships, self.text_units)
+            for value in vars(columns).values()
+            if isinstance(value, np.ndarray)
+        )
+
+    def community_text_unit_counts(self) -> dict[str, int]:
+        """Distinct text units of the entities in each community, the global search community weight."""
+        entities = self.entities
+        members: list[list[np.ndarray]] = [[] for _ in self.community_ids]
+        for row in range(len(entities.ids)):
+            for community in entities.communities_of(row):
+                members[community].append(entities.text_units_of(row))
+        return {
+            community_id: len(np.unique(np.concatenate(parts))) if parts else 0
+            for community_id, parts in zip(self.community_ids, members)
+        }
+
+
+def _embedding_matrix(entities: list[Entity]) -> tuple[np.ndarray, np.ndarray]:
+    dim = next(
+        (len(e.description_embedding) for e in entities if e.description_embedding),
+        0,
+    )
+    matrix = np.zeros((len(entities), dim), dtype=np.float32)
+    present = np.zeros(len(entities), dtype=bool)
+    for row, entity in enumerate(entities):
+        if entity.description_embedding:
+            matrix[row] = entity.description_embedding
+            present[row] = True
+    return matrix, present
+
+
+def _relationship_csr(
+    n_entities: int,
+    source: np.ndarray,
+    target: np.ndarray,
+    rank: np.ndarray,
+    weight: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Entity -> incident relationship rows, each entity's highest rank and weight first."""
+    rows = np.arange(len(source), dtype=np.int32)
+    # a self loop is listed once
+    ends = np.concatenate([source, np.where(target != source, target, -1)])
+    both = np.concatenate([rows, rows])
+    keep = ends >= 0
+    ends, both = ends[keep], both[keep]
+    order = np.lexsort((both, -weight[both], -rank[both], ends))
+    indptr = np.zeros(n_entities + 1, dtype=np.int32)
+    np.cumsum(np.bincount(ends, minlength=n_entities), out=indptr[1:])
+    return indptr, both[order].astype(np.int32)
+
+
+def compact_artifacts(
+    entities: list[Entity],
+    relationships: list[Relationship],
+    text_units: list[TextUnit],
+) -> IndexColumns:
+    """Build the columnar view and slim the objects down in place.
+
+    Description embeddings move into one float32 matrix and are dropped from the
+    entities, and every id string is interned so the id lists of the objects
+    share a single copy of each id.
+    """
+    text_unit_vocab = _Vocabulary([str(unit.id) for unit in text_units])
+    community_vocab = _Vocabulary()
+
+    embeddings, has_embedding = _embedding_matrix(entities)
+    entity_text_units, entity_communities = [], []
+    for entity in entities:
+        entity.id = sys.intern(entity.id)
+        entity.description_embedding = None
+        entity.text_unit_ids = _intern_ids(entity.text_unit_ids)
+        entity.community_ids = _intern_ids(entity.community_ids)
+        entity_text_units.append(
+            [text_unit_vocab.add(id_) for id_ in entity.text_unit_ids or []]
+        )
+        entity_communities.append(
+            [community_vocab.add(id_) for id_ in entity.community_ids or []]
+        )
+    entity_row = {entity.id: row for row, entity in enumerate(entities)}
+    title_row = {entity.title: row for row, entity in enumerate(entities)}
+    text_unit_indptr, text_unit_indices = _csr(entity_text_units)
+    community_indptr, community_indices = _csr(entity_communities)
+
+    source = np.array(
+        [title_row.get(r.source, -1) for r in relationships], dtype=np.int32
+    )
+    target = np.array(
+        [title_row.get(r.target, -1) for r in relationships], dtype=np.int32
+    )
+    weight = np.array([r.weight or 0.0 for r in relationships], dtype=np.float32)
+    rank = np.array(
+        [(r.attributes or {}).get("rank") or 0 for r in relationships], dtype=np.int32
+    )
+    for relationship in relationships:
+        relationship.id = sys.intern(relationship.id)
+        relationship.text_unit_ids = _intern_ids(relationship.text_unit_ids)
+    relationship_indptr, relationship_indices = _relationship_csr(
+        len(entities), source, target, rank, weight
+    )
+
+    unit_entities = []
+    for unit in text_units:
+        unit.id = text_unit_vocab.ids[text_unit_vocab.index[str(unit.id)]]
+        unit.entity_ids = _intern_ids(unit.entity_ids)
+        unit.relationship_ids = _intern_ids(unit.relationship_ids)
+        unit.document_ids = _intern_ids(unit.document_ids)
+        unit_entities.append(
+            [entity_row[id_] for id_ in unit.entity_ids or [] if id_ in entity_row]
+        )
+    entity_indptr, entity_indices = _csr(unit_entities)
+
+    return IndexColumns(
+        entities=EntityColumns(
+            ids=[entity.id for entity in entities],
+            row=entity_row,
+            title_row=title_row,
+            description_embeddings=embeddings,
+            has_description_embedding=has_embedding,
+            rank=np.array([entity.rank or 0 for entity in entities], dtype=np.int32),
+            text_unit_indptr=text_unit_indptr,
+            text_unit_indices=text_unit_indices,
+            community_indptr=community_indptr,
+            community_indices=community_indices,
+            relationship_indptr=relationship_indptr,
+            relationship_indices=relationship_indices,
+        ),
+        relationships=RelationshipColumns(
+            ids=[relationship.id for relationship in relationships],
+            source=source,
+            target=target,
+            weight=weight,
+            rank=rank,
+        ),
+        text_units=TextUnitColumns(
+            ids=[unit.id for unit in text_units],
+            row={unit.id: row for row, unit in enumerate(text_units)},
+            n_tokens=np.array(
+                [unit.n_tokens or 0 for unit in text_units], dtype=np.int32
+            ),
+            entity_indptr=entity_indptr,
+            entity_indices=entity_indices,
+        ),
+        text_unit_ids=text_unit_vocab.ids,
+        community_ids=community_vocab.ids,
+    )
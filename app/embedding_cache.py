@@ -0,0 +1,303 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any
+
+import numpy as np
+from tenacity import (
+    AsyncRetrying,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
+
+from graphrag.query.llm.base import BaseTextEmbedding
+from graphrag.query.llm.oai.embedding import OpenAIEmbedding
+
+from clients import get_text_embedder
+from metrics import incr, record_cache_lookup
+from rate_limit import on_event_loop
+
+log = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_PATH = os.environ.get(
+    "GRAPHRAG_EMBEDDING_CACHE_PATH", "./cache/query_embeddings.sqlite"
+)
+EMBEDDING_CACHE_MAX_ENTRIES = int(
+    os.environ.get("GRAPHRAG_EMBEDDING_CACHE_MAX_ENTRIES", 50_000)
+)
+# most recently used vectors are also kept in process
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(
+    os.environ.get("GRAPHRAG_EMBEDDING_CACHE_MEMORY_ENTRIES", 1024)
+)
+# embedding requests made within this window on one event loop go out as one API call
+EMBEDDING_BATCH_WINDOW_MS = float(
+    os.environ.get("GRAPHRAG_EMBEDDING_BATCH_WINDOW_MS", 5)
+)
+EMBEDDING_BATCH_MAX_SIZE = int(os.environ.get("GRAPHRAG_EMBEDDING_BATCH_MAX_SIZE", 64))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS embeddings_accessed_at ON embeddings (accessed_at);
+"""
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _unit(vector) -> np.ndarray | None:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector) if vector.size else 0.0
+    if not norm or not np.isfinite(norm):
+        # failed embeddings come back empty or as NaN, never keep those
+        return None
+    return vector / norm
+
+
+class EmbeddingCache:
+    """SQLite-backed text embedding cache with LRU eviction and an in-process LRU in front."""
+
+    def __init__(
+        self,
+        path: str = EMBEDDING_CACHE_PATH,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+        memory_entries: int = EMBEDDING_CACHE_MEMORY_ENTRIES,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    with sqlite3.connect(self.path, timeout=30) as conn:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.executescript(_SCHEMA)
+                    self._initialized = True
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get_memory(self, key: str) -> np.ndarray | None:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+            return vector
+
+    def get(self, key: str) -> np.ndarray | None:
+        vector = self.get_memory(key)
+        if vector is not None or self.max_entries <= 0:
+            return vector
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute(
+                    "SELECT vector FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute(
+                    "UPDATE embeddings SET accessed_at = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+        finally:
+            conn.close()
+        vector = np.frombuffer(row[0], dtype=np.float32)
+        self._remember(key, vector)
+        return vector
+
+    def set(self, key: str, model: str, vector: np.ndarray):
+        self._remember(key, vector)
+        if self.max_entries <= 0:
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)",
+                    (key, model, vector.tobytes(), time.time()),
+                )
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    " SELECT key FROM embeddings ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        finally:
+            conn.close()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM embeddings")
+        finally:
+            conn.close()
+
+
+class EmbeddingBatcher:
+    """Sends the texts embedded within a short window on one event loop as a single request.
+
+    Each caller awaits its own vector. Texts longer than the model's input limit
+    are left to OpenAIEmbedding.aembed, which chunks and averages them.
+    """
+
+    def __init__(
+        self,
+        window: float = EMBEDDING_BATCH_WINDOW_MS / 1000,
+        max_size: int = EMBEDDING_BATCH_MAX_SIZE,
+    ):
+        self.window = window
+        self.max_size = max_size
+        self._pending: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, list[tuple[str, asyncio.Future]]
+        ] = weakref.WeakKeyDictionary()
+        self._tasks: set[asyncio.Task] = set()
+
+    async def embed(self, embedder: OpenAIEmbedding, text: str) -> list[float]:
+        if len(text) > embedder.max_tokens and (
+            len(embedder.token_encoder.encode(text)) > embedder.max_tokens
+        ):
+            return await embedder.aembed(text)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(loop, [])
+        pending.append((text, future))
+        if len(pending) >= self.max_size:
+            self._flush(loop)
+        elif len(pending) == 1:
+            loop.call_later(self.window, self._flush, loop)
+        return await future
+
+    def _flush(self, loop: asyncio.AbstractEventLoop):
+        batch = self._pending.pop(loop, None)
+        if batch:
+            task = loop.create_task(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: list[tuple[str, asyncio.Future]]):
+        # looked up on this loop so the pooled async client is bound to it
+        embedder = get_text_embedder()
+        try:
+            vectors = await self._create(embedder, [text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        incr("embedding_batches")
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    @staticmethod
+    async def _create(
+        embedder: OpenAIEmbedding, texts: list[str]
+    ) -> list[list[float]]:
+        retryer = AsyncRetrying(
+            stop=stop_after_attempt(embedder.max_retries),
+            wait=wait_exponential_jitter(max=10),
+            reraise=True,
+            retry=retry_if_exception_type(embedder.retry_error_types),
+        )
+        async for attempt in retryer:
+            with attempt:
+                response = await embedder.async_client.embeddings.create(
+                    input=texts, model=embedder.model
+                )
+                return [
+                    item.embedding
+                    for item in sorted(response.data, key=lambda item: item.index)
+                ]
+        return []
+
+
+class CachedTextEmbedding(BaseTextEmbedding):
+    """The pooled text embedder behind the embedding cache and request batcher.
+
+    Texts are embedded after whitespace normalization, so a cached and a fresh
+    embedding of the same question are identical.
+    """
+
+    def __init__(
+        self,
+        cache: EmbeddingCache | None = None,
+        batcher: EmbeddingBatcher | None = None,
+    ):
+        self.cache = cache or EmbeddingCache()
+        self.batcher = batcher or EmbeddingBatcher()
+
+    def embed(self, text: str, **kwargs: Any) -> list[float]:
+        embedder = get_text_embedder()
+        text = normalize_text(text)
+        key = self.cache.key(embedder.model, text)
+        vector = self.cache.get(key)
+        record_cache_lookup("embedding", vector is not None)
+        if vector is None:
+            if on_event_loop():
+                # the sync client's retries and rate limit waits would block every
+                # query on the loop, callers await aembed for the text beforehand
+                raise RuntimeError("Text was not embedded before use on the event loop")
+            vector = _unit(embedder.embed(text, **kwargs))
+            if vector is None:
+                return []
+            self.cache.set(key, embedder.model, vector)
+        return vector.tolist()
+
+    async def aembed(self, text: str, **kwargs: Any) -> list[float]:
+        embedder = get_text_embedder()
+        text = normalize_text(text)
+        key = self.cache.key(embedder.model, text)
+        vector = self.cache.get_memory(key)
+        if vector is None:
+            vector = await asyncio.to_thread(self.cache.get, key)
+        record_cache_lookup("embedding", vector is not None)
+        if vector is None:
+            vector = _unit(await self.batcher.embed(embedder, text))
+            if vector is None:
+                return []
+            await asyncio.to_thread(self.cache.set, key, embedder.model, vector)
+        return vector.tolist()
+
+
+_lock = threading.Lock()
+_cached_text_embedder: CachedTextEmbedding | None = None
+
+
+def get_cached_text_embedder() -> CachedTextEmbedding:
+    """The process-wide cached and batched text embedder."""
+    global _cached_text_embedder
+    with _lock:
+        if _cached_text_embedder is None:
+            _cached_text_embedder = CachedTextEmbedding()
+        return _cached_text_embedder
@@ -0,0 +1,305 @@
+import json
+import threading
+from collections import OrderedDict
+from collections.abc import Collection
+from typing import Any
+
+import pandas as pd
+import tiktoken
+
+from graphrag.model import CommunityReport, Entity
+from graphrag.query.context_builder.community_context import (
+    _compute_community_weights,
+    build_community_context,
+)
+from graphrag.query.context_builder.conversation_history import ConversationHistory
+from graphrag.query.structured_search.global_search.community_context import (
+    GlobalCommunityContext,
+)
+
+from artifact_store import IndexArtifacts
+from columnar import IndexColumns
+from memory_size import approx_size
+from metrics import timed
+
+# batch sets kept per context builder, one per parameter set and report selection
+MAX_CACHED_BATCH_SETS = 256
+
+
+def _community_weights(
+    community_reports: list[CommunityReport],
+    columns: IndexColumns,
+    weight_attribute: str,
+    normalize: bool,
+) -> list[CommunityReport]:
+    """_compute_community_weights over the entity index arrays instead of the entity objects."""
+    counts = columns.community_text_unit_counts()
+    for report in community_reports:
+        if not report.attributes:
+            report.attributes = {}
+        report.attributes[weight_attribute] = counts.get(report.community_id, 0)
+    if normalize:
+        max_weight = max(
+            report.attributes[weight_attribute] for report in community_reports
+        )
+        for report in community_reports:
+            report.attributes[weight_attribute] /= max_weight
+    return community_reports
+
+
+class DeterministicGlobalCommunityContext(GlobalCommunityContext):
+    """GlobalCommunityContext with stable report order and memoized report batches.
+
+    With shuffle_data=False, reports are ordered by rank and then community weight.
+    The batch strings for a given set of context parameters are built and
+    token-counted once, then reused on every query, so map prompts are
+    byte-identical across queries. A report_ids selection keeps that order and
+    is memoized the same way. shuffle_data=True keeps the upstream behaviour.
+    """
+
+    def __init__(
+        self,
+        community_reports: list[CommunityReport],
+        entities: list[Entity] | None = None,
+        token_encoder: tiktoken.Encoding | None = None,
+        random_state: int = 86,
+        columns: IndexColumns | None = None,
+    ):
+        super().__init__(
+            community_reports=community_reports,
+            entities=entities,
+            token_encoder=token_encoder,
+            random_state=random_state,
+        )
+        self.columns = columns
+        self._lock = threading.Lock()
+        self._batches: OrderedDict[
+            str, tuple[list[str], dict[str, pd.DataFrame]]
+        ] = OrderedDict()
+        self._batch_bytes: dict[str, int] = {}
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate size of the memoized batch strings and tables."""
+        # no lock, it is held while a batch set is built
+        return sum(list(self._batch_bytes.values()))
+
+    def _ordered_reports(
+        self,
+        include_community_weight: bool,
+        community_weight_name: str,
+        normalize_community_weight: bool,
+    ) -> list[CommunityReport]:
+        reports = self.community_reports
+        if (
+            self.entities
+            and reports
+            and include_community_weight
+            and (
+                reports[0].attributes is None
+                or community_weight_name not in reports[0].attributes
+            )
+        ):
+            if self.columns is not None:
+                reports = _community_weights(
+                    reports,
+                    self.columns,
+                    community_weight_name,
+                    normalize_community_weight,
+                )
+            else:
+                reports = _compute_community_weights(
+                    community_reports=reports,
+                    entities=self.entities,
+                    weight_attribute=community_weight_name,
+                    normalize=normalize_community_weight,
+                )
+
+        def _weight(report: CommunityReport) -> float:
+            if not report.attributes:
+                return 0.0
+            return float(report.attributes.get(community_weight_name) or 0.0)
+
+        return sorted(
+            reports,
+            key=lambda report: (-(report.rank or 0.0), -_weight(report), report.id),
+        )
+
+    def community_batches(
+        self,
+        use_community_summary: bool = True,
+        column_delimiter: str = "|",
+        include_community_rank: bool = False,
+        min_community_rank: int = 0,
+        community_rank_name: str = "rank",
+        include_community_weight: bool = True,
+        community_weight_name: str = "occurrence",
+        normalize_community_weight: bool = True,
+        max_tokens: int = 8000,
+        context_name: str = "Reports",
+        report_ids: Collection[str] | None = None,
+    ) -> tuple[list[str], dict[str, pd.DataFrame]]:
+        """Report batches for these parameters and reports, built on first use and then reused."""
+        params = {
+            "use_community_summary": use_community_summary,
+            "column_delimiter": column_delimiter,
+            "include_community_rank": include_community_rank,
+            "min_community_rank": min_community_rank,
+            "community_rank_name": community_rank_name,
+            "include_community_weight": include_community_weight,
+            "community_weight_name": community_weight_name,
+            "normalize_community_weight": normalize_community_weight,
+            "max_tokens": max_tokens,
+            "context_name": context_name,
+        }
+        key = json.dumps(
+            {
+                **params,
+                "report_ids": sorted(report_ids) if report_ids is not None else None,
+            },
+            sort_keys=True,
+        )
+        with self._lock:
+            batches = self._batches.get(key)
+            if batches is not None:
+                self._batches.move_to_end(key)
+                return batches
+
+            reports = self._ordered_reports(
+                include_community_weight,
+                community_weight_name,
+                normalize_community_weight,
+            )
+            if report_ids is not None:
+                report_ids = set(report_ids)
+                reports = [report for report in reports if report.id in report_ids]
+            community_context, community_context_data = build_community_context(
+                community_reports=reports,
+                entities=self.entities,
+                token_encoder=self.token_encoder,
+                shuffle_data=False,
+                single_batch=False,
+                random_state=self.random_state,
+                **params,
+            )
+            if isinstance(community_context, str):
+                community_context = [community_context]
+            batches = (community_context, community_context_data)
+            self._batches[key] = batches
+            self._batch_bytes[key] = approx_size(batches, records=False)
+            while len(self._batches) > MAX_CACHED_BATCH_SETS:
+                self._batch_bytes.pop(self._batches.popitem(last=False)[0])
+            return batches
+
+    @timed("context_build")
+    def build_context(
+        self,
+        conversation_history: ConversationHistory | None = None,
+        use_community_summary: bool = True,
+        column_delimiter: str = "|",
+        shuffle_data: bool = True,
+        include_community_rank: bool = False,
+        min_community_rank: int = 0,
+        community_rank_name: str = "rank",
+        include_community_weight: bool = True,
+        community_weight_name: str = "occurrence",
+        normalize_community_weight: bool = True,
+        max_tokens: int = 8000,
+        context_name: str = "Reports",
+        conversation_history_user_turns_only: bool = True,
+        conversation_history_max_turns: int | None = 5,
+        report_ids: Collection[str] | None = None,
+        **kwargs: Any,
+    ) -> tuple[str | list[str], dict[str, pd.DataFrame]]:
+        # a report selection only applies to the memoized batches
+        if shuffle_data:
+            return super().build_context(
+                conversation_history=conversation_history,
+                use_community_summary=use_community_summary,
+                column_delimiter=column_delimiter,
+                shuffle_data=shuffle_data,
+                include_community_rank=include_community_rank,
+                min_community_rank=min_community_rank,
+                community_rank_name=community_rank_name,
+                include_community_weight=include_community_weight,
+                community_weight_name=community_weight_name,
+                normalize_community_weight=normalize_community_weight,
+                max_tokens=max_tokens,
+                context_name=context_name,
+                conversation_history_user_turns_only=conversation_history_user_turns_only,
+                conversation_history_max_turns=conversation_history_max_turns,
+                **kwargs,
+            )
+
+        conversation_history_context = ""
+        final_context_data = {}
+        if conversation_history:
+            # build conversation history context
+            (
+                conversation_history_context,
+                conversation_history_context_data,
+            ) = conversation_history.build_context(
+                include_user_turns_only=conversation_history_user_turns_only,
+                max_qa_turns=conversation_history_max_turns,
+                column_delimiter=column_delimiter,
+                max_tokens=max_tokens,
+                recency_bias=False,
+            )
+            if conversation_history_context != "":
+                final_context_data = conversation_history_context_data
+
+        community_context, community_context_data = self.community_batches(
+            use_community_summary=use_community_summary,
+            column_delimiter=column_delimiter,
+            include_community_rank=include_community_rank,
+            min_community_rank=min_community_rank,
+            community_rank_name=community_rank_name,
+            include_community_weight=include_community_weight,
+            community_weight_name=community_weight_name,
+            normalize_community_weight=normalize_community_weight,
+            max_tokens=max_tokens,
+            context_name=context_name,
+            report_ids=report_ids,
+        )
+        final_context = [
+            f"{conversation_history_context}\n\n{context}"
+            for context in community_context
+        ]
+        final_context_data.update(community_context_data)
+        return (final_context, final_context_data)
+
+
+_lock = threading.Lock()
+_context_builders: dict[
+    tuple[str, int], tuple[str, DeterministicGlobalCommunityContext]
+] = {}
+
+
+def get_global_context_builder(
+    artifacts: IndexArtifacts, token_encoder: tiktoken.Encoding
+) -> DeterministicGlobalCommunityContext:
+    """One context builder per artifact version, so its report batches are computed once."""
+    key = (artifacts.input_dir, artifacts.community_level)
+    with _lock:
+        cached = _context_builders.get(key)
+        if cached is None or cached[0] != artifacts.version:
+            context_builder = DeterministicGlobalCommunityContext(
+                community_reports=artifacts.global_reports(),
+                entities=artifacts.entities,  # default to None if you don't want to use community weights for ranking
+                token_encoder=token_encoder,
+                columns=artifacts.columns,
+            )
+            cached = (artifacts.version, context_builder)
+            _context_builders[key] = cached
+        return cached[1]
+
+
+def global_context_builder_nbytes(input_dir: str, community_level: int) -> int:
+    with _lock:
+        cached = _context_builders.get((input_dir, community_level))
+    return cached[1].nbytes if cached is not None else 0
+
+
+def evict_global_context_builder(input_dir: str, community_level: int):
+    with _lock:
+        _context_builders.pop((input_dir, community_level), None)
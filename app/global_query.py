@@ -1,23 +1,117 @@
-import os
-import pandas as pd
-import tiktoken
-
-from graphrag.query.indexer_adapters import read_indexer_entities, read_indexer_reports
-from graphrag.query.llm.oai.chat_openai import ChatOpenAI
-from graphrag.query.llm.oai.typing import OpenaiApiType
-from graphrag.query.structured_search.global_search.community_context import (
-    GlobalCommunityContext,
-)
-from graphrag.query.structured_search.global_search.search import GlobalSearch
-import streamlit as st
-
+from collections.abc import AsyncIterator, Collection
+
+from answer_cache import answer_cache, answer_namespace
+from artifact_store import IndexArtifacts
+from clients import get_chat_llm, get_token_encoder
+from global_context import get_global_context_builder
+from index_registry import aget_index
+from map_cache import CachedGlobalSearch
+from metrics import QueryMetrics, stage
+from report_filter import GLOBAL_REPORT_FILTER, report_filter_params, select_reports
+from streaming import stream_search
+from token_counts import get_precounted_encoder
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
 
-async def execute_global_query(question: str, mock=True):
+context_builder_params = {
+    "use_community_summary": False,  # False means using full community reports. True means using community short summaries.
+    "shuffle_data": False,  # False keeps a stable report order and reuses the precomputed report batches
+    "include_community_rank": True,
+    "min_community_rank": 0,
+    "community_rank_name": "rank",
+    "include_community_weight": True,
+    "community_weight_name": "occurrence weight",
+    "normalize_community_weight": True,
+    "max_tokens": 12_000,  # change this based on the token limit you have on your model (if you are using a model with 8k limit, a good setting could be 5000)
+    "context_name": "Reports",
+}
+
+map_llm_params = {
+    "max_tokens": 1000,
+    "temperature": 0.0,
+    "response_format": {"type": "json_object"},
+}
+
+reduce_llm_params = {
+    "max_tokens": 2000,  # change this based on the token limit you have on your model (if you are using a model with 8k limit, a good setting could be 1000-1500)
+    "temperature": 0.0,
+}
+
+search_params = {
+    "max_data_tokens": 12_000,  # change this based on the token limit you have on your model (if you are using a model with 8k limit, a good setting could be 5000)
+    "allow_general_knowledge": False,  # set this to True will add instruction to encourage the LLM to incorporate general knowledge in the response, which may increase hallucinations, but could be useful in some use cases.
+    "json_mode": True,  # set this to False if your LLM model does not support JSON mode.
+    "concurrent_coroutines": 32,
+    "response_type": "single paragraph",  # free form text describing the response type and format, can be anything, e.g. prioritized list, single paragraph, multiple paragraphs, multiple-page report
+}
+
+
+def build_global_search(
+    artifacts: IndexArtifacts, report_ids: Collection[str] | None = None
+) -> CachedGlobalSearch:
+    # shared, connection-pooled client and encoder for the whole process
+    llm = get_chat_llm()
+    token_encoder = get_token_encoder()
+
+    # reports are ordered by rank and weight and batched once per artifact version,
+    # so map prompts are identical from one query to the next; report rows are
+    # measured with the token counts precomputed for this index run
+    context_builder = get_global_context_builder(
+        artifacts, get_precounted_encoder(artifacts)
+    )
+
+    # map answers are reused across queries for identical report batches and questions
+    return CachedGlobalSearch(
+        llm=llm,
+        context_builder=context_builder,
+        token_encoder=token_encoder,
+        map_llm_params=map_llm_params,
+        reduce_llm_params=reduce_llm_params,
+        # report_ids limits the map phase to the reports picked for the question
+        context_builder_params=(
+            context_builder_params
+            if report_ids is None
+            else {**context_builder_params, "report_ids": report_ids}
+        ),
+        **search_params,
+    )
+
+
+def global_cache_namespace(artifacts: IndexArtifacts) -> str:
+    return answer_namespace(
+        artifacts,
+        "global",
+        get_chat_llm().model,
+        {
+            "context_builder_params": context_builder_params,
+            "map_llm_params": map_llm_params,
+            "reduce_llm_params": reduce_llm_params,
+            "search_params": search_params,
+            "report_filter": report_filter_params(),
+        },
+    )
+
+
+async def select_question_reports(
+    artifacts: IndexArtifacts, question: str
+) -> Collection[str] | None:
+    """Reports to map for question with GRAPHRAG_GLOBAL_REPORT_FILTER=1, otherwise None for all of them."""
+    if not GLOBAL_REPORT_FILTER:
+        return None
+    with stage("report_filter"):
+        return await select_reports(artifacts, question)
+
+
+async def execute_global_query(
+    question: str,
+    mock=True,
+    use_cache=True,
+    metrics: QueryMetrics | None = None,
+    index_id: str | None = None,
+):
 
     if mock:
         result = {
@@ -33,95 +127,74 @@ async def execute_global_query(question: str, mock=True):
         }
 
     else:
-        api_key = os.environ["GRAPHRAG_API_KEY"]
-        llm_model = os.environ["GRAPHRAG_LLM_MODEL"]
-        # api_key = st.secrets["GRAPHRAG_API_KEY"]
-        # llm_model = st.secrets["GRAPHRAG_LLM_MODEL"]
-
-        llm = ChatOpenAI(
-            api_key=api_key,
-            model=llm_model,
-            api_type=OpenaiApiType.AzureOpenAI,  # OpenaiApiType.OpenAI or OpenaiApiType.OpenAI
-            api_base="https://theraflow-openai.openai.azure.com/openai/deployments/gpt-4o-mini/chat/completions?api-version=2024-02-15-preview",
-            api_version="2024-02-15-preview",
-            max_retries=20,
-        )
-
-        token_encoder = tiktoken.get_encoding("cl100k_base")
-
-        # parquet files generated from indexing pipeline
-        INPUT_DIR = "./output/20240825-115048/artifacts"
-        COMMUNITY_REPORT_TABLE = "create_final_community_reports"
-        ENTITY_TABLE = "create_final_nodes"
-        ENTITY_EMBEDDING_TABLE = "create_final_entities"
-
-        # community level in the Leiden community hierarchy from which we will load the community reports
-        # higher value means we use reports from more fine-grained communities (at the cost of higher computation cost)
-        COMMUNITY_LEVEL = 2
-
-        entity_df = pd.read_parquet(f"{INPUT_DIR}/{ENTITY_TABLE}.parquet")
-        report_df = pd.read_parquet(f"{INPUT_DIR}/{COMMUNITY_REPORT_TABLE}.parquet")
-        entity_embedding_df = pd.read_parquet(
-            f"{INPUT_DIR}/{ENTITY_EMBEDDING_TABLE}.parquet"
-        )
-
-        reports = read_indexer_reports(report_df, entity_df, COMMUNITY_LEVEL)
-        entities = read_indexer_entities(
-            entity_df, entity_embedding_df, COMMUNITY_LEVEL
-        )
-        print(f"Total report count: {len(report_df)}")
-        print(
-            f"Report count after filtering by community level {COMMUNITY_LEVEL}: {len(reports)}"
-        )
-        report_df.head()
-
-        context_builder = GlobalCommunityContext(
-            community_reports=reports,
-            entities=entities,  # default to None if you don't want to use community weights for ranking
-            token_encoder=token_encoder,
-        )
-
-        context_builder_params = {
-            "use_community_summary": False,  # False means using full community reports. True means using community short summaries.
-            "shuffle_data": True,
-            "include_community_rank": True,
-            "min_community_rank": 0,
-            "community_rank_name": "rank",
-            "include_community_weight": True,
-            "community_weight_name": "occurrence weight",
-            "normalize_community_weight": True,
-            "max_tokens": 12_000,  # change this based on the token limit you have on your model (if you are using a model with 8k limit, a good setting could be 5000)
-            "context_name": "Reports",
-        }
-
-        map_llm_params = {
-            "max_tokens": 1000,
-            "temperature": 0.0,
-            "response_format": {"type": "json_object"},
-        }
+        metrics = metrics or QueryMetrics()
+        metrics.search_type, metrics.question = "global", question
+
+        with metrics.activate():
+            with metrics.stage("load_artifacts"):
+                artifacts = await aget_index(index_id)
+
+            namespace = global_cache_namespace(artifacts)
+            if use_cache:
+                with metrics.stage("answer_cache"):
+                    result = await answer_cache.aget(namespace, question)
+                metrics.record_cache_lookup("answer", result is not None)
+                if result is not None:
+                    metrics.finish()
+                    return result
+
+            report_ids = await select_question_reports(artifacts, question)
+            with metrics.stage("build_search"):
+                search_engine = build_global_search(artifacts, report_ids)
+            with metrics.stage("search"):
+                result = await search_engine.asearch(question)
+
+            if use_cache:
+                await answer_cache.aset(namespace, question, result)
+        metrics.finish(result, get_token_encoder())
 
-        reduce_llm_params = {
-            "max_tokens": 2000,  # change this based on the token limit you have on your model (if you are using a model with 8k limit, a good setting could be 1000-1500)
-            "temperature": 0.0,
-        }
+    return result
 
-        search_engine = GlobalSearch(
-            llm=llm,
-            context_builder=context_builder,
-            token_encoder=token_encoder,
-            max_data_tokens=12_000,  # change this based on the token limit you have on your model (if you are using a model with 8k limit, a good setting could be 5000)
-            map_llm_params=map_llm_params,
-            reduce_llm_params=reduce_llm_params,
-            allow_general_knowledge=False,  # set this to True will add instruction to encourage the LLM to incorporate general knowledge in the response, which may increase hallucinations, but could be useful in some use cases.
-            json_mode=True,  # set this to False if your LLM model does not support JSON mode.
-            context_builder_params=context_builder_params,
-            concurrent_coroutines=32,
-            response_type="single paragraph",  # free form text describing the response type and format, can be anything, e.g. prioritized list, single paragraph, multiple paragraphs, multiple-page report
-        )
-
-        result = await search_engine.asearch(question)
 
-    return result
+async def stream_global_query(
+    question: str,
+    use_cache=True,
+    metrics: QueryMetrics | None = None,
+    index_id: str | None = None,
+) -> AsyncIterator[str]:
+    """Yield the reduce-phase tokens of a global search as the LLM generates them."""
+    metrics = metrics or QueryMetrics()
+    metrics.search_type, metrics.question = "global", question
+
+    # stages are only activated between yields, a generator may resume in another context
+    with metrics.activate():
+        with metrics.stage("load_artifacts"):
+            artifacts = await aget_index(index_id)
+
+        namespace = global_cache_namespace(artifacts)
+        result = None
+        if use_cache:
+            with metrics.stage("answer_cache"):
+                result = await answer_cache.aget(namespace, question)
+            metrics.record_cache_lookup("answer", result is not None)
+    if result is not None:
+        metrics.finish()
+        yield result.response
+        return
+
+    with metrics.activate():
+        report_ids = await select_question_reports(artifacts, question)
+        with metrics.stage("build_search"):
+            search_engine = build_global_search(artifacts, report_ids)
+
+    results = []
+    with metrics.stage("search"):
+        async for token in stream_search(search_engine, question, results, metrics):
+            yield token
+
+    if use_cache and results:
+        await answer_cache.aset(namespace, question, results[0])
+    metrics.finish(results[0] if results else None, get_token_encoder())
 
     # print(result.response)
 
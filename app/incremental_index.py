@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+from dataclasses import dataclass, field
+
+import networkx as nx
+import pandas as pd
+import yaml
+
+from graphrag.config import create_graphrag_config
+from graphrag.index import create_pipeline_config, run_pipeline_with_config
+from graphrag.index.config import (
+    PipelineConfig,
+    PipelineFileReportingConfig,
+    PipelineFileStorageConfig,
+)
+from graphrag.index.input import load_input
+from graphrag.index.verbs.graph.merge.merge_graphs import merge_edges, merge_nodes
+from graphrag.index.verbs.graph.merge.typing import DetailedAttributeMergeOperation
+
+from artifact_store import COMMUNITY_LEVEL, load_artifacts
+from clients import get_token_encoder
+from index_registry import (
+    INDEX_ROOT,
+    default_index_id,
+    index_input_dir,
+    set_default_index,
+)
+from token_counts import compute_token_counts, write_token_counts
+
+log = logging.getLogger(__name__)
+
+DOCUMENT_TABLE = "create_final_documents"
+BASE_TEXT_UNIT_TABLE = "create_base_text_units"
+EXTRACTED_GRAPH_TABLE = "create_base_extracted_entities"
+# chunking and entity extraction, the only workflows that read the documents
+EXTRACTION_WORKFLOWS = {BASE_TEXT_UNIT_TABLE, EXTRACTED_GRAPH_TABLE}
+
+# the merge operations of graphrag's create_base_extracted_entities workflow
+_NODE_OPS = {
+    "source_id": DetailedAttributeMergeOperation(
+        operation="concat", delimiter=", ", distinct=True
+    ),
+    "description": DetailedAttributeMergeOperation(
+        operation="concat", separator="\n", distinct=False
+    ),
+}
+_EDGE_OPS = {
+    **_NODE_OPS,
+    "weight": DetailedAttributeMergeOperation(operation="sum"),
+}
+
+
+@dataclass
+class InputChanges:
+    """Input documents by title compared with the ones an index run was built from."""
+
+    added: list[str] = field(default_factory=list)
+    changed: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+
+    @property
+    def additive(self) -> bool:
+        return not self.changed and not self.removed
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+
+def diff_documents(indexed: pd.DataFrame, current: pd.DataFrame) -> InputChanges:
+    """Compare documents by title and content hash.
+
+    graphrag's document id is the md5 of the document text, so an id that differs
+    for the same title means the file was edited.
+    """
+    indexed_ids = dict(zip(indexed["title"], indexed["id"]))
+    current_ids = dict(zip(current["title"], current["id"]))
+    return InputChanges(
+        added=sorted(set(current_ids) - set(indexed_ids)),
+        changed=sorted(
+            title
+            for title, id_ in current_ids.items()
+            if title in indexed_ids and indexed_ids[title] != id_
+        ),
+        removed=sorted(set(indexed_ids) - set(current_ids)),
+    )
+
+
+def merge_extracted_graphs(graphml: str, new_graphml: str) -> str:
+    """Merge the entity graph extracted from new documents into an existing one.
+
+    Entities and relationships are merged by name as graphrag merges the graphs of
+    individual chunks; existing nodes and edges keep their order, so entity and
+    relationship ids of the communities the new documents do not touch are stable.
+    """
+    graph = nx.parse_graphml(graphml)
+    new_graph = nx.parse_graphml(new_graphml)
+    merge_nodes(graph, new_graph, _NODE_OPS)
+    merge_edges(graph, new_graph, _EDGE_OPS)
+    return "\n".join(nx.generate_graphml(graph))
+
+
+def load_settings(root: str = "."):
+    with open(os.path.join(root, "settings.yaml"), "rb") as file:
+        return create_graphrag_config(yaml.safe_load(file), root)
+
+
+def _pipeline_config(
+    settings, run_dir: str, workflows: set[str] | None = None
+) -> PipelineConfig:
+    config = create_pipeline_config(settings)
+    # file storage paths are relative to the working directory, not root_dir
+    config.storage = PipelineFileStorageConfig(
+        base_dir=os.path.abspath(os.path.join(run_dir, "artifacts"))
+    )
+    config.reporting = PipelineFileReportingConfig(
+        base_dir=os.path.abspath(os.path.join(run_dir, "reports"))
+    )
+    if workflows is not None:
+        config.workflows = [w for w in config.workflows if w.name in workflows]
+    return config
+
+
+async def _run_pipeline(
+    config: PipelineConfig, dataset: pd.DataFrame, run_id: str, resume=False
+):
+    # the LLM calls go through the file cache in settings.yaml, so prompts an
+    # earlier run already sent (unchanged chunks, entity descriptions and
+    # communities) are answered from the cache
+    async for output in run_pipeline_with_config(
+        config, dataset=dataset, run_id=run_id, is_resume_run=resume
+    ):
+        if output.errors:
+            raise RuntimeError(
+                f"Indexing workflow {output.workflow} failed: {output.errors[0]}"
+            )
+        log.info("Finished %s", output.workflow)
+
+
+async def update_index(
+    base_index_id: str | None = None,
+    root: str = ".",
+    run_id: str | None = None,
+    switch=True,
+) -> str | None:
+    """Build a new index run from base_index_id plus the input documents that changed since.
+
+    Only new documents are chunked and extracted when files were just added, and
+    their entity graph is merged into the existing one. Edited or deleted files
+    cannot be taken back out of the merged graph, so then every document is
+    re-extracted, with unchanged chunks answered from the cache. Summaries,
+    communities, reports and embeddings are then rebuilt over the merged graph;
+    the LLM is only called for entities and communities whose inputs changed.
+
+    The run is built in a staging directory, renamed into INDEX_ROOT when it is
+    complete and, with switch, made the default index. Returns the new index id,
+    or None when the input is unchanged.
+    """
+    base_index_id = base_index_id or default_index_id()
+    base_dir = index_input_dir(base_index_id)
+    settings = load_settings(root)
+    documents = await load_input(
+        create_pipeline_config(settings).input, root_dir=root
+    )
+    indexed = pd.read_parquet(os.path.join(base_dir, f"{DOCUMENT_TABLE}.parquet"))
+    changes = diff_documents(indexed, documents)
+    if not changes:
+        print(f"{base_index_id} is up to date with {len(documents)} documents")
+        return None
+    print(
+        f"Updating {base_index_id}: {len(changes.added)} added, "
+        f"{len(changes.changed)} changed, {len(changes.removed)} removed"
+    )
+
+    run_id = run_id or time.strftime("%Y%m%d-%H%M%S")
+    run_dir = os.path.join(INDEX_ROOT, run_id)
+    if os.path.exists(run_dir):
+        raise ValueError(f"Index {run_id} already exists")
+    # dot directories are not listed as indexes
+    staging_dir = os.path.join(INDEX_ROOT, f".{run_id}")
+    delta_dir = os.path.join(staging_dir, "delta")
+    artifacts_dir = os.path.join(staging_dir, "artifacts")
+    try:
+        if changes.additive:
+            extract = documents[documents["title"].isin(changes.added)]
+        else:
+            extract = documents
+        await _run_pipeline(
+            _pipeline_config(settings, delta_dir, EXTRACTION_WORKFLOWS),
+            extract,
+            run_id,
+        )
+        text_units = pd.read_parquet(
+            os.path.join(delta_dir, "artifacts", f"{BASE_TEXT_UNIT_TABLE}.parquet")
+        )
+        graph = pd.read_parquet(
+            os.path.join(delta_dir, "artifacts", f"{EXTRACTED_GRAPH_TABLE}.parquet")
+        )
+        if changes.additive:
+            text_units = pd.concat(
+                [
+                    pd.read_parquet(
+                        os.path.join(base_dir, f"{BASE_TEXT_UNIT_TABLE}.parquet")
+                    ),
+                    text_units,
+                ],
+                ignore_index=True,
+            )
+            base_graph = pd.read_parquet(
+                os.path.join(base_dir, f"{EXTRACTED_GRAPH_TABLE}.parquet")
+            )
+            graph = pd.DataFrame(
+                {
+                    "entity_graph": [
+                        merge_extracted_graphs(
+                            base_graph["entity_graph"][0], graph["entity_graph"][0]
+                        )
+                    ]
+                }
+            )
+
+        # the resumed run skips workflows whose table is already in storage and
+        # runs everything downstream of extraction over the merged tables
+        os.makedirs(artifacts_dir, exist_ok=True)
+        text_units.to_parquet(
+            os.path.join(artifacts_dir, f"{BASE_TEXT_UNIT_TABLE}.parquet")
+        )
+        graph.to_parquet(
+            os.path.join(artifacts_dir, f"{EXTRACTED_GRAPH_TABLE}.parquet")
+        )
+        shutil.rmtree(delta_dir)
+        await _run_pipeline(
+            _pipeline_config(settings, staging_dir), documents, run_id, resume=True
+        )
+
+        # ship the query-time token counts with the run
+        artifacts = load_artifacts(artifacts_dir, COMMUNITY_LEVEL)
+        token_encoder = get_token_encoder()
+        write_token_counts(
+            artifacts, token_encoder, compute_token_counts(artifacts, token_encoder)
+        )
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    os.rename(staging_dir, run_dir)
+    print(f"Wrote index {run_id}")
+    if switch:
+        # queries already running finish on the old index, the next ones load this run
+        set_default_index(run_id)
+        print(f"Switched the default index to {run_id}")
+    return run_id
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="index new and edited input files on top of an existing index run, run from the repository root"
+    )
+    parser.add_argument(
+        "--index", dest="base_index_id", help="index run to update, defaults to the default index"
+    )
+    parser.add_argument("--run-id", dest="run_id", help="id of the new index run")
+    parser.add_argument(
+        "--no-switch",
+        dest="switch",
+        action="store_false",
+        help="build the run without making it the default index",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(update_index(args.base_index_id, run_id=args.run_id, switch=args.switch))
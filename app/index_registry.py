@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from artifact_store import COMMUNITY_LEVEL, INPUT_DIR, IndexArtifacts, artifact_store
+from global_context import (
+    evict_global_context_builder,
+    get_global_context_builder,
+    global_context_builder_nbytes,
+)
+from local_context import evict_session_caches, session_caches_nbytes
+from memory_size import approx_size
+from report_filter import evict_report_index, report_index_nbytes
+from token_counts import (
+    evict_precounted_encoder,
+    get_precounted_encoder,
+    precounted_encoder_nbytes,
+)
+from vector_index import (
+    evict_entity_vector_store,
+    evict_memory_vector_store,
+    get_entity_store,
+    lancedb_uri,
+    memory_vector_store_nbytes,
+)
+
+log = logging.getLogger(__name__)
+
+# every index run lives in {INDEX_ROOT}/{index_id}/artifacts, e.g. one run per patient
+INDEX_ROOT = os.environ.get(
+    "GRAPHRAG_INDEX_ROOT", os.path.dirname(os.path.dirname(INPUT_DIR))
+)
+DEFAULT_INDEX_ID = os.environ.get(
+    "GRAPHRAG_DEFAULT_INDEX", os.path.basename(os.path.dirname(INPUT_DIR))
+)
+# names the index run queries default to, rewritten by incremental_index.py after
+# each update; GRAPHRAG_DEFAULT_INDEX pins the default and ignores it
+CURRENT_INDEX_FILE = os.path.join(INDEX_ROOT, "CURRENT")
+# loaded indexes are evicted least recently used first beyond either bound, the
+# bytes count the parsed artifacts and the per-index caches built from them
+INDEX_CACHE_MAX_BYTES = int(os.environ.get("GRAPHRAG_INDEX_CACHE_MAX_MB", 2048)) << 20
+INDEX_CACHE_MAX_INDEXES = int(os.environ.get("GRAPHRAG_INDEX_CACHE_MAX_INDEXES", 32))
+
+
+def index_input_dir(index_id: str) -> str:
+    if not index_id or os.path.basename(index_id) != index_id or index_id.startswith("."):
+        raise ValueError(f"Invalid index id: {index_id!r}")
+    return os.path.join(INDEX_ROOT, index_id, "artifacts")
+
+
+def list_indexes() -> list[str]:
+    """Ids of the index runs under INDEX_ROOT, newest first."""
+    if not os.path.isdir(INDEX_ROOT):
+        return []
+    return sorted(
+        (
+            name
+            for name in os.listdir(INDEX_ROOT)
+            # runs still being built are staged in dot directories
+            if not name.startswith(".")
+            and os.path.isdir(os.path.join(INDEX_ROOT, name, "artifacts"))
+        ),
+        reverse=True,
+    )
+
+
+def default_index_id() -> str:
+    """The index run queries without an index id go to, read on every call so an update switches it live."""
+    if "GRAPHRAG_DEFAULT_INDEX" not in os.environ:
+        try:
+            with open(CURRENT_INDEX_FILE) as file:
+                index_id = file.read().strip()
+            if index_id:
+                return index_id
+        except FileNotFoundError:
+            pass
+    return DEFAULT_INDEX_ID
+
+
+def set_default_index(index_id: str):
+    """Point the default index at index_id, readers see either the old or the new id."""
+    if not os.path.isdir(index_input_dir(index_id)):
+        raise ValueError(f"Unknown index: {index_id}")
+    tmp_path = f"{CURRENT_INDEX_FILE}.tmp"
+    with open(tmp_path, "w") as file:
+        file.write(index_id + "\n")
+    os.replace(tmp_path, CURRENT_INDEX_FILE)
+
+
+def estimate_artifact_bytes(artifacts: IndexArtifacts) -> int:
+    # interned ids shared between records are counted once per record, so this
+    # errs on the high side
+    return approx_size(artifacts.columns) + sum(
+        approx_size(record)
+        for records in (
+            artifacts.entities,
+            artifacts.relationships,
+            artifacts.reports,
+            artifacts.text_units,
+        )
+        for record in records
+    )
+
+
+def estimate_cache_bytes(input_dir: str, community_level: int) -> int:
+    """Size of the per-index caches queries built from the artifacts so far."""
+    return sum(
+        nbytes(input_dir, community_level)
+        for nbytes in (
+            memory_vector_store_nbytes,
+            global_context_builder_nbytes,
+            precounted_encoder_nbytes,
+            report_index_nbytes,
+            session_caches_nbytes,
+        )
+    )
+
+
+@dataclass
+class ResidentIndex:
+    index_id: str
+    input_dir: str
+    version: str
+    # parsed artifacts, fixed once loaded
+    artifact_bytes: int
+    # caches built from them since, refreshed whenever an index is used
+    cache_bytes: int = 0
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.artifact_bytes + self.cache_bytes
+
+
+class IndexRegistry:
+    """Loads index runs on first use and keeps a memory-bounded LRU of them resident.
+
+    The memory bound covers the parsed artifacts and the caches built from them.
+    Evicting an index drops its parsed artifacts, open LanceDB table, vector
+    store, token counts, global report batches, report vectors and session caches
+    from the process caches; queries already holding them finish normally and
+    the memory is freed afterwards.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = INDEX_CACHE_MAX_BYTES,
+        max_indexes: int = INDEX_CACHE_MAX_INDEXES,
+        community_level: int = COMMUNITY_LEVEL,
+    ):
+        self.max_bytes = max_bytes
+        self.max_indexes = max_indexes
+        self.community_level = community_level
+        self._lock = threading.Lock()
+        self._resident: OrderedDict[str, ResidentIndex] = OrderedDict()
+
+    def get(self, index_id: str | None = None) -> IndexArtifacts:
+        index_id = index_id or default_index_id()
+        input_dir = index_input_dir(index_id)
+        artifacts = artifact_store.get(input_dir, self.community_level)
+
+        with self._lock:
+            resident = self._resident.get(index_id)
+            if resident is None or resident.version != artifacts.version:
+                self._resident[index_id] = ResidentIndex(
+                    index_id=index_id,
+                    input_dir=input_dir,
+                    version=artifacts.version,
+                    artifact_bytes=estimate_artifact_bytes(artifacts),
+                )
+            self._resident.move_to_end(index_id)
+            residents = list(self._resident.values())
+
+        # the caches of an index grow while it is queried, e.g. with new sessions
+        for resident in residents:
+            resident.cache_bytes = estimate_cache_bytes(
+                resident.input_dir, self.community_level
+            )
+        with self._lock:
+            evicted = self._evict_over_budget()
+
+        for resident in evicted:
+            self._drop(resident)
+        return artifacts
+
+    def _evict_over_budget(self) -> list[ResidentIndex]:
+        # the index just used is last and is never evicted
+        evicted = []
+        while len(self._resident) > 1 and (
+            len(self._resident) > self.max_indexes
+            or self.memory_bytes() > self.max_bytes
+        ):
+            evicted.append(self._resident.popitem(last=False)[1])
+        return evicted
+
+    def _drop(self, resident: ResidentIndex):
+        log.info(
+            "Evicting index %s (%.1f MB)",
+            resident.index_id,
+            resident.memory_bytes / (1 << 20),
+        )
+        artifact_store.evict(resident.input_dir, self.community_level)
+        evict_entity_vector_store(lancedb_uri(resident.input_dir))
+        evict_memory_vector_store(resident.input_dir, self.community_level)
+        evict_precounted_encoder(resident.input_dir, self.community_level)
+        evict_global_context_builder(resident.input_dir, self.community_level)
+        evict_report_index(resident.input_dir, self.community_level)
+        evict_session_caches(resident.input_dir, self.community_level)
+
+    def evict(self, index_id: str):
+        with self._lock:
+            resident = self._resident.pop(index_id, None)
+        if resident is not None:
+            self._drop(resident)
+
+    def memory_bytes(self) -> int:
+        return sum(resident.memory_bytes for resident in self._resident.values())
+
+    def memory_usage(self) -> dict[str, int]:
+        """Estimated resident bytes per loaded index, least recently used first."""
+        with self._lock:
+            return {
+                index_id: resident.memory_bytes
+                for index_id, resident in self._resident.items()
+            }
+
+
+index_registry = IndexRegistry()
+
+
+def get_index(index_id: str | None = None) -> IndexArtifacts:
+    return index_registry.get(index_id)
+
+
+def load_index(index_id: str | None = None) -> IndexArtifacts:
+    """get_index plus the per-index search state the searches build from the artifacts."""
+    artifacts = get_index(index_id)
+    # entity store, precounted token counts and the global report context builder
+    get_entity_store(artifacts)
+    get_global_context_builder(artifacts, get_precounted_encoder(artifacts))
+    return artifacts
+
+
+# one load per index at a time on each event loop
+_load_locks: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, dict[str, asyncio.Lock]
+] = weakref.WeakKeyDictionary()
+
+
+async def aget_index(index_id: str | None = None) -> IndexArtifacts:
+    """load_index off the event loop, opening an index parses, hashes and precounts it."""
+    index_id = index_id or default_index_id()
+    locks = _load_locks.setdefault(asyncio.get_running_loop(), {})
+    async with locks.setdefault(index_id, asyncio.Lock()):
+        return await asyncio.to_thread(load_index, index_id)
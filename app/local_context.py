@@ -0,0 +1,706 @@
+import logging
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from collections.abc import Callable
+from dataclasses import replace
+from typing import Any, TypeVar, cast
+
+import numpy as np
+import pandas as pd
+
+from graphrag.model import Entity, Relationship, TextUnit
+from graphrag.query.context_builder.conversation_history import ConversationHistory
+from graphrag.query.context_builder.entity_extraction import (
+    EntityVectorStoreKey,
+    map_query_to_entities,
+)
+from graphrag.query.context_builder.local_context import build_entity_context
+from graphrag.query.context_builder.source_context import (
+    build_text_unit_context,
+    count_relationships,
+)
+from graphrag.query.input.retrieval.relationships import (
+    sort_relationships_by_ranking_attribute,
+)
+from graphrag.query.llm.text_utils import num_tokens
+from graphrag.query.structured_search.local_search.mixed_context import (
+    LocalSearchMixedContext,
+)
+
+from artifact_store import IndexArtifacts
+from columnar import IndexColumns
+from memory_size import approx_size
+from metrics import record_cache_lookup, timed
+
+log = logging.getLogger(__name__)
+
+# conversations whose context pieces are kept, the least recently used is dropped first
+MAX_SESSIONS = int(os.environ.get("GRAPHRAG_LOCAL_SESSIONS", 256))
+# context pieces kept per conversation
+MAX_SESSION_ENTRIES = 512
+
+T = TypeVar("T")
+
+
+def _filter_relationships(
+    selected_entities: list[Entity],
+    relationships: list[Relationship],
+    top_k_relationships: int = 10,
+    relationship_ranking_attribute: str = "rank",
+    links: dict[str, int] | None = None,
+) -> list[Relationship]:
+    """graphrag's _filter_relationships with set lookups and one pass to count out-of-network links.
+
+    Upstream writes the counts into the relationships' "links" attribute, where
+    they stay for the later calls of the same query. The relationships here are
+    shared by every query of the process, so the counts go into links instead,
+    one dict per query, and only the relationships returned are copies carrying
+    them.
+    """
+    links = {} if links is None else links
+    selected_names = {entity.title for entity in selected_entities}
+    in_network = [
+        rel
+        for rel in relationships
+        if rel.source in selected_names and rel.target in selected_names
+    ]
+    if len(in_network) > 1:
+        in_network = sort_relationships_by_ranking_attribute(
+            in_network, selected_entities, relationship_ranking_attribute
+        )
+    out_network = [
+        rel
+        for rel in relationships
+        if rel.source in selected_names and rel.target not in selected_names
+    ] + [
+        rel
+        for rel in relationships
+        if rel.target in selected_names and rel.source not in selected_names
+    ]
+    out_network = sort_relationships_by_ranking_attribute(
+        out_network, selected_entities, relationship_ranking_attribute
+    )
+    if len(out_network) <= 1:
+        return _with_links(in_network + out_network, links)
+
+    # number of selected entities each outside entity is linked to
+    linked = defaultdict(set)
+    for rel in out_network:
+        if rel.source not in selected_names:
+            linked[rel.source].add(rel.target)
+        if rel.target not in selected_names:
+            linked[rel.target].add(rel.source)
+    for rel in out_network:
+        links[rel.id] = len(
+            linked[rel.source] if rel.source in linked else linked[rel.target]
+        )
+
+    if relationship_ranking_attribute == "weight":
+        out_network.sort(key=lambda x: (links[x.id], x.weight), reverse=True)
+    else:
+        out_network.sort(
+            key=lambda x: (
+                links[x.id],
+                x.attributes[relationship_ranking_attribute],  # type: ignore
+            ),
+            reverse=True,
+        )
+    return _with_links(
+        in_network + out_network[: top_k_relationships * len(selected_entities)], links
+    )
+
+
+def _with_links(
+    relationships: list[Relationship], links: dict[str, int]
+) -> list[Relationship]:
+    return [
+        replace(rel, attributes={**(rel.attributes or {}), "links": links[rel.id]})
+        if rel.id in links
+        else rel
+        for rel in relationships
+    ]
+
+
+def build_relationship_context(
+    selected_entities: list[Entity],
+    relationships: list[Relationship],
+    token_encoder=None,
+    include_relationship_weight: bool = False,
+    max_tokens: int = 8000,
+    top_k_relationships: int = 10,
+    relationship_ranking_attribute: str = "rank",
+    column_delimiter: str = "|",
+    context_name: str = "Relationships",
+    links: dict[str, int] | None = None,
+) -> tuple[str, pd.DataFrame]:
+    """graphrag's build_relationship_context over the faster _filter_relationships."""
+    selected_relationships = _filter_relationships(
+        selected_entities=selected_entities,
+        relationships=relationships,
+        top_k_relationships=top_k_relationships,
+        relationship_ranking_attribute=relationship_ranking_attribute,
+        links=links,
+    )
+    if len(selected_entities) == 0 or len(selected_relationships) == 0:
+        return "", pd.DataFrame()
+
+    current_context_text = f"-----{context_name}-----" + "\n"
+    header = ["id", "source", "target", "description"]
+    if include_relationship_weight:
+        header.append("weight")
+    attribute_cols = (
+        list(selected_relationships[0].attributes.keys())
+        if selected_relationships[0].attributes
+        else []
+    )
+    attribute_cols = [col for col in attribute_cols if col not in header]
+    header.extend(attribute_cols)
+
+    current_context_text += column_delimiter.join(header) + "\n"
+    current_tokens = num_tokens(current_context_text, token_encoder)
+
+    all_context_records = [header]
+    for rel in selected_relationships:
+        new_context = [
+            rel.short_id if rel.short_id else "",
+            rel.source,
+            rel.target,
+            rel.description if rel.description else "",
+        ]
+        if include_relationship_weight:
+            new_context.append(str(rel.weight if rel.weight else ""))
+        for field in attribute_cols:
+            field_value = (
+                str(rel.attributes.get(field))
+                if rel.attributes and rel.attributes.get(field)
+                else ""
+            )
+            new_context.append(field_value)
+        new_context_text = column_delimiter.join(new_context) + "\n"
+        new_tokens = num_tokens(new_context_text, token_encoder)
+        if current_tokens + new_tokens > max_tokens:
+            break
+        current_context_text += new_context_text
+        all_context_records.append(new_context)
+        current_tokens += new_tokens
+
+    if len(all_context_records) > 1:
+        record_df = pd.DataFrame(
+            all_context_records[1:], columns=cast(Any, all_context_records[0])
+        )
+    else:
+        record_df = pd.DataFrame()
+    return current_context_text, record_df
+
+
+class LocalSessionCache:
+    """Mapped entities and context tables built for the earlier turns of one conversation.
+
+    Follow-up questions about the same patient mostly select the same entities,
+    so their entity, relationship, community and text unit tables and token counts
+    are reused instead of rebuilt. Each piece is keyed by everything it is built
+    from, a reused piece is the one a rebuild would produce.
+    """
+
+    def __init__(self, max_entries: int = MAX_SESSION_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, Any] = OrderedDict()
+        self._entry_bytes: dict[tuple, int] = {}
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate size of the cached tables and texts, the entity records belong to the index."""
+        with self._lock:
+            return sum(self._entry_bytes.values())
+
+    def get_or_build(self, key: tuple, build: Callable[[], T]) -> T:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        record_cache_lookup("session_context", value is not None)
+        if value is None:
+            value = build()
+            size = approx_size(value, records=False)
+            with self._lock:
+                self._entries[key] = value
+                self._entry_bytes[key] = size
+                while len(self._entries) > self.max_entries:
+                    self._entry_bytes.pop(self._entries.popitem(last=False)[0])
+        return value
+
+
+def _cached(session: LocalSessionCache | None, key: tuple, build: Callable[[], T]) -> T:
+    return build() if session is None else session.get_or_build(key, build)
+
+
+def entity_mapping_query(
+    query: str,
+    conversation_history: ConversationHistory | None,
+    conversation_history_max_turns: int | None = 5,
+) -> str:
+    """The text local search maps to entities, the question followed by the previous user questions."""
+    if not conversation_history:
+        return query
+    pre_user_questions = "\n".join(
+        conversation_history.get_user_turns(conversation_history_max_turns)
+    )
+    return f"{query}\n{pre_user_questions}"
+
+
+class LocalSearchContext(LocalSearchMixedContext):
+    """LocalSearchMixedContext that reads entity neighbourhoods from the precomputed index arrays.
+
+    Mapped entities are looked up by key instead of by scanning every entity for
+    each search hit, and the relationships considered for the selected entities
+    come from the entity -> relationship CSR arrays instead of a scan of every
+    relationship for each entity added to the context. The context is the same
+    as upstream's. Without columns, or when candidate context is requested, the
+    upstream implementation is used. build_context is timed as the context_build
+    stage.
+    """
+
+    def __init__(self, *args, columns: IndexColumns | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.columns = columns
+        self._entities_by_title: dict[str, list[Entity]] = {}
+        for entity in self.entities.values():
+            self._entities_by_title.setdefault(entity.title, []).append(entity)
+        if columns is not None:
+            # relationship rows of the index arrays
+            self._relationship_rows = [
+                self.relationships[id_] for id_ in columns.relationships.ids
+            ]
+
+    def _entity_by_key(self, value: str | int) -> Entity | None:
+        if self.embedding_vectorstore_key == EntityVectorStoreKey.TITLE:
+            entities = self._entities_by_title.get(str(value))
+            return entities[0] if entities else None
+        entity = self.entities.get(value)
+        if entity is None and isinstance(value, str):
+            entity = self.entities.get(value.replace("-", ""))
+        return entity
+
+    def _map_query_to_entities(
+        self,
+        query: str,
+        include_entity_names: list[str],
+        exclude_entity_names: list[str],
+        k: int,
+        oversample_scaler: int = 2,
+    ) -> list[Entity]:
+        """map_query_to_entities with dict lookups of the search hits."""
+        if query == "":
+            return map_query_to_entities(
+                query=query,
+                text_embedding_vectorstore=self.entity_text_embeddings,
+                text_embedder=self.text_embedder,
+                all_entities=list(self.entities.values()),
+                embedding_vectorstore_key=self.embedding_vectorstore_key,
+                include_entity_names=include_entity_names,
+                exclude_entity_names=exclude_entity_names,
+                k=k,
+                oversample_scaler=oversample_scaler,
+            )
+
+        search_results = self.entity_text_embeddings.similarity_search_by_text(
+            text=query,
+            text_embedder=lambda t: self.text_embedder.embed(t),
+            k=k * oversample_scaler,
+        )
+        matched_entities = [
+            entity
+            for result in search_results
+            if (entity := self._entity_by_key(result.document.id))
+        ]
+        if exclude_entity_names:
+            matched_entities = [
+                entity
+                for entity in matched_entities
+                if entity.title not in exclude_entity_names
+            ]
+        included_entities = [
+            entity
+            for entity_name in include_entity_names
+            for entity in self._entities_by_title.get(entity_name, [])
+        ]
+        return included_entities + matched_entities
+
+    def _neighbour_relationships(
+        self, selected_entities: list[Entity]
+    ) -> list[Relationship]:
+        """Relationships with a selected entity at either end, in the order of the full list."""
+        columns = self.columns.entities
+        rows = {
+            columns.title_row[entity.title]
+            for entity in selected_entities
+            if entity.title in columns.title_row
+        }
+        if not rows:
+            return []
+        relationship_rows = np.unique(
+            np.concatenate([columns.relationships_of(row) for row in rows])
+        )
+        return [self._relationship_rows[row] for row in relationship_rows]
+
+    @timed("context_build")
+    def build_context(
+        self,
+        query: str,
+        conversation_history: ConversationHistory | None = None,
+        include_entity_names: list[str] | None = None,
+        exclude_entity_names: list[str] | None = None,
+        conversation_history_max_turns: int | None = 5,
+        conversation_history_user_turns_only: bool = True,
+        max_tokens: int = 8000,
+        text_unit_prop: float = 0.5,
+        community_prop: float = 0.25,
+        top_k_mapped_entities: int = 10,
+        top_k_relationships: int = 10,
+        include_community_rank: bool = False,
+        include_entity_rank: bool = False,
+        rank_description: str = "number of relationships",
+        include_relationship_weight: bool = False,
+        relationship_ranking_attribute: str = "rank",
+        return_candidate_context: bool = False,
+        use_community_summary: bool = False,
+        min_community_rank: int = 0,
+        community_context_name: str = "Reports",
+        column_delimiter: str = "|",
+        session: LocalSessionCache | None = None,
+        **kwargs: dict[str, Any],
+    ) -> tuple[str | list[str], dict[str, pd.DataFrame]]:
+        if self.columns is None or return_candidate_context:
+            return super().build_context(
+                query=query,
+                conversation_history=conversation_history,
+                include_entity_names=include_entity_names,
+                exclude_entity_names=exclude_entity_names,
+                conversation_history_max_turns=conversation_history_max_turns,
+                conversation_history_user_turns_only=conversation_history_user_turns_only,
+                max_tokens=max_tokens,
+                text_unit_prop=text_unit_prop,
+                community_prop=community_prop,
+                top_k_mapped_entities=top_k_mapped_entities,
+                top_k_relationships=top_k_relationships,
+                include_community_rank=include_community_rank,
+                include_entity_rank=include_entity_rank,
+                rank_description=rank_description,
+                include_relationship_weight=include_relationship_weight,
+                relationship_ranking_attribute=relationship_ranking_attribute,
+                return_candidate_context=return_candidate_context,
+                use_community_summary=use_community_summary,
+                min_community_rank=min_community_rank,
+                community_context_name=community_context_name,
+                column_delimiter=column_delimiter,
+                **kwargs,
+            )
+
+        if community_prop + text_unit_prop > 1:
+            value_error = (
+                "The sum of community_prop and text_unit_prop should not exceed 1."
+            )
+            raise ValueError(value_error)
+
+        # map user query to entities, with the previous user questions attached
+        query = entity_mapping_query(
+            query, conversation_history, conversation_history_max_turns
+        )
+        include_entity_names = include_entity_names or []
+        exclude_entity_names = exclude_entity_names or []
+        selected_entities = _cached(
+            session,
+            (
+                "entities",
+                query,
+                tuple(include_entity_names),
+                tuple(exclude_entity_names),
+                top_k_mapped_entities,
+            ),
+            lambda: self._map_query_to_entities(
+                query=query,
+                include_entity_names=include_entity_names,
+                exclude_entity_names=exclude_entity_names,
+                k=top_k_mapped_entities,
+            ),
+        )
+        entity_ids = tuple(entity.id for entity in selected_entities)
+
+        final_context = list[str]()
+        final_context_data = dict[str, pd.DataFrame]()
+
+        if conversation_history:
+            (
+                conversation_history_context,
+                conversation_history_context_data,
+            ) = conversation_history.build_context(
+                include_user_turns_only=conversation_history_user_turns_only,
+                max_qa_turns=conversation_history_max_turns,
+                column_delimiter=column_delimiter,
+                max_tokens=max_tokens,
+                recency_bias=False,
+            )
+            if conversation_history_context.strip() != "":
+                final_context.append(conversation_history_context)
+                final_context_data = conversation_history_context_data
+                max_tokens = max_tokens - num_tokens(
+                    conversation_history_context, self.token_encoder
+                )
+
+        community_tokens = max(int(max_tokens * community_prop), 0)
+        community_context, community_context_data = _cached(
+            session,
+            (
+                "communities",
+                entity_ids,
+                community_tokens,
+                use_community_summary,
+                column_delimiter,
+                include_community_rank,
+                min_community_rank,
+                community_context_name,
+            ),
+            lambda: self._build_community_context(
+                selected_entities=selected_entities,
+                max_tokens=community_tokens,
+                use_community_summary=use_community_summary,
+                column_delimiter=column_delimiter,
+                include_community_rank=include_community_rank,
+                min_community_rank=min_community_rank,
+                context_name=community_context_name,
+            ),
+        )
+        if community_context.strip() != "":
+            final_context.append(community_context)
+            final_context_data = {**final_context_data, **community_context_data}
+
+        local_prop = 1 - community_prop - text_unit_prop
+        local_tokens = max(int(max_tokens * local_prop), 0)
+        local_context, local_context_data = self._build_local_context(
+            selected_entities=selected_entities,
+            max_tokens=local_tokens,
+            include_entity_rank=include_entity_rank,
+            rank_description=rank_description,
+            include_relationship_weight=include_relationship_weight,
+            top_k_relationships=top_k_relationships,
+            relationship_ranking_attribute=relationship_ranking_attribute,
+            column_delimiter=column_delimiter,
+            session=session,
+        )
+        if local_context.strip() != "":
+            final_context.append(str(local_context))
+            final_context_data = {**final_context_data, **local_context_data}
+
+        text_unit_tokens = max(int(max_tokens * text_unit_prop), 0)
+        text_unit_context, text_unit_context_data = _cached(
+            session,
+            ("text_units", entity_ids, text_unit_tokens),
+            lambda: self._build_text_unit_context(
+                selected_entities=selected_entities,
+                max_tokens=text_unit_tokens,
+            ),
+        )
+        if text_unit_context.strip() != "":
+            final_context.append(text_unit_context)
+            final_context_data = {**final_context_data, **text_unit_context_data}
+
+        return ("\n\n".join(final_context), final_context_data)
+
+    def _build_text_unit_context(
+        self,
+        selected_entities: list[Entity],
+        max_tokens: int = 8000,
+        return_candidate_context: bool = False,
+        column_delimiter: str = "|",
+        context_name: str = "Sources",
+    ) -> tuple[str, dict[str, pd.DataFrame]]:
+        if self.columns is None or return_candidate_context:
+            return super()._build_text_unit_context(
+                selected_entities=selected_entities,
+                max_tokens=max_tokens,
+                return_candidate_context=return_candidate_context,
+                column_delimiter=column_delimiter,
+                context_name=context_name,
+            )
+        if len(selected_entities) == 0 or len(self.text_units) == 0:
+            return ("", {context_name.lower(): pd.DataFrame()})
+
+        # rank by the order of the first entity matching each text unit, then by the
+        # number of that entity's relationships the text unit mentions
+        selected_text_units = list[tuple[int, int, TextUnit]]()
+        seen = set()
+        for index, entity in enumerate(selected_entities):
+            if not entity.text_unit_ids:
+                continue
+            entity_relationships = None
+            for text_id in entity.text_unit_ids:
+                if text_id in seen or text_id not in self.text_units:
+                    continue
+                seen.add(text_id)
+                if entity_relationships is None:
+                    entity_relationships = {
+                        relationship.id: relationship
+                        for relationship in self._neighbour_relationships([entity])
+                    }
+                selected_unit = self.text_units[text_id]
+                num_relationships = count_relationships(
+                    selected_unit, entity, entity_relationships
+                )
+                selected_text_units.append((index, -num_relationships, selected_unit))
+        selected_text_units.sort(key=lambda item: (item[0], item[1]))
+
+        context_text, context_data = build_text_unit_context(
+            text_units=[unit for _, _, unit in selected_text_units],
+            token_encoder=self.token_encoder,
+            max_tokens=max_tokens,
+            shuffle_data=False,
+            context_name=context_name,
+            column_delimiter=column_delimiter,
+        )
+        return (str(context_text), context_data)
+
+    def _build_local_context(
+        self,
+        selected_entities: list[Entity],
+        max_tokens: int = 8000,
+        include_entity_rank: bool = False,
+        rank_description: str = "relationship count",
+        include_relationship_weight: bool = False,
+        top_k_relationships: int = 10,
+        relationship_ranking_attribute: str = "rank",
+        return_candidate_context: bool = False,
+        column_delimiter: str = "|",
+        session: LocalSessionCache | None = None,
+    ) -> tuple[str, dict[str, pd.DataFrame]]:
+        if self.columns is None or return_candidate_context or self.covariates:
+            return super()._build_local_context(
+                selected_entities=selected_entities,
+                max_tokens=max_tokens,
+                include_entity_rank=include_entity_rank,
+                rank_description=rank_description,
+                include_relationship_weight=include_relationship_weight,
+                top_k_relationships=top_k_relationships,
+                relationship_ranking_attribute=relationship_ranking_attribute,
+                return_candidate_context=return_candidate_context,
+                column_delimiter=column_delimiter,
+            )
+
+        def _entity_context():
+            context, context_data = build_entity_context(
+                selected_entities=selected_entities,
+                token_encoder=self.token_encoder,
+                max_tokens=max_tokens,
+                column_delimiter=column_delimiter,
+                include_entity_rank=include_entity_rank,
+                rank_description=rank_description,
+                context_name="Entities",
+            )
+            return context, context_data, num_tokens(context, self.token_encoder)
+
+        def _relationship_context(added_entities: list[Entity], links: dict[str, int]):
+            links = dict(links)
+            context, context_data = build_relationship_context(
+                selected_entities=added_entities,
+                relationships=self._neighbour_relationships(added_entities),
+                token_encoder=self.token_encoder,
+                max_tokens=max_tokens,
+                column_delimiter=column_delimiter,
+                top_k_relationships=top_k_relationships,
+                include_relationship_weight=include_relationship_weight,
+                relationship_ranking_attribute=relationship_ranking_attribute,
+                context_name="Relationships",
+                links=links,
+            )
+            return context, context_data, num_tokens(context, self.token_encoder), links
+
+        entity_context, entity_context_data, entity_tokens = _cached(
+            session,
+            (
+                "entity_context",
+                tuple(entity.id for entity in selected_entities),
+                max_tokens,
+                include_entity_rank,
+                rank_description,
+                column_delimiter,
+            ),
+            _entity_context,
+        )
+
+        # add entities one at a time until their relationships no longer fit, only
+        # the relationships touching the added entities can ever be selected. As
+        # upstream, the link counts of earlier steps stay on relationships a later
+        # step selects, so a step depends on the added entities in order and a
+        # later turn reuses the steps an earlier turn with the same prefix built
+        final_context = list[str]()
+        final_context_data = dict[str, pd.DataFrame]()
+        links: dict[str, int] = {}
+        for count in range(1, len(selected_entities) + 1):
+            added_entities = selected_entities[:count]
+            (
+                relationship_context,
+                relationship_context_data,
+                relationship_tokens,
+                links,
+            ) = _cached(
+                session,
+                (
+                    "relationships",
+                    tuple(entity.id for entity in added_entities),
+                    max_tokens,
+                    top_k_relationships,
+                    include_relationship_weight,
+                    relationship_ranking_attribute,
+                    column_delimiter,
+                ),
+                lambda: _relationship_context(added_entities, links),
+            )
+            if entity_tokens + relationship_tokens > max_tokens:
+                log.info("Reached token limit - reverting to previous context state")
+                break
+            final_context = [relationship_context]
+            final_context_data = {"relationships": relationship_context_data}
+
+        final_context_text = entity_context + "\n\n" + "\n\n".join(final_context)
+        final_context_data["entities"] = entity_context_data
+        # copies, the tables may be reused by the next turn
+        for key in final_context_data:
+            final_context_data[key] = final_context_data[key].assign(in_context=True)
+        return (final_context_text, final_context_data)
+
+
+_sessions_lock = threading.Lock()
+_sessions: OrderedDict[
+    tuple[str, str, int], tuple[str, LocalSessionCache]
+] = OrderedDict()
+
+
+def get_session_cache(artifacts: IndexArtifacts, session_id: str) -> LocalSessionCache:
+    """The context cache of one conversation on one index, created on its first turn."""
+    key = (session_id, artifacts.input_dir, artifacts.community_level)
+    with _sessions_lock:
+        cached = _sessions.get(key)
+        if cached is None or cached[0] != artifacts.version:
+            cached = (artifacts.version, LocalSessionCache())
+            _sessions[key] = cached
+        _sessions.move_to_end(key)
+        while len(_sessions) > MAX_SESSIONS:
+            _sessions.popitem(last=False)
+        return cached[1]
+
+
+def session_caches_nbytes(input_dir: str, community_level: int) -> int:
+    with _sessions_lock:
+        sessions = [
+            cached[1]
+            for key, cached in _sessions.items()
+            if key[1:] == (input_dir, community_level)
+        ]
+    return sum(session.nbytes for session in sessions)
+
+
+def evict_session_caches(input_dir: str, community_level: int):
+    with _sessions_lock:
+        for key in [key for key in _sessions if key[1:] == (input_dir, community_level)]:
+            del _sessions[key]
@@ -1,185 +1,275 @@
-import os
-
-import pandas as pd
-import tiktoken
+import json
+from collections.abc import AsyncIterator
 
+from graphrag.query.context_builder.conversation_history import ConversationHistory
 from graphrag.query.context_builder.entity_extraction import EntityVectorStoreKey
-from graphrag.query.indexer_adapters import (
-    read_indexer_covariates,
-    read_indexer_entities,
-    read_indexer_relationships,
-    read_indexer_reports,
-    read_indexer_text_units,
-)
-from graphrag.query.input.loaders.dfs import (
-    store_entity_semantic_embeddings,
-)
-from graphrag.query.llm.oai.chat_openai import ChatOpenAI
-from graphrag.query.llm.oai.embedding import OpenAIEmbedding
-from graphrag.query.llm.oai.typing import OpenaiApiType
 from graphrag.query.question_gen.local_gen import LocalQuestionGen
-from graphrag.query.structured_search.local_search.mixed_context import (
-    LocalSearchMixedContext,
-)
 from graphrag.query.structured_search.local_search.search import LocalSearch
-from graphrag.vector_stores.lancedb import LanceDBVectorStore
-
-import streamlit as st
 
+from answer_cache import answer_cache, answer_namespace
+from artifact_store import IndexArtifacts
+from clients import get_chat_llm, get_token_encoder
+from embedding_cache import get_cached_text_embedder
+from index_registry import aget_index
+from local_context import (
+    LocalSearchContext,
+    entity_mapping_query,
+    get_session_cache,
+)
+from metrics import QueryMetrics, stage
+from streaming import stream_search
+from token_counts import get_precounted_encoder
+from vector_index import get_entity_store
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-INPUT_DIR = "./output/20240825-115048/artifacts"
-LANCEDB_URI = f"{INPUT_DIR}/lancedb"
-
-COMMUNITY_REPORT_TABLE = "create_final_community_reports"
-ENTITY_TABLE = "create_final_nodes"
-ENTITY_EMBEDDING_TABLE = "create_final_entities"
-RELATIONSHIP_TABLE = "create_final_relationships"
-# COVARIATE_TABLE = "create_final_covariates"
-TEXT_UNIT_TABLE = "create_final_text_units"
-COMMUNITY_LEVEL = 2
-
-
-async def execute_local_query(question: str, mock=True):
-    # read nodes table to get community and degree data
-    entity_df = pd.read_parquet(f"{INPUT_DIR}/{ENTITY_TABLE}.parquet")
-    entity_embedding_df = pd.read_parquet(
-        f"{INPUT_DIR}/{ENTITY_EMBEDDING_TABLE}.parquet"
-    )
-
-    entities = read_indexer_entities(entity_df, entity_embedding_df, COMMUNITY_LEVEL)
-
-    # load description embeddings to an in-memory lancedb vectorstore
-    # to connect to a remote db, specify url and port values.
-    description_embedding_store = LanceDBVectorStore(
-        collection_name="entity_description_embeddings",
-    )
-    description_embedding_store.connect(db_uri=LANCEDB_URI)
-    entity_description_embeddings = store_entity_semantic_embeddings(
-        entities=entities, vectorstore=description_embedding_store
-    )
-
-    print(f"Entity count: {len(entity_df)}")
-    entity_df.head()
-
-    relationship_df = pd.read_parquet(f"{INPUT_DIR}/{RELATIONSHIP_TABLE}.parquet")
-    relationships = read_indexer_relationships(relationship_df)
-
-    print(f"Relationship count: {len(relationship_df)}")
-    relationship_df.head()
-
-    # NOTE: covariates are turned off by default, because they generally need prompt tuning to be valuable
-    # Please see the GRAPHRAG_CLAIM_* settings
-    # covariate_df = pd.read_parquet(f"{INPUT_DIR}/{COVARIATE_TABLE}.parquet")
-
-    # claims = read_indexer_covariates(covariate_df)
-
-    # print(f"Claim records: {len(claims)}")
-    # covariates = {"claims": claims}
-
-    report_df = pd.read_parquet(f"{INPUT_DIR}/{COMMUNITY_REPORT_TABLE}.parquet")
-    reports = read_indexer_reports(report_df, entity_df, COMMUNITY_LEVEL)
-
-    print(f"Report records: {len(report_df)}")
-
-    text_unit_df = pd.read_parquet(f"{INPUT_DIR}/{TEXT_UNIT_TABLE}.parquet")
-    text_units = read_indexer_text_units(text_unit_df)
-
-    print(f"Text unit records: {len(text_unit_df)}")
-    text_unit_df.head()
-
-    api_key = os.environ["GRAPHRAG_API_KEY"]
-    llm_model = os.environ["GRAPHRAG_LLM_MODEL"]
-    embedding_model = os.environ["GRAPHRAG_EMBEDDING_MODEL"]
-    # api_key = st.secrets["GRAPHRAG_API_KEY"]
-    # llm_model = st.secrets["GRAPHRAG_LLM_MODEL"]
-    # embedding_model = st.secrets["GRAPHRAG_EMBEDDING_MODEL"]
-
-    llm = ChatOpenAI(
-        api_key=api_key,
-        model=llm_model,
-        api_type=OpenaiApiType.AzureOpenAI,  # OpenaiApiType.OpenAI or OpenaiApiType.AzureOpenAI
-        api_base="https://theraflow-openai.openai.azure.com/openai/deployments/gpt-4o-mini/chat/completions?api-version=2024-02-15-preview",
-        api_version="2024-02-15-preview",
-        max_retries=20,
-    )
-
-    token_encoder = tiktoken.get_encoding("cl100k_base")
-
-    text_embedder = OpenAIEmbedding(
-        api_key=api_key,
-        api_type=OpenaiApiType.AzureOpenAI,
-        api_base="https://theraflow-openai.openai.azure.com/openai/deployments/text-embedding-ada-002/embeddings?api-version=2023-05-15",
-        api_version="2023-05-15",
-        model=embedding_model,
-        deployment_name=embedding_model,
-        max_retries=20,
-    )
-
-    context_builder = LocalSearchMixedContext(
-        community_reports=reports,
-        text_units=text_units,
-        entities=entities,
-        relationships=relationships,
+# text_unit_prop: proportion of context window dedicated to related text units
+# community_prop: proportion of context window dedicated to community reports.
+# The remaining proportion is dedicated to entities and relationships. Sum of text_unit_prop and community_prop should be <= 1
+# conversation_history_max_turns: maximum number of turns to include in the conversation history.
+# conversation_history_user_turns_only: if True, only include user queries in the conversation history.
+# top_k_mapped_entities: number of related entities to retrieve from the entity description embedding store.
+# top_k_relationships: control the number of out-of-network relationships to pull into the context window.
+# include_entity_rank: if True, include the entity rank in the entity table in the context window. Default entity rank = node degree.
+# include_relationship_weight: if True, include the relationship weight in the context window.
+# include_community_rank: if True, include the community rank in the context window.
+# return_candidate_context: if True, return a set of dataframes containing all candidate entity/relationship/covariate records that
+# could be relevant. Note that not all of these records will be included in the context window. The "in_context" column in these
+# dataframes indicates whether the record is included in the context window.
+# max_tokens: maximum number of tokens to use for the context window.
+
+local_context_params = {
+    "text_unit_prop": 0.5,
+    "community_prop": 0.1,
+    "conversation_history_max_turns": 5,
+    "conversation_history_user_turns_only": True,
+    "top_k_mapped_entities": 10,
+    "top_k_relationships": 10,
+    "include_entity_rank": True,
+    "include_relationship_weight": True,
+    "include_community_rank": False,
+    "return_candidate_context": False,
+    "embedding_vectorstore_key": EntityVectorStoreKey.ID,  # set this to EntityVectorStoreKey.TITLE if the vectorstore uses entity title as ids
+    "max_tokens": 12_000,  # change this based on the token limit you have on your model (if you are using a model with 8k limit, a good setting could be 5000)
+}
+
+llm_params = {
+    "max_tokens": 2_000,  # change this based on the token limit you have on your model (if you are using a model with 8k limit, a good setting could be 1000=1500)
+    "temperature": 0.0,
+}
+
+response_type = "single paragraph"  # free form text describing the response type and format, can be anything, e.g. prioritized list, single paragraph, multiple paragraphs, multiple-page report
+
+
+def build_local_search(artifacts: IndexArtifacts) -> LocalSearch:
+    # in-process matrix search by default, or the persisted LanceDB table with
+    # GRAPHRAG_VECTOR_STORE=lancedb; both are built once per artifact version
+    with stage("vector_store"):
+        description_embedding_store = get_entity_store(artifacts)
+
+    # shared, connection-pooled clients and encoder for the whole process
+    llm = get_chat_llm()
+    token_encoder = get_token_encoder()
+    text_embedder = get_cached_text_embedder()
+
+    context_builder = LocalSearchContext(
+        community_reports=artifacts.reports,
+        text_units=artifacts.text_units,
+        entities=artifacts.entities,
+        relationships=artifacts.relationships,
+        columns=artifacts.columns,
         # if you did not run covariates during indexing, set this to None
         covariates=None,
         entity_text_embeddings=description_embedding_store,
         embedding_vectorstore_key=EntityVectorStoreKey.ID,  # if the vectorstore uses entity title as ids, set this to EntityVectorStoreKey.TITLE
         text_embedder=text_embedder,
-        token_encoder=token_encoder,
+        # context rows are measured with the token counts precomputed for this index run
+        token_encoder=get_precounted_encoder(artifacts),
     )
 
-    # text_unit_prop: proportion of context window dedicated to related text units
-    # community_prop: proportion of context window dedicated to community reports.
-    # The remaining proportion is dedicated to entities and relationships. Sum of text_unit_prop and community_prop should be <= 1
-    # conversation_history_max_turns: maximum number of turns to include in the conversation history.
-    # conversation_history_user_turns_only: if True, only include user queries in the conversation history.
-    # top_k_mapped_entities: number of related entities to retrieve from the entity description embedding store.
-    # top_k_relationships: control the number of out-of-network relationships to pull into the context window.
-    # include_entity_rank: if True, include the entity rank in the entity table in the context window. Default entity rank = node degree.
-    # include_relationship_weight: if True, include the relationship weight in the context window.
-    # include_community_rank: if True, include the community rank in the context window.
-    # return_candidate_context: if True, return a set of dataframes containing all candidate entity/relationship/covariate records that
-    # could be relevant. Note that not all of these records will be included in the context window. The "in_context" column in these
-    # dataframes indicates whether the record is included in the context window.
-    # max_tokens: maximum number of tokens to use for the context window.
-
-    local_context_params = {
-        "text_unit_prop": 0.5,
-        "community_prop": 0.1,
-        "conversation_history_max_turns": 5,
-        "conversation_history_user_turns_only": True,
-        "top_k_mapped_entities": 10,
-        "top_k_relationships": 10,
-        "include_entity_rank": True,
-        "include_relationship_weight": True,
-        "include_community_rank": False,
-        "return_candidate_context": False,
-        "embedding_vectorstore_key": EntityVectorStoreKey.ID,  # set this to EntityVectorStoreKey.TITLE if the vectorstore uses entity title as ids
-        "max_tokens": 12_000,  # change this based on the token limit you have on your model (if you are using a model with 8k limit, a good setting could be 5000)
-    }
-
-    llm_params = {
-        "max_tokens": 2_000,  # change this based on the token limit you have on your model (if you are using a model with 8k limit, a good setting could be 1000=1500)
-        "temperature": 0.0,
-    }
-
-    search_engine = LocalSearch(
+    return LocalSearch(
         llm=llm,
         context_builder=context_builder,
         token_encoder=token_encoder,
         llm_params=llm_params,
         context_builder_params=local_context_params,
-        response_type="single paragraph",  # free form text describing the response type and format, can be anything, e.g. prioritized list, single paragraph, multiple paragraphs, multiple-page report
+        response_type=response_type,
+    )
+
+
+async def embed_question(question: str):
+    """Embed the question ahead of the search.
+
+    The context builder embeds the question synchronously on the event loop; done
+    here first, that becomes a cache hit and concurrent questions share a batched
+    embedding request instead of blocking the loop one by one.
+    """
+    # a failed or NaN embedding comes back empty and is not cached, the context
+    # builder would only report that the text was not embedded beforehand
+    if not await get_cached_text_embedder().aembed(question):
+        raise RuntimeError("Embedding the question failed, no usable vector returned")
+
+
+def mapping_query(question: str, history: ConversationHistory | None) -> str:
+    return entity_mapping_query(
+        question, history, local_context_params["conversation_history_max_turns"]
     )
 
-    result = await search_engine.asearch(question)
+
+def conversation_history(
+    history: list[dict[str, str]] | None,
+) -> ConversationHistory | None:
+    """The earlier {"role", "content"} messages of a conversation, None before its first question."""
+    if not history or not any(turn.get("role") == "user" for turn in history):
+        return None
+    return ConversationHistory.from_list(history)
+
+
+def answer_key(question: str, history: ConversationHistory | None) -> str:
+    """The answer cache key, the question and the earlier turns put in its context.
+
+    Keys with history are only matched exactly, two different follow-ups of one
+    conversation share most of their text.
+    """
+    if history is None:
+        return question
+    if local_context_params["conversation_history_user_turns_only"]:
+        turns = history.get_user_turns(
+            local_context_params["conversation_history_max_turns"]
+        )
+    else:
+        turns = [str(turn) for turn in history.turns]
+    return json.dumps([question, *turns])
+
+
+def search_kwargs(
+    artifacts: IndexArtifacts,
+    history: ConversationHistory | None,
+    session_id: str | None,
+) -> dict:
+    """asearch arguments for a turn of a conversation, the session cache reuses earlier turns' context."""
+    kwargs = {"conversation_history": history}
+    if session_id is not None:
+        kwargs["session"] = get_session_cache(artifacts, session_id)
+    return kwargs
+
+
+def local_cache_namespace(artifacts: IndexArtifacts) -> str:
+    return answer_namespace(
+        artifacts,
+        "local",
+        get_chat_llm().model,
+        {
+            "local_context_params": local_context_params,
+            "llm_params": llm_params,
+            "response_type": response_type,
+        },
+    )
+
+
+async def execute_local_query(
+    question: str,
+    mock=True,
+    use_cache=True,
+    metrics: QueryMetrics | None = None,
+    index_id: str | None = None,
+    history: list[dict[str, str]] | None = None,
+    session_id: str | None = None,
+):
+    """Answer question, history holds the earlier messages of its conversation and
+    session_id names the conversation whose context cache the turn reuses."""
+    metrics = metrics or QueryMetrics()
+    metrics.search_type, metrics.question = "local", question
+    history = conversation_history(history)
+
+    with metrics.activate():
+        with metrics.stage("load_artifacts"):
+            artifacts = await aget_index(index_id)
+
+        namespace = local_cache_namespace(artifacts)
+        key = answer_key(question, history)
+        if use_cache:
+            with metrics.stage("answer_cache"):
+                result = await answer_cache.aget(
+                    namespace, key, semantic=history is None
+                )
+            metrics.record_cache_lookup("answer", result is not None)
+            if result is not None:
+                metrics.finish()
+                return result
+
+        with metrics.stage("build_search"):
+            search_engine = build_local_search(artifacts)
+        with metrics.stage("search"):
+            await embed_question(mapping_query(question, history))
+            result = await search_engine.asearch(
+                question, **search_kwargs(artifacts, history, session_id)
+            )
+
+        if use_cache:
+            await answer_cache.aset(namespace, key, result, semantic=history is None)
+    metrics.finish(result, get_token_encoder())
     return result
 
 
+async def stream_local_query(
+    question: str,
+    use_cache=True,
+    metrics: QueryMetrics | None = None,
+    index_id: str | None = None,
+    history: list[dict[str, str]] | None = None,
+    session_id: str | None = None,
+) -> AsyncIterator[str]:
+    """Yield the completion tokens of a local search as the LLM generates them."""
+    metrics = metrics or QueryMetrics()
+    metrics.search_type, metrics.question = "local", question
+    history = conversation_history(history)
+
+    # stages are only activated between yields, a generator may resume in another context
+    with metrics.activate():
+        with metrics.stage("load_artifacts"):
+            artifacts = await aget_index(index_id)
+
+        namespace = local_cache_namespace(artifacts)
+        key = answer_key(question, history)
+        result = None
+        if use_cache:
+            with metrics.stage("answer_cache"):
+                result = await answer_cache.aget(
+                    namespace, key, semantic=history is None
+                )
+            metrics.record_cache_lookup("answer", result is not None)
+    if result is not None:
+        metrics.finish()
+        yield result.response
+        return
+
+    with metrics.activate():
+        with metrics.stage("build_search"):
+            search_engine = build_local_search(artifacts)
+
+    results = []
+    with metrics.stage("search"):
+        with metrics.activate():
+            await embed_question(mapping_query(question, history))
+        async for token in stream_search(
+            search_engine,
+            question,
+            results,
+            metrics,
+            **search_kwargs(artifacts, history, session_id),
+        ):
+            yield token
+
+    if use_cache and results:
+        await answer_cache.aset(
+            namespace, key, results[0], semantic=history is None
+        )
+    metrics.finish(results[0] if results else None, get_token_encoder())
+
+
 if __name__ == "__main__":
     import argparse
     import asyncio
@@ -0,0 +1,237 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from graphrag.query.llm.text_utils import num_tokens
+from graphrag.query.structured_search.base import SearchResult
+from graphrag.query.structured_search.global_search.callbacks import (
+    GlobalSearchLLMCallback,
+)
+from graphrag.query.structured_search.global_search.search import GlobalSearch
+
+from answer_cache import normalize_question
+from metrics import current_metrics, record_cache_lookup, stage, timed
+
+log = logging.getLogger(__name__)
+
+MAP_CACHE_PATH = os.environ.get(
+    "GRAPHRAG_MAP_CACHE_PATH", "./cache/query_map_results.sqlite"
+)
+MAP_CACHE_MAX_ENTRIES = int(os.environ.get("GRAPHRAG_MAP_CACHE_MAX_ENTRIES", 50_000))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS map_results (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS map_results_accessed_at ON map_results (accessed_at);
+"""
+
+
+class MapResultCache:
+    """SQLite-backed store of parsed map-phase answers, keyed by report batch, question and map parameters."""
+
+    def __init__(
+        self, path: str = MAP_CACHE_PATH, max_entries: int = MAP_CACHE_MAX_ENTRIES
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    with sqlite3.connect(self.path, timeout=30) as conn:
+                        conn.execute("PRAGMA journal_mode=WAL")
+                        conn.executescript(_SCHEMA)
+                    self._initialized = True
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def key(context_data: str, question: str, map_params: dict[str, Any]) -> str:
+        batch_hash = hashlib.sha256(context_data.encode("utf-8")).hexdigest()
+        params = json.dumps(map_params, sort_keys=True, default=str)
+        return hashlib.sha256(
+            f"{batch_hash}:{normalize_question(question)}:{params}".encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> tuple[list[dict[str, Any]], int] | None:
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute(
+                    "SELECT response, prompt_tokens FROM map_results WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute(
+                    "UPDATE map_results SET accessed_at = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+        finally:
+            conn.close()
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, response: list[dict[str, Any]], prompt_tokens: int):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO map_results VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(response), prompt_tokens, time.time()),
+                )
+                conn.execute(
+                    "DELETE FROM map_results WHERE key IN ("
+                    " SELECT key FROM map_results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        finally:
+            conn.close()
+
+
+map_result_cache = MapResultCache()
+
+
+def _cacheable(search_response: str, points: list[dict[str, Any]]) -> bool:
+    """Whether a map answer is the model's answer, rather than an empty or unparseable reply.
+
+    agenerate returns an empty string once its retries are exhausted and a reply
+    that does not parse comes back as no points or a single empty one, neither
+    is kept. A reply that parses to an empty points list is a real answer.
+    """
+    if any(point.get("answer") for point in points):
+        return True
+    try:
+        parsed = json.loads(search_response)
+    except ValueError:
+        return False
+    return isinstance(parsed, dict) and parsed.get("points") == []
+
+
+class MapPhaseTimer(GlobalSearchLLMCallback):
+    """Times the map phase between the callbacks GlobalSearch fires around it."""
+
+    def __init__(self):
+        super().__init__()
+        self._start = 0.0
+
+    def on_map_response_start(self, map_response_contexts: list[str]):
+        super().on_map_response_start(map_response_contexts)
+        self._start = time.perf_counter()
+
+    def on_map_response_end(self, map_response_outputs: list[SearchResult]):
+        super().on_map_response_end(map_response_outputs)
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.add_time("map", time.perf_counter() - self._start)
+            metrics.incr("map_batches", len(map_response_outputs))
+
+
+class CachedGlobalSearch(GlobalSearch):
+    """GlobalSearch that answers repeated map calls from the map result cache."""
+
+    def __init__(self, *args, map_cache: MapResultCache = map_result_cache, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.map_cache = map_cache
+        self.callbacks = [*(self.callbacks or []), MapPhaseTimer()]
+
+    def _map_params(self, llm_kwargs: dict[str, Any]) -> dict[str, Any]:
+        return {
+            "model": getattr(self.llm, "model", None),
+            "map_system_prompt": self.map_system_prompt,
+            "llm_params": llm_kwargs,
+        }
+
+    async def _map_response_single_batch(
+        self,
+        context_data: str,
+        query: str,
+        **llm_kwargs,
+    ) -> SearchResult:
+        start_time = time.time()
+        key = self.map_cache.key(context_data, query, self._map_params(llm_kwargs))
+        cached = await asyncio.to_thread(self.map_cache.get, key)
+        record_cache_lookup("map", cached is not None)
+        if cached is not None:
+            return SearchResult(
+                response=cached[0],
+                context_data=context_data,
+                context_text=context_data,
+                completion_time=time.time() - start_time,
+                llm_calls=0,
+                prompt_tokens=0,
+            )
+
+        search_prompt = ""
+        try:
+            search_prompt = self.map_system_prompt.format(context_data=context_data)
+            search_messages = [
+                {"role": "system", "content": search_prompt},
+                {"role": "user", "content": query},
+            ]
+            async with self.semaphore:
+                search_response = await self.llm.agenerate(
+                    messages=search_messages, streaming=False, **llm_kwargs
+                )
+                log.info("Map response: %s", search_response)
+            try:
+                processed_response = self.parse_search_response(search_response)
+            except ValueError:
+                log.warning(
+                    "Warning: Error parsing search response json - skipping this batch"
+                )
+                processed_response = []
+
+            prompt_tokens = num_tokens(search_prompt, self.token_encoder)
+            if _cacheable(search_response, processed_response):
+                await asyncio.to_thread(
+                    self.map_cache.set, key, processed_response, prompt_tokens
+                )
+            return SearchResult(
+                response=processed_response,
+                context_data=context_data,
+                context_text=context_data,
+                completion_time=time.time() - start_time,
+                llm_calls=1,
+                prompt_tokens=prompt_tokens,
+            )
+
+        except Exception:
+            log.exception("Exception in _map_response_single_batch")
+            return SearchResult(
+                response=[{"answer": "", "score": 0}],
+                context_data=context_data,
+                context_text=context_data,
+                completion_time=time.time() - start_time,
+                llm_calls=1,
+                prompt_tokens=num_tokens(search_prompt, self.token_encoder),
+            )
+
+    @timed("reduce")
+    async def _reduce_response(self, *args, **kwargs) -> SearchResult:
+        return await super()._reduce_response(*args, **kwargs)
+
+    async def amap(self, query: str) -> list[SearchResult]:
+        """Run only the map phase for query, filling the map result cache."""
+        context_chunks, _ = self.context_builder.build_context(
+            **self.context_builder_params
+        )
+        with stage("map"):
+            return await asyncio.gather(*[
+                self._map_response_single_batch(
+                    context_data=data, query=query, **self.map_llm_params
+                )
+                for data in context_chunks
+            ])
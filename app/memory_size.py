@@ -0,0 +1,38 @@
+import sys
+from dataclasses import fields, is_dataclass
+
+import numpy as np
+import pandas as pd
+
+
+def approx_size(value, records: bool = True) -> int:
+    """Rough resident size of value, strings, arrays and tables dominate.
+
+    With records=False, dataclass instances are taken to be artifact records the
+    index already accounts for and only their references are counted.
+    """
+    if isinstance(value, str):
+        return sys.getsizeof(value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        # a Series reports a single int, not one per column
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, list | tuple | set | frozenset):
+        # float embeddings: 8 byte pointer plus a 24 byte float object each
+        if value and isinstance(value, list | tuple) and isinstance(value[0], float):
+            return sys.getsizeof(value) + 24 * len(value)
+        return sys.getsizeof(value) + sum(approx_size(item, records) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            approx_size(k, records) + approx_size(v, records) for k, v in value.items()
+        )
+    if is_dataclass(value):
+        if not records:
+            return 0
+        return sys.getsizeof(value) + sum(
+            approx_size(getattr(value, f.name)) for f in fields(value)
+        )
+    return sys.getsizeof(value)
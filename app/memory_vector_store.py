@@ -0,0 +1,170 @@
+import os
+import sys
+from typing import Any
+
+import numpy as np
+
+from graphrag.model.types import TextEmbedder
+from graphrag.vector_stores import (
+    BaseVectorStore,
+    VectorStoreDocument,
+    VectorStoreSearchResult,
+)
+
+from memory_size import approx_size
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def write_npy(path: str, matrix: np.ndarray):
+    """Write matrix to path atomically, readers never map a partial file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        np.save(file, matrix)
+    os.replace(tmp_path, path)
+
+
+class InMemoryVectorStore(BaseVectorStore):
+    """Exact cosine top-k over a normalized float32 matrix held in process.
+
+    Drop-in for LanceDBVectorStore at the entity counts of one index run, where a
+    matrix product over every row is cheaper than a LanceDB round trip. The
+    matrix can be memory-mapped from a .npy file so processes serving the same
+    index share its pages. Scores are cosine similarities; for unit-length
+    embeddings that ranks documents like LanceDB's L2 distance.
+    """
+
+    def __init__(self, collection_name: str, **kwargs: Any):
+        super().__init__(collection_name=collection_name, **kwargs)
+        self.ids: list[str | int] = []
+        self.texts: list[str | None] = []
+        self.attributes: list[dict] = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+
+    def connect(self, **kwargs: Any) -> None:
+        """Nothing to connect to, documents live in this process."""
+
+    def load_documents(
+        self, documents: list[VectorStoreDocument], overwrite: bool = True
+    ) -> None:
+        documents = [
+            document for document in documents if document.vector is not None
+        ]
+        if not overwrite and len(self.ids):
+            documents = self.documents() + documents
+        self.load_arrays(
+            ids=[document.id for document in documents],
+            texts=[document.text for document in documents],
+            attributes=[document.attributes for document in documents],
+            vectors=np.array(
+                [document.vector for document in documents], dtype=np.float32
+            ),
+        )
+
+    def load_arrays(
+        self,
+        ids: list,
+        texts: list,
+        attributes: list[dict],
+        vectors: np.ndarray,
+        normalized: bool = False,
+    ):
+        """Load documents column-wise, vectors is kept as is when already normalized (e.g. a memory map)."""
+        self.ids = list(ids)
+        self.texts = list(texts)
+        self.attributes = list(attributes)
+        self.vectors = vectors if normalized else normalize_rows(vectors)
+
+    @property
+    def nbytes(self) -> int:
+        # ids and texts are the entity records' own strings
+        return (
+            self.vectors.nbytes
+            + sys.getsizeof(self.ids)
+            + sys.getsizeof(self.texts)
+            + approx_size(self.attributes)
+        )
+
+    def documents(self) -> list[VectorStoreDocument]:
+        return [self._document(row) for row in range(len(self.ids))]
+
+    def _document(self, row: int, with_vector: bool = True) -> VectorStoreDocument:
+        return VectorStoreDocument(
+            id=self.ids[row],
+            text=self.texts[row],
+            vector=self.vectors[row].tolist() if with_vector else None,
+            attributes=self.attributes[row],
+        )
+
+    def filter_by_id(self, include_ids: list[str] | list[int]) -> Any:
+        """Boolean row mask of include_ids, None for every row.
+
+        The store is shared by every query of the process, so the mask is not
+        kept; pass include_ids to the search call instead.
+        """
+        if len(include_ids) == 0:
+            return None
+        include = set(include_ids)
+        return np.array([id_ in include for id_ in self.ids])
+
+    def similarity_search_by_vectors(
+        self,
+        query_embeddings: list[list[float]] | np.ndarray,
+        k: int = 10,
+        include_ids: list[str] | list[int] | None = None,
+    ) -> list[list[VectorStoreSearchResult]]:
+        """Top-k documents for each query vector, all scored with one matrix product.
+
+        With include_ids, only those documents are searched.
+        """
+        if not len(self.ids):
+            return [[] for _ in query_embeddings]
+        queries = normalize_rows(np.atleast_2d(np.asarray(query_embeddings)))
+        scores = queries @ self.vectors.T
+        row_mask = self.filter_by_id(include_ids or [])
+        if row_mask is not None:
+            scores[:, ~row_mask] = -np.inf
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        # results leave the vector out, entity mapping only reads the ids and
+        # converting it to a float list would cost more than the search
+        results = []
+        for query_scores, rows in zip(scores, top):
+            rows = rows[np.argsort(-query_scores[rows], kind="stable")]
+            results.append(
+                [
+                    VectorStoreSearchResult(
+                        document=self._document(row, with_vector=False),
+                        score=float(query_scores[row]),
+                    )
+                    for row in rows
+                    if np.isfinite(query_scores[row])
+                ]
+            )
+        return results
+
+    def similarity_search_by_vector(
+        self,
+        query_embedding: list[float],
+        k: int = 10,
+        include_ids: list[str] | list[int] | None = None,
+        **kwargs: Any,
+    ) -> list[VectorStoreSearchResult]:
+        return self.similarity_search_by_vectors([query_embedding], k, include_ids)[0]
+
+    def similarity_search_by_text(
+        self,
+        text: str,
+        text_embedder: TextEmbedder,
+        k: int = 10,
+        include_ids: list[str] | list[int] | None = None,
+        **kwargs: Any,
+    ) -> list[VectorStoreSearchResult]:
+        query_embedding = text_embedder(text)
+        if query_embedding:
+            return self.similarity_search_by_vector(query_embedding, k, include_ids)
+        return []
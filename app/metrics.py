@@ -0,0 +1,296 @@
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Awaitable
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, TypeVar
+
+import httpx
+
+from graphrag.query.llm.text_utils import num_tokens
+from graphrag.query.structured_search.base import SearchResult
+
+log = logging.getLogger(__name__)
+
+# when set, the Prometheus text exposition is rewritten here after every query
+METRICS_FILE = os.environ.get("GRAPHRAG_METRICS_FILE")
+# when set, start_metrics_server serves /metrics on this port
+METRICS_PORT = os.environ.get("GRAPHRAG_METRICS_PORT")
+# loopback only by default, like the query API
+METRICS_HOST = os.environ.get("GRAPHRAG_METRICS_HOST", "127.0.0.1")
+
+# status codes the openai client retries on
+RETRY_STATUS_CODES = {408, 409, 429}
+
+T = TypeVar("T")
+
+
+@dataclass
+class QueryMetrics:
+    """Stage timings and counters collected while answering one question."""
+
+    search_type: str = ""
+    question: str = ""
+    started_at: float = field(default_factory=time.time)
+    stages: dict[str, float] = field(default_factory=dict)
+    counters: dict[str, int] = field(default_factory=dict)
+
+    def add_time(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def incr(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_cache_lookup(self, cache: str, hit: bool):
+        self.incr(f"{cache}_cache_{'hits' if hit else 'misses'}")
+
+    def mark(self, name: str):
+        """Record the time elapsed since the query started, once."""
+        self.stages.setdefault(name, time.time() - self.started_at)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    @contextmanager
+    def activate(self):
+        """Make this the metrics object that nested code reports into."""
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    async def run(self, awaitable: Awaitable[T]) -> T:
+        """Await awaitable with this metrics object active, for use as its own task."""
+        _current.set(self)
+        return await awaitable
+
+    def finish(self, result: SearchResult | None = None, token_encoder=None):
+        """Record the totals of a finished query, log them and update the process metrics."""
+        self.stages["total"] = time.time() - self.started_at
+        if result is not None:
+            self.incr("llm_calls", result.llm_calls)
+            self.incr("prompt_tokens", result.prompt_tokens)
+            if token_encoder is not None and isinstance(result.response, str):
+                self.incr(
+                    "completion_tokens", num_tokens(result.response, token_encoder)
+                )
+        registry.record(self)
+        log.info(
+            json.dumps({
+                "event": "query_metrics",
+                **self.to_dict(),
+                **question_fields(self.question),
+            })
+        )
+        if METRICS_FILE:
+            registry.write(METRICS_FILE)
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def question_fields(question: str) -> dict[str, Any]:
+    """What the logs keep of a question, which may name a patient: a digest and its length."""
+    return {
+        "question": hashlib.sha256(question.encode("utf-8")).hexdigest()[:16],
+        "question_chars": len(question),
+    }
+
+
+_current: ContextVar[QueryMetrics | None] = ContextVar("query_metrics", default=None)
+
+
+def current_metrics() -> QueryMetrics | None:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block into the active query's metrics, a no-op outside of a query."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    with metrics.stage(name):
+        yield
+
+
+def timed(name: str):
+    """Decorate a function or coroutine function so each call is timed as a stage."""
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def incr(name: str, value: int = 1):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.incr(name, value)
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.record_cache_lookup(cache, hit)
+
+
+class MetricsRegistry:
+    """Process-wide totals over all finished queries, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queries: dict[str, int] = {}
+        self.stage_seconds: dict[tuple[str, str], float] = {}
+        self.stage_counts: dict[tuple[str, str], int] = {}
+        self.counters: dict[tuple[str, str], int] = {}
+        self.last: QueryMetrics | None = None
+
+    def record(self, metrics: QueryMetrics):
+        search_type = metrics.search_type
+        with self._lock:
+            self.queries[search_type] = self.queries.get(search_type, 0) + 1
+            for name, seconds in metrics.stages.items():
+                key = (search_type, name)
+                self.stage_seconds[key] = self.stage_seconds.get(key, 0.0) + seconds
+                self.stage_counts[key] = self.stage_counts.get(key, 0) + 1
+            for name, value in metrics.counters.items():
+                key = (search_type, name)
+                self.counters[key] = self.counters.get(key, 0) + value
+            self.last = metrics
+
+    def render(self) -> str:
+        with self._lock:
+            lines = ["# TYPE graphrag_queries_total counter"]
+            lines += [
+                f'graphrag_queries_total{{search_type="{search_type}"}} {count}'
+                for search_type, count in sorted(self.queries.items())
+            ]
+            lines.append("# TYPE graphrag_stage_seconds summary")
+            for (search_type, name), seconds in sorted(self.stage_seconds.items()):
+                labels = f'search_type="{search_type}",stage="{name}"'
+                lines.append(f"graphrag_stage_seconds_sum{{{labels}}} {seconds:.6f}")
+                lines.append(
+                    f"graphrag_stage_seconds_count{{{labels}}} "
+                    f"{self.stage_counts[(search_type, name)]}"
+                )
+            for (search_type, name), value in sorted(self.counters.items()):
+                lines.append(
+                    f'graphrag_{name}_total{{search_type="{search_type}"}} {value}'
+                )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(self.render())
+            os.replace(tmp_path, path)
+        except OSError:
+            log.warning("Could not write metrics to %s", path, exc_info=True)
+
+
+registry = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: ThreadingHTTPServer | None = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(
+    port: str | int | None = METRICS_PORT, host: str = METRICS_HOST
+):
+    """Serve /metrics on port in a background thread, once per process. Does nothing without a port."""
+    global _server
+    if not port:
+        return
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+
+
+def _request_kind(request: httpx.Request) -> str:
+    return "embedding" if request.url.path.endswith("/embeddings") else "chat"
+
+
+def _on_request(request: httpx.Request):
+    request.extensions["metrics_start"] = time.perf_counter()
+    incr(f"{_request_kind(request)}_requests")
+
+
+def _on_response(response: httpx.Response):
+    request = response.request
+    kind = _request_kind(request)
+    if response.status_code in RETRY_STATUS_CODES or response.status_code >= 500:
+        incr(f"{kind}_retries")
+    # embedding responses are small, time to headers is the whole call
+    if kind == "embedding" and "metrics_start" in request.extensions:
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.add_time(
+                "query_embedding",
+                time.perf_counter() - request.extensions["metrics_start"],
+            )
+
+
+async def _on_request_async(request: httpx.Request):
+    _on_request(request)
+
+
+async def _on_response_async(response: httpx.Response):
+    _on_response(response)
+
+
+# httpx event hooks that count LLM and embedding requests and retries against the active query
+HTTP_EVENT_HOOKS = {"request": [_on_request], "response": [_on_response]}
+ASYNC_HTTP_EVENT_HOOKS = {
+    "request": [_on_request_async],
+    "response": [_on_response_async],
+}
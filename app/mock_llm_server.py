@@ -0,0 +1,224 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+EMBEDDING_DIM = 1536
+
+MAP_RESPONSE = {
+    "points": [
+        {
+            "description": "John Doe is receiving weekly cognitive behavioral therapy for anxiety and depression [Data: Reports (1, 0)]",
+            "score": 80,
+        },
+        {
+            "description": "His mother Jane Doe is closely involved in his care [Data: Reports (0)]",
+            "score": 40,
+        },
+    ]
+}
+
+ANSWER = (
+    "John Doe is a 13-year-old patient being treated for anxiety and depression. "
+    "He attends weekly cognitive behavioral therapy sessions and practises breathing "
+    "exercises, and his mother Jane Doe supports him at home and with his school "
+    "[Data: Reports (0, 1); Entities (6, 67)]."
+)
+
+
+class MockLLMSettings:
+    """Latency and failure profile of the mock endpoints."""
+
+    def __init__(
+        self,
+        chat_latency: float = 0.5,
+        embedding_latency: float = 0.05,
+        token_latency: float = 0.01,
+        jitter: float = 0.2,
+        rate_limit_probability: float = 0.0,
+        retry_after: float = 1.0,
+        seed: int | None = None,
+    ):
+        self.chat_latency = chat_latency
+        self.embedding_latency = embedding_latency
+        self.token_latency = token_latency
+        self.jitter = jitter
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self, base: float) -> float:
+        """base seconds scaled by a random factor in [1 - jitter, 1 + jitter]."""
+        with self._lock:
+            return max(0.0, base * (1 + self.random.uniform(-self.jitter, self.jitter)))
+
+    def rate_limited(self) -> bool:
+        with self._lock:
+            return self.random.random() < self.rate_limit_probability
+
+
+def _embedding(text: str) -> list[float]:
+    # stable per input so repeated questions embed identically
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """Speaks enough of the OpenAI/Azure chat completion and embedding API for graphrag search."""
+
+    protocol_version = "HTTP/1.1"
+    settings: MockLLMSettings = MockLLMSettings()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: dict | None = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, data: str):
+        chunk = f"data: {data}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+
+        if self.settings.rate_limited():
+            self._send_json(
+                429,
+                {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                {"Retry-After": str(self.settings.retry_after)},
+            )
+            return
+
+        if self.path.split("?")[0].endswith("/embeddings"):
+            self._embeddings(request)
+        else:
+            self._chat_completion(request)
+
+    def _embeddings(self, request: dict):
+        time.sleep(self.settings.delay(self.settings.embedding_latency))
+        inputs = request["input"]
+        inputs = inputs if isinstance(inputs, list) else [inputs]
+        self._send_json(
+            200,
+            {
+                "object": "list",
+                "model": request.get("model", "mock"),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": _embedding(str(text))}
+                    for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            },
+        )
+
+    def _chat_completion(self, request: dict):
+        time.sleep(self.settings.delay(self.settings.chat_latency))
+        model = request.get("model", "mock")
+        if request.get("response_format", {}).get("type") == "json_object":
+            content = json.dumps(MAP_RESPONSE)
+        else:
+            content = ANSWER
+
+        if not request.get("stream"):
+            self._send_json(
+                200,
+                {
+                    "id": "mock",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                },
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = content.split(" ")
+        for i, word in enumerate(words):
+            delta = {"content": word if i == len(words) - 1 else f"{word} "}
+            self._send_chunk(
+                json.dumps({
+                    "id": "mock",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                })
+            )
+            time.sleep(self.settings.delay(self.settings.token_latency))
+        self._send_chunk(
+            json.dumps({
+                "id": "mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            })
+        )
+        self._send_chunk("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def serve(host: str, port: int, settings: MockLLMSettings):
+    handler = type("ConfiguredMockLLMHandler", (MockLLMHandler,), {"settings": settings})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    print(f"Mock LLM server listening on http://{host}:{port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="local stand-in for the Azure OpenAI chat and embedding endpoints"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chat-latency", type=float, default=0.5, help="seconds before the first chat token")
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--token-latency", type=float, default=0.01, help="seconds between streamed tokens")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative latency jitter, 0.2 means +-20%%")
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    serve(
+        args.host,
+        args.port,
+        MockLLMSettings(
+            chat_latency=args.chat_latency,
+            embedding_latency=args.embedding_latency,
+            token_latency=args.token_latency,
+            jitter=args.jitter,
+            rate_limit_probability=args.rate_limit_probability,
+            retry_after=args.retry_after,
+            seed=args.seed,
+        ),
+    )
@@ -1,33 +1,27 @@
+import uuid
+
 import streamlit as st
 
-from global_query import execute_global_query
-from local_query import execute_local_query
-import asyncio
+from backend import get_query_backend, start_warm_up
+from questions import INTAKE_QUESTIONS
+from report_export import EXPORT_FORMATS, ReportExporter
 import os
-from datetime import datetime
-from fpdf import FPDF
 
+# search modules (graphrag, pandas, tiktoken, the OpenAI SDK) are imported by
+# get_query_backend on the search path only; start importing them and loading
+# the default index in the background while the first page renders
+start_warm_up()
 
 if "run_once" not in st.session_state:
     st.session_state["run_once"] = True
 
+# names this browser session's conversation, local search reuses the context of its earlier turns
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
+
 # Specify the directory containing the text files
 TEXT_FILES_DIR = "./input/"
 
-# Get a list of all .txt files in the directory
-txt_files = [f for f in os.listdir(TEXT_FILES_DIR) if f.endswith(".txt")]
-
-
-# Cache the main function's response using the st.cache_data decorator
-@st.cache_data(show_spinner=False)
-def get_cached_global_response(question_str):
-    return asyncio.run(execute_global_query(question=question_str, mock=False))
-
-
-@st.cache_data(show_spinner=False)
-def get_cached_local_response(question_str):
-    return asyncio.run(execute_local_query(question=question_str, mock=False))
-
 
 # Tab selector
 tab = st.sidebar.radio("Select a tab", ["Search Documents", "View Documents"])
@@ -44,13 +38,34 @@ Local Search focuses on a specific subgraph or a local neighborhood of nodes wit
 Global Search is used when the query requires a broad understanding and connections from various parts of the graph. It’s useful for queries that are not highly specific and benefit from a wider context. Queries such as “Explain what treatments have been tried and has anything worked?”\n
 
 Note: You will find that you get a Local and Global response for a given question, but for a question like “Explain what treatments have been tried and has anything worked? you will get a better answer if using Global search than Local search. Similarly, for a specific question about date of birth you may or may not get an answer with Global search, because a Local search is more appropriate. 
+
+Auto Search picks Local or Global for each question. When it cannot tell, it starts a Local search, also starts a Global search if Local is slow, and shows the first useful answer.
 """
 
     # Graphrag search type
     search_type = st.sidebar.radio(
-        "Type of Search", ["Global", "Local"], help=help_text
+        "Type of Search", ["Auto", "Global", "Local"], help=help_text
     )
 
+    # waits for the imports when the warm-up thread has not finished them yet
+    query_backend = get_query_backend()
+
+    # Patient index, each index run is loaded on first use
+    indexes, default_index = query_backend.list_indexes()
+    index_id = default_index
+    if len(indexes) > 1:
+        index_id = st.sidebar.selectbox(
+            "Patient index",
+            indexes,
+            index=indexes.index(default_index) if default_index in indexes else 0,
+        )
+    if st.session_state.get("index_id", index_id) != index_id:
+        # a different patient starts a new conversation with its own intake questions
+        st.session_state.messages = []
+        st.session_state["run_once"] = True
+        st.session_state.pop("last_metrics", None)
+    st.session_state["index_id"] = index_id
+
     # Initialize chat history
     if "messages" not in st.session_state:
         st.session_state.messages = []
@@ -65,30 +80,15 @@ Note: You will find that you get a Local and Global response for a given questio
 
         # Init questions
 
-        user_q_list = [
-            {
-                "question": "What is the patient's name, age and date of birth, if known?",
-                "type": "local",
-            },
-            {"question": "Who does the patient live with if known", "type": "local"},
-            {
-                "question": "What is the patient's early development history if known i.e. traumas, significant events, what school they went to.",
-                "type": "global",
-            },
-            {"question": "Why is the patient coming to the clinic?", "type": "global"},
-            {
-                "question": "Have social services been involved or has the patient had other early help",
-                "type": "global",
-            },
-            {"question": "What is the patient's condition history.", "type": "global"},
-            {
-                "question": "What drugs has the patient been prescribed previously if known",
-                "type": "local",
-            },
-            {"question": "What does the patient want?", "type": "global"},
-        ]
-
-        for q in user_q_list:
+        user_q_list = INTAKE_QUESTIONS
+
+        # run the whole batch concurrently on the service loop, the page waits for the slowest search only
+        with st.spinner("Model is working on it..."):
+            results = query_backend.run_batch(
+                [(q["question"], q["type"]) for q in user_q_list], index_id=index_id
+            )
+
+        for q, result in zip(user_q_list, results):
 
             # Display user message in chat message container
             with st.chat_message("user"):
@@ -96,23 +96,14 @@ Note: You will find that you get a Local and Global response for a given questio
             # Add user message to chat history
             st.session_state.messages.append({"role": "user", "content": q["question"]})
 
-            # response = get_cached_response(prompt)
-            # output = "This is just a test"
-
-            try:
-                with st.spinner("Model is working on it..."):
-                    if q["type"] == "global":
-                        result = get_cached_global_response(question_str=q["question"])
-                    elif q["type"] == "local":
-                        result = get_cached_local_response(question_str=q["question"])
-                    output = result.response
-                    # st.subheader(f":blue[{i}]")
-                    # st.write(reponse.response)
-            except Exception as e:
-                st.error(f"An error occurred: {e}")
+            if isinstance(result, Exception):
+                st.error(f"An error occurred: {result}")
                 st.error(
                     "Oops, the GPT response resulted in an error :( Please try again with a different question."
                 )
+                continue
+
+            output = result.response
             # Display assistant response in chat message container
             with st.chat_message("assistant"):
                 st.markdown(output)
@@ -126,163 +117,75 @@ Note: You will find that you get a Local and Global response for a given questio
         # Add user message to chat history
         st.session_state.messages.append({"role": "user", "content": additional_q})
 
-        # response = get_cached_response(prompt)
-        # output = "This is just a test"
-
-        try:
-            with st.spinner("Model is working on it..."):
-                if search_type == "Global":
-                    result = get_cached_global_response(question_str=additional_q)
-                elif search_type == "Local":
-                    result = get_cached_local_response(question_str=additional_q)
-
-                output = result.response
-                # st.subheader(f":blue[{i}]")
-                # st.write(reponse.response)
-        except Exception as e:
-            st.error(f"An error occurred: {e}")
-            st.error(
-                "Oops, the GPT response resulted in an error :( Please try again with a different question."
-            )
-
-        # Display assistant response in chat message container
+        # Stream the answer into the assistant message as the tokens arrive
+        output = ""
+        metrics = {}
         with st.chat_message("assistant"):
-            st.markdown(output)
+            try:
+                with st.spinner("Model is working on it..."):
+                    stream = query_backend.stream_query(
+                        additional_q,
+                        search_type.lower(),
+                        metrics=metrics,
+                        index_id=index_id,
+                        # the conversation before this question
+                        history=st.session_state.messages[:-1],
+                        session_id=st.session_state["session_id"],
+                    )
+                    output = st.write_stream(stream)
+                st.session_state["last_metrics"] = metrics
+            except Exception as e:
+                st.error(f"An error occurred: {e}")
+                st.error(
+                    "Oops, the GPT response resulted in an error :( Please try again with a different question."
+                )
         # Add assistant response to chat history
-        st.session_state.messages.append({"role": "assistant", "content": output})  #
-
-    # # Function to format the chat history into a string
-    # def format_messages_for_text(messages):
-    #     formatted = []
-    #     for msg in messages:
-    #         role = "User" if msg["role"] == "user" else "Assistant"
-    #         content = msg["content"]
-    #         formatted.append(f"{role}: {content}")
-    #     return "\n".join(formatted)
-
-    # # Format messages for the text file
-    # if st.session_state.messages:
-    #     messages_str = format_messages_for_text(st.session_state.messages)
-
-    #     # Convert the string to bytes
-    #     messages_bytes = messages_str.encode("utf-8")
-
-    #     # Create a download button for the text file
-    #     st.sidebar.download_button(
-    #         label="Download Chat History as Text File",
-    #         data=messages_bytes,
-    #         file_name="chat_history.txt",
-    #         mime="text/plain",
-    #     )
-    # else:
-    #     st.write("No messages stored yet.")
-
-    # Function to format the chat history into a PDF
-    def format_messages_for_pdf(messages):
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_auto_page_break(auto=True, margin=15)
-
-        # Set font for the header
-        pdf.set_font("Arial", "B", 16)
-        pdf.cell(0, 10, "Summary Report", ln=True, align="C")
-
-        # Add date
-        date_str = f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        pdf.set_font("Arial", size=12)
-        pdf.cell(0, 10, date_str, ln=True, align="C")
-        pdf.ln(10)  # Add some space after the date
-
-        # Process each message and add it to the PDF
-        for i in range(0, len(messages), 2):
-            user_msg = messages[i]
-            if user_msg["role"] == "user":
-                pdf.set_font("Arial", "B", 14)
-                question = f"Question {i // 2 + 1}:"
-                pdf.cell(0, 10, question, ln=True)
-                pdf.set_font("Arial", size=12)
-                pdf.multi_cell(0, 10, user_msg["content"])
-                pdf.ln(5)
-
-            # Ensure there's a corresponding assistant response
-            if i + 1 < len(messages):
-                assistant_msg = messages[i + 1]
-                if assistant_msg["role"] == "assistant":
-                    pdf.set_font("Arial", "B", 14)
-                    response_header = "Summary:"
-                    pdf.cell(0, 10, response_header, ln=True)
-                    pdf.set_font("Arial", size=12)
-                    pdf.multi_cell(0, 10, assistant_msg["content"])
-                    pdf.ln(10)
-
-        return pdf.output(dest="S").encode("latin1")
-
-    # Format messages for the PDF file
+        st.session_state.messages.append({"role": "assistant", "content": output})
+
+    # Timing breakdown of the last streamed answer
+    if last_metrics := st.session_state.get("last_metrics"):
+        with st.sidebar.expander("Last answer timings"):
+            st.table(
+                {
+                    "stage": list(last_metrics["stages"]),
+                    "seconds": [round(s, 3) for s in last_metrics["stages"].values()],
+                }
+            )
+            st.json(last_metrics["counters"])
+
+    # Chat history exports are rendered on a worker thread, and only once one was
+    # asked for; after that each new answer is added in the background
+    exporter = st.session_state.setdefault("report_exporter", ReportExporter())
     if st.session_state.messages:
-        messages_bytes = format_messages_for_pdf(st.session_state.messages)
-
-        # Create a download button for the PDF file
-        st.sidebar.download_button(
-            label="Download Summary Report",
-            data=messages_bytes,
-            file_name="chat_history.pdf",
-            mime="application/pdf",
-        )
+        exporter.refresh(st.session_state.messages)
+        export_name = st.sidebar.selectbox("Report format", list(EXPORT_FORMATS))
+        export_format = EXPORT_FORMATS[export_name]
+        report = exporter.ready(export_name, st.session_state.messages)
+        if report is None and st.sidebar.button("Prepare report"):
+            try:
+                with st.spinner("Preparing the report..."):
+                    report = exporter.export(
+                        export_name, st.session_state.messages
+                    ).result()
+            except Exception as e:
+                st.sidebar.error(f"Could not prepare the report: {e}")
+        if report is not None:
+            st.sidebar.download_button(
+                label=export_format.label,
+                data=report,
+                file_name=export_format.file_name,
+                mime=export_format.mime,
+            )
     else:
         st.write("No messages stored yet.")
 
-    # import streamlit as st
-    # from datetime import datetime
-
-    # # Function to format the chat history into a markdown string
-    # def format_messages_for_markdown(messages):
-    #     formatted = []
-    #     # Add a header and date to the markdown
-    #     header = "# Chat History Report"
-    #     date_str = f"**Date:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-    #     formatted.append(header)
-    #     formatted.append(date_str)
-    #     formatted.append("\n")
-
-    #     # Process each message and format as markdown sections
-    #     for i in range(0, len(messages), 2):
-    #         user_msg = messages[i]
-    #         if user_msg["role"] == "user":
-    #             question = f"## Question {i // 2 + 1}\n{user_msg['content']}"
-    #             formatted.append(question)
-
-    #         # Ensure there's a corresponding assistant response
-    #         if i + 1 < len(messages):
-    #             assistant_msg = messages[i + 1]
-    #             if assistant_msg["role"] == "assistant":
-    #                 response = f"### Response\n{assistant_msg['content']}"
-    #                 formatted.append(response)
-
-    #         formatted.append("\n")
-
-    #     return "\n".join(formatted)
-
-    # # Format messages for the markdown file
-    # if st.session_state.messages:
-    #     messages_str = format_messages_for_markdown(st.session_state.messages)
-
-    #     # Convert the string to bytes
-    #     messages_bytes = messages_str.encode("utf-8")
-
-    #     # Create a download button for the markdown file
-    #     st.sidebar.download_button(
-    #         label="Download Chat History as Markdown File",
-    #         data=messages_bytes,
-    #         file_name="chat_history.md",
-    #         mime="text/markdown",
-    #     )
-    # else:
-    #     st.write("No messages stored yet.")
-
 
 elif tab == "View Documents":
     st.title("Document Viewer")
 
+    # Get a list of all .txt files in the directory
+    txt_files = [f for f in os.listdir(TEXT_FILES_DIR) if f.endswith(".txt")]
+
     if txt_files:
         # Dropdown menu to select a file
         selected_file = st.selectbox("Select a text file", txt_files)
@@ -0,0 +1,48 @@
+import asyncio
+
+from global_query import build_global_search, select_question_reports
+from index_registry import aget_index
+from questions import INTAKE_QUESTIONS
+from rate_limit import BACKGROUND, request_priority
+
+
+async def prewarm_map_cache(questions: list[str], index_id: str | None = None) -> int:
+    """Run the global search map phase for each question so later queries go straight to reduce."""
+    artifacts = await aget_index(index_id)
+
+    llm_calls = 0
+    for question in questions:
+        # yield the LLM budget to interactive queries running in the same process
+        with request_priority(BACKGROUND):
+            # the reports a live query would map, so its batches and cache keys match
+            report_ids = await select_question_reports(artifacts, question)
+            search_engine = build_global_search(artifacts, report_ids)
+            map_responses = await search_engine.amap(question)
+        calls = sum(response.llm_calls for response in map_responses)
+        print(f"{len(map_responses)} batches, {calls} map calls: {question}")
+        llm_calls += calls
+    return llm_calls
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="fill the global search map cache after an indexing run"
+    )
+    parser.add_argument(
+        "--question",
+        action="append",
+        dest="questions",
+        help="question to prewarm, defaults to the global intake questions",
+    )
+    parser.add_argument(
+        "--index", dest="index_id", help="index run to prewarm, defaults to the default index"
+    )
+    args = parser.parse_args()
+
+    questions = args.questions or [
+        q["question"] for q in INTAKE_QUESTIONS if q["type"] == "global"
+    ]
+    llm_calls = asyncio.run(prewarm_map_cache(questions, args.index_id))
+    print(f"Prewarmed {len(questions)} questions with {llm_calls} map calls")
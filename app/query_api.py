@@ -0,0 +1,342 @@
+import asyncio
+import hmac
+import ipaddress
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+
+import tornado.web
+from tornado.iostream import StreamClosedError
+
+from graphrag.query.structured_search.base import SearchResult
+
+from batch_query import execute_query
+from global_query import stream_global_query
+from index_registry import (
+    aget_index,
+    default_index_id,
+    index_input_dir,
+    index_registry,
+    list_indexes,
+)
+from local_query import stream_local_query
+from metrics import QueryMetrics, registry
+from query_router import stream_auto_query
+
+log = logging.getLogger(__name__)
+
+# loopback only by default, any other address also needs GRAPHRAG_API_TOKEN
+API_HOST = os.environ.get("GRAPHRAG_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("GRAPHRAG_API_PORT", 8000))
+# with a token set every request needs an "Authorization: Bearer <token>" header
+API_TOKEN = os.environ.get("GRAPHRAG_API_TOKEN") or None
+# searches running at once, further requests wait in the queue
+API_MAX_CONCURRENCY = int(os.environ.get("GRAPHRAG_API_MAX_CONCURRENCY", 8))
+# requests allowed to wait for a slot before new ones are turned away with 503
+API_MAX_QUEUE = int(os.environ.get("GRAPHRAG_API_MAX_QUEUE", 64))
+
+SEARCH_TYPES = ("local", "global", "auto")
+# roles of the conversation history messages
+ROLES = ("user", "assistant")
+
+
+class QueueFull(Exception):
+    pass
+
+
+class QueryQueue:
+    """Bounded admission queue in front of the search engines."""
+
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.running = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.waiting >= self.max_queue:
+            raise QueueFull
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self.semaphore.release()
+
+
+def result_to_dict(result: SearchResult) -> dict:
+    return {
+        "response": result.response,
+        "completion_time": result.completion_time,
+        "llm_calls": result.llm_calls,
+        "prompt_tokens": result.prompt_tokens,
+    }
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class BaseHandler(tornado.web.RequestHandler):
+    # load balancer probes call /health without credentials
+    requires_token = True
+
+    @property
+    def queue(self) -> QueryQueue:
+        return self.application.settings["query_queue"]
+
+    def prepare(self):
+        token = self.application.settings["api_token"]
+        if token is None or not self.requires_token:
+            return
+        authorization = self.request.headers.get("Authorization", "")
+        scheme, _, credentials = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(
+            credentials.encode("utf-8"), token.encode("utf-8")
+        ):
+            self.set_header("WWW-Authenticate", "Bearer")
+            raise tornado.web.HTTPError(401, reason="Missing or invalid bearer token")
+
+    def json_body(self) -> dict:
+        try:
+            body = json.loads(self.request.body or b"{}")
+        except json.JSONDecodeError as e:
+            raise tornado.web.HTTPError(400, reason=f"Invalid JSON: {e}")
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, reason="Body must be a JSON object")
+        return body
+
+    def write_error(self, status_code: int, **kwargs):
+        if status_code == 503:
+            self.set_header("Retry-After", "1")
+        self.finish({"error": self._reason})
+
+
+def _search_type(search_type: str) -> str:
+    if search_type not in SEARCH_TYPES:
+        raise tornado.web.HTTPError(404, reason=f"Unknown search type: {search_type}")
+    return search_type
+
+
+def _index_id(body: dict) -> str:
+    index_id = body.get("index_id") or default_index_id()
+    try:
+        input_dir = index_input_dir(index_id)
+    except ValueError as e:
+        raise tornado.web.HTTPError(400, reason=str(e))
+    if not os.path.isdir(input_dir):
+        raise tornado.web.HTTPError(404, reason=f"Unknown index: {index_id}")
+    return index_id
+
+
+def _question(body: dict) -> str:
+    question = body.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise tornado.web.HTTPError(400, reason="question is required")
+    return question
+
+
+def _history(body: dict) -> list[dict[str, str]] | None:
+    history = body.get("history")
+    if history is None:
+        return None
+    if not isinstance(history, list) or not all(
+        isinstance(turn, dict)
+        and turn.get("role") in ROLES
+        and isinstance(turn.get("content"), str)
+        for turn in history
+    ):
+        raise tornado.web.HTTPError(
+            400, reason="history must be a list of role and content messages"
+        )
+    return history
+
+
+class HealthHandler(BaseHandler):
+    requires_token = False
+
+    def get(self):
+        self.write({
+            "status": "ok",
+            "running": self.queue.running,
+            "queued": self.queue.waiting,
+            "resident_indexes": index_registry.memory_usage(),
+        })
+
+
+class IndexesHandler(BaseHandler):
+    def get(self):
+        self.write({"default": default_index_id(), "indexes": list_indexes()})
+
+
+class MetricsHandler(BaseHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(registry.render())
+
+
+class QueryHandler(BaseHandler):
+    async def post(self, search_type: str):
+        body = self.json_body()
+        question = _question(body)
+        index_id = _index_id(body)
+        try:
+            async with self.queue.slot():
+                result = await execute_query(
+                    question,
+                    _search_type(search_type),
+                    use_cache=body.get("use_cache", True),
+                    index_id=index_id,
+                )
+        except QueueFull:
+            raise tornado.web.HTTPError(503, reason="Query queue is full")
+        self.write(result_to_dict(result))
+
+
+class BatchHandler(BaseHandler):
+    async def post(self):
+        queries = self.json_body().get("queries")
+        if not isinstance(queries, list) or not queries:
+            raise tornado.web.HTTPError(400, reason="queries is required")
+        for query in queries:
+            if not isinstance(query, dict):
+                raise tornado.web.HTTPError(400, reason="queries must be JSON objects")
+            _question(query)
+            _search_type(query.get("type"))
+            query["index_id"] = _index_id(query)
+
+        async def _run(query: dict) -> dict:
+            try:
+                async with self.queue.slot():
+                    result = await execute_query(
+                        query["question"],
+                        query["type"],
+                        use_cache=query.get("use_cache", True),
+                        index_id=query["index_id"],
+                    )
+                return result_to_dict(result)
+            except QueueFull:
+                return {"error": "Query queue is full"}
+            except Exception as e:
+                log.exception("Batch query failed")
+                return {"error": str(e)}
+
+        if self.queue.waiting + len(queries) > self.queue.max_queue:
+            raise tornado.web.HTTPError(503, reason="Query queue is full")
+        results = await asyncio.gather(*[_run(query) for query in queries])
+        self.write({"results": results})
+
+
+class StreamHandler(BaseHandler):
+    """Server-sent events: one token event per chunk, then a done event with the call stats and metrics."""
+
+    async def post(self, search_type: str):
+        body = self.json_body()
+        question = _question(body)
+        index_id = _index_id(body)
+        search_type = _search_type(search_type)
+        # follow-up questions of a conversation, only local search uses them
+        conversation = {}
+        if search_type != "global":
+            conversation = {
+                "history": _history(body),
+                "session_id": body.get("session_id"),
+            }
+        stream_query = {
+            "auto": stream_auto_query,
+            "global": stream_global_query,
+            "local": stream_local_query,
+        }[search_type]
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        metrics = QueryMetrics()
+        try:
+            async with self.queue.slot():
+                stream = stream_query(
+                    question,
+                    use_cache=body.get("use_cache", True),
+                    metrics=metrics,
+                    index_id=index_id,
+                    **conversation,
+                )
+                try:
+                    async for token in stream:
+                        self.write(f"data: {json.dumps({'token': token})}\n\n")
+                        await self.flush()
+                finally:
+                    await stream.aclose()
+            self.write(
+                f"event: done\ndata: {json.dumps({'metrics': metrics.to_dict()})}\n\n"
+            )
+        except QueueFull:
+            raise tornado.web.HTTPError(503, reason="Query queue is full")
+        except StreamClosedError:
+            # the client went away, closing the stream cancelled the search
+            return
+        except Exception as e:
+            log.exception("Streamed query failed")
+            self.write(f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n")
+        self.finish()
+
+
+def make_app(
+    max_concurrency: int = API_MAX_CONCURRENCY,
+    max_queue: int = API_MAX_QUEUE,
+    api_token: str | None = API_TOKEN,
+) -> tornado.web.Application:
+    return tornado.web.Application(
+        [
+            (r"/health", HealthHandler),
+            (r"/metrics", MetricsHandler),
+            (r"/indexes", IndexesHandler),
+            (r"/query/batch", BatchHandler),
+            (r"/query/(\w+)", QueryHandler),
+            (r"/query/(\w+)/stream", StreamHandler),
+        ],
+        query_queue=QueryQueue(max_concurrency, max_queue),
+        api_token=api_token,
+    )
+
+
+async def serve(host: str, port: int, max_concurrency: int, max_queue: int):
+    # the API answers questions about patient records, nothing but this machine
+    # may reach it without a token
+    if API_TOKEN is None and not is_loopback(host):
+        raise SystemExit(
+            f"Set GRAPHRAG_API_TOKEN to serve on {host}, or bind to 127.0.0.1"
+        )
+    # load the default index before taking traffic, others load on first use
+    await aget_index(default_index_id())
+    app = make_app(max_concurrency, max_queue)
+    app.listen(port, address=host)
+    print(f"Query API listening on {host}:{port}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="serve local and global search over HTTP, run from the repository root"
+    )
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--max-concurrency", type=int, default=API_MAX_CONCURRENCY)
+    parser.add_argument("--max-queue", type=int, default=API_MAX_QUEUE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args.host, args.port, args.max_concurrency, args.max_queue))
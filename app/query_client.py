@@ -0,0 +1,143 @@
+import json
+import os
+from collections.abc import Iterator
+from dataclasses import dataclass
+
+import httpx
+
+# a global search with a long reduce phase can take minutes
+REQUEST_TIMEOUT = 300.0
+# bearer token of a query API served beyond localhost
+API_TOKEN = os.environ.get("GRAPHRAG_API_TOKEN") or None
+
+
+class QueryAPIError(Exception):
+    pass
+
+
+@dataclass
+class QueryAnswer:
+    response: str
+    completion_time: float
+    llm_calls: int
+    prompt_tokens: int
+
+
+class QueryAPIClient:
+    """Thin client for query_api.py with the same batch and streaming calls as QueryService.
+
+    Lets the Streamlit UI run without loading any artifacts or search engines itself.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float = REQUEST_TIMEOUT,
+        api_token: str | None = API_TOKEN,
+    ):
+        self.client = httpx.Client(
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            headers={"Authorization": f"Bearer {api_token}"} if api_token else None,
+        )
+
+    def _raise_for_status(self, response: httpx.Response):
+        if response.is_error:
+            response.read()
+            try:
+                message = response.json()["error"]
+            except (ValueError, KeyError):
+                message = response.text
+            raise QueryAPIError(f"{response.status_code}: {message}")
+
+    def health(self) -> dict:
+        response = self.client.get("/health")
+        self._raise_for_status(response)
+        return response.json()
+
+    def list_indexes(self) -> tuple[list[str], str]:
+        """Ids of the indexes the server can answer from, and its default."""
+        response = self.client.get("/indexes")
+        self._raise_for_status(response)
+        body = response.json()
+        return body["indexes"], body["default"]
+
+    def query(
+        self,
+        question: str,
+        search_type: str,
+        use_cache=True,
+        index_id: str | None = None,
+    ) -> QueryAnswer:
+        response = self.client.post(
+            f"/query/{search_type}",
+            json={"question": question, "use_cache": use_cache, "index_id": index_id},
+        )
+        self._raise_for_status(response)
+        return QueryAnswer(**response.json())
+
+    def run_batch(
+        self,
+        queries: list[tuple[str, str]],
+        use_cache=True,
+        index_id: str | None = None,
+    ) -> list:
+        """Answers to (question, type) pairs in order, QueryAPIError in place of failed questions."""
+        response = self.client.post(
+            "/query/batch",
+            json={
+                "queries": [
+                    {
+                        "question": question,
+                        "type": search_type,
+                        "use_cache": use_cache,
+                        "index_id": index_id,
+                    }
+                    for question, search_type in queries
+                ]
+            },
+        )
+        self._raise_for_status(response)
+        return [
+            QueryAPIError(result["error"]) if "error" in result else QueryAnswer(**result)
+            for result in response.json()["results"]
+        ]
+
+    def stream_query(
+        self,
+        question: str,
+        search_type: str,
+        use_cache=True,
+        metrics: dict | None = None,
+        index_id: str | None = None,
+        history: list[dict[str, str]] | None = None,
+        session_id: str | None = None,
+    ) -> Iterator[str]:
+        """Yield answer tokens from the server-sent event stream, metrics is filled in when it ends."""
+        with self.client.stream(
+            "POST",
+            f"/query/{search_type}/stream",
+            json={
+                "question": question,
+                "use_cache": use_cache,
+                "index_id": index_id,
+                "history": history,
+                "session_id": session_id,
+            },
+        ) as response:
+            self._raise_for_status(response)
+            event = "message"
+            for line in response.iter_lines():
+                if line.startswith("event:"):
+                    event = line[len("event:") :].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[len("data:") :])
+                    if event == "error":
+                        raise QueryAPIError(data["error"])
+                    if event == "done":
+                        if metrics is not None:
+                            metrics.update(data["metrics"])
+                        return
+                    yield data["token"]
+                elif not line:
+                    event = "message"
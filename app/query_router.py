@@ -0,0 +1,374 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+
+import numpy as np
+
+from graphrag.query.structured_search.base import SearchResult
+from graphrag.query.structured_search.global_search.search import NO_DATA_ANSWER
+
+from embedding_cache import get_cached_text_embedder
+from global_query import execute_global_query, stream_global_query
+from local_query import execute_local_query, stream_local_query
+from memory_vector_store import normalize_rows
+from metrics import QueryMetrics, question_fields
+from questions import INTAKE_QUESTIONS
+
+log = logging.getLogger(__name__)
+
+# questions scoring within this margin of 0 are routed to both engines
+ROUTER_MARGIN = float(os.environ.get("GRAPHRAG_ROUTER_MARGIN", 0.03))
+# with "0" an undecided question goes to global search only
+ROUTER_HEDGE = os.environ.get("GRAPHRAG_ROUTER_HEDGE", "1") == "1"
+# an undecided question starts with local search and also starts global search
+# when local has not answered within this delay
+ROUTER_HEDGE_DELAY_MS = float(os.environ.get("GRAPHRAG_ROUTER_HEDGE_DELAY_MS", 1000))
+# nearest labelled examples averaged per search type
+ROUTER_NEIGHBOURS = 3
+# score added per matching cue word, positive leans global
+ROUTER_CUE_WEIGHT = 0.02
+
+# labelled questions the router compares new questions with, besides the intake questions
+ROUTE_EXAMPLES = [
+    *((q["question"], q["type"]) for q in INTAKE_QUESTIONS),
+    ("When was the patient born?", "local"),
+    ("What medication dose is the patient on?", "local"),
+    ("Which school does the patient attend?", "local"),
+    ("Who is the patient's social worker?", "local"),
+    ("When was the last therapy session?", "local"),
+    ("Summarize the patient's history.", "global"),
+    ("Explain what treatments have been tried and has anything worked?", "global"),
+    ("What are the main themes across the therapy sessions?", "global"),
+    ("How has the patient progressed over time?", "global"),
+    ("Give an overview of the patient's family situation.", "global"),
+]
+
+# wording that asks about the whole record, or about one fact
+GLOBAL_CUES = re.compile(
+    r"\b(summar\w*|overall|overview|history|themes?|patterns?|progress\w*|"
+    r"over time|across|explain|tried|worked|main|generally|why)\b",
+    re.IGNORECASE,
+)
+LOCAL_CUES = re.compile(
+    r"\b(name|age|born|birth|date|when|who|which|where|dose|dosage|address)\b",
+    re.IGNORECASE,
+)
+# a reply like this, or global search's NO_DATA_ANSWER, does not answer the question
+NO_ANSWER = re.compile(
+    r"\b(i (do not|don't) know|no (relevant )?information|not (mentioned|provided|"
+    r"specified|available)|unable to (answer|determine|find)|cannot be determined)\b",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class Route:
+    # "local", "global", or "hedged" when the router is unsure
+    search_type: str
+    # above 0 leans global
+    score: float
+
+
+class QueryRouter:
+    """Picks local or global search from nearest labelled example questions and cue words.
+
+    The score is the mean similarity of the question to its nearest global
+    examples minus that to its nearest local examples, plus ROUTER_CUE_WEIGHT for
+    every global cue and minus it for every local cue. Scores within the margin
+    of 0 are left undecided.
+    """
+
+    def __init__(
+        self,
+        examples: list[tuple[str, str]] = ROUTE_EXAMPLES,
+        margin: float = ROUTER_MARGIN,
+        hedge: bool = ROUTER_HEDGE,
+    ):
+        self.examples = examples
+        self.margin = margin
+        self.hedge = hedge
+        self._vectors: np.ndarray | None = None
+        self._is_global = np.array([label == "global" for _, label in examples])
+
+    async def _example_vectors(self) -> np.ndarray:
+        if self._vectors is None:
+            embedder = get_cached_text_embedder()
+            vectors = await asyncio.gather(
+                *[embedder.aembed(question) for question, _ in self.examples]
+            )
+            self._vectors = normalize_rows(np.array(vectors, dtype=np.float32))
+        return self._vectors
+
+    async def _similarity_score(self, question: str) -> float:
+        query_embedding = await get_cached_text_embedder().aembed(question)
+        if not query_embedding:
+            return 0.0
+        vectors = await self._example_vectors()
+        scores = vectors @ normalize_rows(np.asarray(query_embedding))
+        nearest = [
+            np.sort(scores[mask])[-ROUTER_NEIGHBOURS:].mean()
+            for mask in (self._is_global, ~self._is_global)
+        ]
+        return float(nearest[0] - nearest[1])
+
+    async def route(self, question: str) -> Route:
+        score = await self._similarity_score(question) + ROUTER_CUE_WEIGHT * (
+            len(GLOBAL_CUES.findall(question)) - len(LOCAL_CUES.findall(question))
+        )
+        if score > self.margin:
+            search_type = "global"
+        elif score < -self.margin:
+            search_type = "local"
+        else:
+            search_type = "hedged" if self.hedge else "global"
+        return Route(search_type=search_type, score=score)
+
+
+query_router = QueryRouter()
+
+
+def answered(result: SearchResult | BaseException | None) -> bool:
+    """Whether a search produced an answer worth returning instead of trying the other engine."""
+    if not isinstance(result, SearchResult) or not isinstance(result.response, str):
+        return False
+    response = result.response.strip()
+    if response == NO_DATA_ANSWER:
+        return False
+    # a long answer that mentions one missing detail still answers the question
+    return bool(response) and not (len(response) < 400 and NO_ANSWER.search(response))
+
+
+def _search(
+    search_type: str,
+    question: str,
+    mock: bool,
+    use_cache: bool,
+    index_id: str | None,
+    searches: list[QueryMetrics],
+    history: list[dict[str, str]] | None = None,
+    session_id: str | None = None,
+):
+    """The query of one engine, its metrics are appended to searches.
+
+    Only local search takes the conversation into account.
+    """
+    search_metrics = QueryMetrics()
+    searches.append(search_metrics)
+    if search_type == "global":
+        return execute_global_query(
+            question,
+            mock=mock,
+            use_cache=use_cache,
+            metrics=search_metrics,
+            index_id=index_id,
+        )
+    return execute_local_query(
+        question,
+        mock=mock,
+        use_cache=use_cache,
+        metrics=search_metrics,
+        index_id=index_id,
+        history=history,
+        session_id=session_id,
+    )
+
+
+async def _hedged_query(
+    question: str,
+    mock: bool,
+    use_cache: bool,
+    index_id: str | None,
+    metrics: QueryMetrics,
+    searches: list[QueryMetrics],
+    history: list[dict[str, str]] | None = None,
+    session_id: str | None = None,
+) -> tuple[SearchResult, str]:
+    """Start local search, add global search after the hedge delay, keep the first useful answer."""
+    tasks: dict[str, asyncio.Task] = {}
+
+    def _start(search_type: str):
+        metrics.incr(f"hedge_{search_type}_started")
+        tasks[search_type] = asyncio.create_task(
+            _search(
+                search_type,
+                question,
+                mock,
+                use_cache,
+                index_id,
+                searches,
+                history,
+                session_id,
+            )
+        )
+
+    def _result(search_type: str) -> SearchResult | BaseException:
+        # only for a finished task
+        task = tasks[search_type]
+        return task.exception() or task.result()
+
+    try:
+        _start("local")
+        done, _ = await asyncio.wait(
+            tasks.values(), timeout=ROUTER_HEDGE_DELAY_MS / 1000
+        )
+        if not done:
+            _start("global")
+        while True:
+            # local first, a cached global answer can still come back before local search
+            for search_type, task in tasks.items():
+                if task.done() and answered(_result(search_type)):
+                    return _result(search_type), search_type
+            running = [task for task in tasks.values() if not task.done()]
+            if running:
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            elif "global" not in tasks:
+                # local search failed or had no answer
+                _start("global")
+            else:
+                break
+        # neither search answered, the local reply is kept over the global one and
+        # an error is only raised when both searches failed
+        for search_type in tasks:
+            result = _result(search_type)
+            if not isinstance(result, BaseException):
+                return result, search_type
+        raise _result("local")
+    finally:
+        for search_type, task in tasks.items():
+            if not task.done():
+                task.cancel()
+                metrics.incr(f"hedge_{search_type}_cancelled")
+
+
+def _record_route(metrics: QueryMetrics, question: str, route: Route):
+    metrics.incr(f"routed_{route.search_type}")
+    log.info(
+        json.dumps({
+            "event": "query_route",
+            **question_fields(question),
+            "route": route.search_type,
+            "score": round(route.score, 4),
+            "seconds": round(metrics.stages.get("route", 0.0), 4),
+        })
+    )
+
+
+def _finish(metrics: QueryMetrics, searches: list[QueryMetrics]):
+    # LLM calls, tokens and cache lookups of the searches, a cancelled search
+    # only reports the lookups it made
+    for search_metrics in searches:
+        for name, value in search_metrics.counters.items():
+            metrics.incr(name, value)
+    metrics.finish()
+
+
+async def execute_auto_query(
+    question: str,
+    mock=False,
+    use_cache=True,
+    metrics: QueryMetrics | None = None,
+    index_id: str | None = None,
+    history: list[dict[str, str]] | None = None,
+    session_id: str | None = None,
+) -> SearchResult:
+    """Answer question with the search engine the router picks for it.
+
+    The query records its route, hedge outcome and latency as search type
+    "auto", the searches it runs also record their own metrics.
+    """
+    metrics = metrics or QueryMetrics()
+    metrics.search_type, metrics.question = "auto", question
+    searches: list[QueryMetrics] = []
+    with metrics.activate():
+        with metrics.stage("route"):
+            route = await query_router.route(question)
+        _record_route(metrics, question, route)
+        with metrics.stage("search"):
+            if route.search_type == "hedged":
+                result, winner = await _hedged_query(
+                    question,
+                    mock,
+                    use_cache,
+                    index_id,
+                    metrics,
+                    searches,
+                    history,
+                    session_id,
+                )
+                metrics.incr(f"hedge_{winner}_answered")
+            else:
+                result = await _search(
+                    route.search_type,
+                    question,
+                    mock,
+                    use_cache,
+                    index_id,
+                    searches,
+                    history,
+                    session_id,
+                )
+    _finish(metrics, searches)
+    return result
+
+
+async def stream_auto_query(
+    question: str,
+    use_cache=True,
+    metrics: QueryMetrics | None = None,
+    index_id: str | None = None,
+    history: list[dict[str, str]] | None = None,
+    session_id: str | None = None,
+) -> AsyncIterator[str]:
+    """Stream the answer of the search engine the router picks.
+
+    A hedged question is answered in one piece, only the answer of the search
+    that wins is worth showing.
+    """
+    metrics = metrics or QueryMetrics()
+    metrics.search_type, metrics.question = "auto", question
+    searches: list[QueryMetrics] = []
+    with metrics.activate():
+        with metrics.stage("route"):
+            route = await query_router.route(question)
+        _record_route(metrics, question, route)
+
+    if route.search_type == "hedged":
+        with metrics.activate():
+            with metrics.stage("search"):
+                result, winner = await _hedged_query(
+                    question,
+                    False,
+                    use_cache,
+                    index_id,
+                    metrics,
+                    searches,
+                    history,
+                    session_id,
+                )
+            metrics.incr(f"hedge_{winner}_answered")
+        metrics.mark("first_token")
+        yield result.response
+    else:
+        searches.append(QueryMetrics())
+        if route.search_type == "global":
+            stream = stream_global_query(
+                question, use_cache=use_cache, metrics=searches[0], index_id=index_id
+            )
+        else:
+            stream = stream_local_query(
+                question,
+                use_cache=use_cache,
+                metrics=searches[0],
+                index_id=index_id,
+                history=history,
+                session_id=session_id,
+            )
+        with metrics.stage("search"):
+            async for token in stream:
+                metrics.mark("first_token")
+                yield token
+    _finish(metrics, searches)
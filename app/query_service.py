@@ -0,0 +1,175 @@
+import asyncio
+import atexit
+import queue
+import threading
+from collections.abc import AsyncIterator, Coroutine, Iterator
+from concurrent.futures import Future
+from typing import Any, TypeVar
+
+from batch_query import BATCH_MAX_CONCURRENCY, execute_batch_queries, execute_query
+from clients import get_chat_llm, get_text_embedder
+from global_query import build_global_search, stream_global_query
+from index_registry import default_index_id, get_index, list_indexes
+from local_query import build_local_search, stream_local_query
+from metrics import QueryMetrics
+from query_router import stream_auto_query
+
+T = TypeVar("T")
+
+_STREAM_END = object()
+
+
+def _load_search_state(index_id: str | None):
+    artifacts = get_index(index_id)
+    # entity store, precounted token counts and the ordered global report batches
+    build_local_search(artifacts)
+    build_global_search(artifacts)
+
+
+async def warm_up(index_id: str | None = None):
+    """Load an index and its search state off the loop, then bind the pooled clients to it."""
+    await asyncio.to_thread(_load_search_state, index_id)
+    get_chat_llm()
+    get_text_embedder()
+
+
+class QueryService:
+    """Runs every search on one long-lived event loop in a background thread.
+
+    Pooled async HTTP clients, context builders and caches stay bound to that loop
+    for the life of the process. Callers on other threads, such as Streamlit script
+    runs, submit work and get concurrent futures or token iterators back.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run, name="query-service", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro: Coroutine[Any, Any, T]) -> Future[T]:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def warm_up(self, index_id: str | None = None) -> Future[None]:
+        """Load an index and build its search state and the pooled clients ahead of the first query."""
+        return self.submit(warm_up(index_id))
+
+    def list_indexes(self) -> tuple[list[str], str]:
+        return list_indexes(), default_index_id()
+
+    def query(
+        self,
+        question: str,
+        search_type: str,
+        use_cache=True,
+        index_id: str | None = None,
+    ) -> Future:
+        return self.submit(
+            execute_query(question, search_type, use_cache=use_cache, index_id=index_id)
+        )
+
+    def batch(
+        self,
+        queries: list[tuple[str, str]],
+        max_concurrency: int = BATCH_MAX_CONCURRENCY,
+        use_cache=True,
+        index_id: str | None = None,
+    ) -> Future[list]:
+        """Future of the results of (question, type) pairs, exceptions in place of failed questions."""
+        return self.submit(
+            execute_batch_queries(
+                queries,
+                max_concurrency=max_concurrency,
+                use_cache=use_cache,
+                index_id=index_id,
+            )
+        )
+
+    def run_batch(
+        self,
+        queries: list[tuple[str, str]],
+        use_cache=True,
+        index_id: str | None = None,
+    ) -> list:
+        return self.batch(queries, use_cache=use_cache, index_id=index_id).result()
+
+    def stream_query(
+        self,
+        question: str,
+        search_type: str,
+        use_cache=True,
+        metrics: dict | None = None,
+        index_id: str | None = None,
+        history: list[dict[str, str]] | None = None,
+        session_id: str | None = None,
+    ) -> Iterator[str]:
+        """Yield answer tokens for question, metrics is filled in when the answer is complete.
+
+        history holds the earlier messages of the conversation and session_id names
+        it, local search uses both to answer follow-up questions.
+        """
+        query_metrics = QueryMetrics()
+        if search_type == "global":
+            stream = stream_global_query(
+                question, use_cache=use_cache, metrics=query_metrics, index_id=index_id
+            )
+        else:
+            stream_query = (
+                stream_auto_query if search_type == "auto" else stream_local_query
+            )
+            stream = stream_query(
+                question,
+                use_cache=use_cache,
+                metrics=query_metrics,
+                index_id=index_id,
+                history=history,
+                session_id=session_id,
+            )
+        yield from self.stream(stream)
+        if metrics is not None:
+            metrics.update(query_metrics.to_dict())
+
+    def stream(self, stream: AsyncIterator[str]) -> Iterator[str]:
+        """Consume an async token stream on the service loop and yield its tokens here."""
+        tokens: queue.Queue = queue.Queue()
+
+        async def _pump():
+            try:
+                async for token in stream:
+                    tokens.put(token)
+            finally:
+                tokens.put(_STREAM_END)
+
+        future = self.submit(_pump())
+        try:
+            while (token := tokens.get()) is not _STREAM_END:
+                yield token
+            # surfaces an exception raised by the search
+            future.result()
+        finally:
+            if not future.done():
+                future.cancel()
+
+    def close(self):
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5)
+
+
+_lock = threading.Lock()
+_service: QueryService | None = None
+
+
+def get_query_service() -> QueryService:
+    """The process-wide query service, started on first use."""
+    global _service
+    with _lock:
+        if _service is None:
+            _service = QueryService()
+            atexit.register(_service.close)
+        return _service
@@ -0,0 +1,359 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+
+log = logging.getLogger(__name__)
+
+# query-time budgets, the indexing throttles in settings.yaml use the same defaults; 0 turns a limit off
+LLM_REQUESTS_PER_MINUTE = int(os.environ.get("GRAPHRAG_LLM_RPM", 10_000))
+LLM_TOKENS_PER_MINUTE = int(os.environ.get("GRAPHRAG_LLM_TPM", 150_000))
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.environ.get("GRAPHRAG_EMBEDDING_RPM", 10_000))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.environ.get("GRAPHRAG_EMBEDDING_TPM", 150_000))
+# upper bound of the adaptive in-flight request limit, per process and endpoint kind
+MAX_CONCURRENCY = int(os.environ.get("GRAPHRAG_LLM_MAX_CONCURRENCY", 32))
+# share the budget between processes through this SQLite file, in memory when unset
+RATE_LIMIT_PATH = os.environ.get("GRAPHRAG_RATE_LIMIT_PATH")
+
+INTERACTIVE = 0
+BACKGROUND = 1
+# background requests only use this share of the in-flight limit
+BACKGROUND_SHARE = 0.5
+
+# completion budget assumed when a chat request does not set max_tokens
+DEFAULT_MAX_TOKENS = 1000
+
+_POLL_INTERVAL = 0.02
+# 429s within this long of a decrease, or within its Retry-After, do not decrease the limit again
+_DECREASE_WINDOW = 1.0
+
+_priority: ContextVar[int] = ContextVar("request_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def request_priority(priority: int):
+    """Send the LLM and embedding calls made inside this block with priority."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class RateLimitExceeded(RuntimeError):
+    """A sync request on an event loop thread found the budget exhausted."""
+
+
+class MemoryBucketStore:
+    """Token bucket levels and Retry-After pauses for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._blocked_until: dict[str, float] = {}
+
+    def take(self, key: str, amount: float, capacity: float) -> float:
+        """Take amount from the bucket and return 0, or return the seconds until it can be taken."""
+        now = time.time()
+        with self._lock:
+            level, updated_at = self._buckets.get(key, (capacity, now))
+            level, wait = _take(level, updated_at, now, amount, capacity)
+            self._buckets[key] = (level, now)
+            return wait
+
+    def block(self, key: str, until: float):
+        with self._lock:
+            self._blocked_until[key] = max(self._blocked_until.get(key, 0.0), until)
+
+    def blocked_for(self, key: str) -> float:
+        with self._lock:
+            return max(0.0, self._blocked_until.get(key, 0.0) - time.time())
+
+
+class SqliteBucketStore:
+    """Token bucket levels and Retry-After pauses shared by every process using the same file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with sqlite3.connect(path, timeout=30) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " key TEXT PRIMARY KEY, level REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, amount: float, capacity: float) -> float:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT level, updated_at FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            level, updated_at = row if row else (capacity, now)
+            level, wait = _take(level, updated_at, now, amount, capacity)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (key, level, now)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def block(self, key: str, until: float):
+        # a pause is stored as a bucket whose updated_at lies in the future
+        self._conn().execute(
+            "INSERT INTO buckets VALUES (?, 0, ?) ON CONFLICT (key) DO UPDATE"
+            " SET updated_at = max(updated_at, excluded.updated_at)",
+            (f"{key}:blocked", until),
+        )
+
+    def blocked_for(self, key: str) -> float:
+        row = self._conn().execute(
+            "SELECT updated_at FROM buckets WHERE key = ?", (f"{key}:blocked",)
+        ).fetchone()
+        return max(0.0, row[0] - time.time()) if row else 0.0
+
+
+def _take(
+    level: float, updated_at: float, now: float, amount: float, capacity: float
+) -> tuple[float, float]:
+    # refill at capacity per minute, a request larger than the bucket waits for a full one
+    level = min(capacity, level + (now - updated_at) * capacity / 60)
+    amount = min(amount, capacity)
+    if level >= amount:
+        return level - amount, 0.0
+    return level, (amount - level) * 60 / capacity
+
+
+class RateLimiter:
+    """RPM and TPM token buckets plus an adaptive in-flight limit for one kind of endpoint.
+
+    The in-flight limit is halved once per burst of 429s and grows back by one
+    request per limit's worth of successes. A 429's Retry-After pauses every caller
+    sharing the bucket store. Interactive requests go first, background requests wait while any
+    are queued and only ever use part of the in-flight limit.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        max_concurrency: int,
+        store: MemoryBucketStore | SqliteBucketStore,
+    ):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.store = store
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.interactive_waiting = 0
+        self._decreased_until = 0.0
+        self._lock = threading.Lock()
+
+    def _try_start(self, priority: int) -> bool:
+        with self._lock:
+            limit = int(self.limit)
+            if priority != INTERACTIVE:
+                if self.interactive_waiting:
+                    return False
+                limit = max(1, int(limit * BACKGROUND_SHARE))
+            if self.in_flight >= limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def _budget_wait(self, tokens: int) -> float:
+        wait = self.store.blocked_for(self.name)
+        if wait:
+            return wait
+        if self.requests_per_minute:
+            wait = self.store.take(f"{self.name}:rpm", 1, self.requests_per_minute)
+            if wait:
+                return wait
+        if self.tokens_per_minute:
+            wait = self.store.take(f"{self.name}:tpm", tokens, self.tokens_per_minute)
+            if wait and self.requests_per_minute:
+                # give the request back, the request is retried as a whole
+                self.store.take(f"{self.name}:rpm", -1, self.requests_per_minute)
+        return wait
+
+    def _waiting(self, priority: int, delta: int):
+        if priority == INTERACTIVE:
+            with self._lock:
+                self.interactive_waiting += delta
+
+    async def acquire(self, tokens: int):
+        priority = _priority.get()
+        self._waiting(priority, 1)
+        try:
+            while True:
+                if self._try_start(priority):
+                    # a shared store locks its SQLite file, which may block for a while
+                    if isinstance(self.store, SqliteBucketStore):
+                        wait = await asyncio.to_thread(self._budget_wait, tokens)
+                    else:
+                        wait = self._budget_wait(tokens)
+                    if not wait:
+                        return
+                    self.release()
+                else:
+                    wait = _POLL_INTERVAL
+                await asyncio.sleep(wait)
+        finally:
+            self._waiting(priority, -1)
+
+    def acquire_sync(self, tokens: int):
+        # sync calls can come from the event loop thread itself (graphrag embeds the
+        # local search query synchronously), so they never wait on in-flight async
+        # requests that could only finish once the loop runs again, and there fail
+        # instead of sleeping out the budget or a Retry-After
+        on_loop = on_event_loop()
+        while wait := self._budget_wait(tokens):
+            if on_loop:
+                raise RateLimitExceeded(f"{self.name} budget exhausted for {wait:.1f}s")
+            time.sleep(wait)
+        with self._lock:
+            self.in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def on_response(self, response: httpx.Response):
+        if response.status_code == 429:
+            retry_after = _retry_after(response)
+            now = time.time()
+            with self._lock:
+                # the other 429s of a burst answer requests sent before the decrease
+                if now >= self._decreased_until:
+                    self.limit = max(1.0, self.limit / 2)
+                    self._decreased_until = now + max(retry_after, _DECREASE_WINDOW)
+            self.store.block(self.name, now + retry_after)
+            log.warning(
+                "%s rate limited, pausing %.1fs, in-flight limit %d",
+                self.name,
+                retry_after,
+                self.limit,
+            )
+        elif response.is_success:
+            with self._lock:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+
+def on_event_loop() -> bool:
+    """Whether the calling thread is running an event loop, where nothing may block."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _retry_after(response: httpx.Response) -> float:
+    try:
+        if "retry-after-ms" in response.headers:
+            return float(response.headers["retry-after-ms"]) / 1000
+        return float(response.headers.get("retry-after", 1.0))
+    except ValueError:
+        return 1.0
+
+
+def estimate_tokens(request: httpx.Request) -> int:
+    """Rough TPM cost of a request, prompt characters / 4 plus the completion budget."""
+    try:
+        body = json.loads(request.content or b"{}")
+    except (ValueError, httpx.RequestNotRead):
+        return DEFAULT_MAX_TOKENS
+    if "messages" in body:
+        chars = sum(len(str(m.get("content") or "")) for m in body["messages"])
+        return chars // 4 + int(body.get("max_tokens") or DEFAULT_MAX_TOKENS)
+    inputs = body.get("input", "")
+    inputs = inputs if isinstance(inputs, list) else [inputs]
+    return sum(len(str(text)) for text in inputs) // 4 + 1
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport, limiter: RateLimiter):
+        self.transport = transport
+        self.limiter = limiter
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        try:
+            self.limiter.acquire_sync(estimate_tokens(request))
+        except RateLimitExceeded as e:
+            # the openai client retries any exception a transport raises, sleeping on
+            # the loop, and graphrag retries the connection error it becomes; a 503 it
+            # is told not to retry surfaces as an error neither of them retries
+            return httpx.Response(
+                503, headers={"x-should-retry": "false"}, text=str(e), request=request
+            )
+        try:
+            response = self.transport.handle_request(request)
+        finally:
+            self.limiter.release()
+        self.limiter.on_response(response)
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncRateLimitedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, limiter: RateLimiter):
+        self.transport = transport
+        self.limiter = limiter
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await self.limiter.acquire(estimate_tokens(request))
+        try:
+            # the slot is held until the response headers arrive
+            response = await self.transport.handle_async_request(request)
+        finally:
+            self.limiter.release()
+        self.limiter.on_response(response)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+_store = SqliteBucketStore(RATE_LIMIT_PATH) if RATE_LIMIT_PATH else MemoryBucketStore()
+
+# process-wide limiters shared by every client of a kind
+limiters = {
+    "chat": RateLimiter(
+        "chat",
+        LLM_REQUESTS_PER_MINUTE,
+        LLM_TOKENS_PER_MINUTE,
+        MAX_CONCURRENCY,
+        _store,
+    ),
+    "embedding": RateLimiter(
+        "embedding",
+        EMBEDDING_REQUESTS_PER_MINUTE,
+        EMBEDDING_TOKENS_PER_MINUTE,
+        MAX_CONCURRENCY,
+        _store,
+    ),
+}
@@ -0,0 +1,242 @@
+import copy
+import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+
+# threads rendering exports, shared by every session of the server process
+EXPORT_WORKERS = int(os.environ.get("GRAPHRAG_EXPORT_WORKERS", 2))
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# (role, content) of a user message and of the assistant answer after it, either may be missing
+Pair = tuple[tuple[str, str] | None, tuple[str, str] | None]
+
+
+def _pairs(messages: list[dict]) -> list[Pair]:
+    """Messages two at a time as the reports number them, an unanswered question ends the list."""
+    pairs = []
+    for i in range(0, len(messages), 2):
+        pair = messages[i : i + 2]
+        pairs.append(
+            tuple(
+                (message["role"], message["content"]) for message in pair
+            ) + (None,) * (2 - len(pair))
+        )
+    return pairs
+
+
+class IncrementalReport(ABC):
+    """A chat history export that renders each question and answer pair once.
+
+    Answered pairs are appended to the state kept from the previous export, a
+    trailing unanswered question is only rendered into the output. The state
+    starts over when the history no longer begins with the pairs rendered so far,
+    e.g. after switching patients.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rendered: list[Pair] = []
+        self._state = None
+
+    def render(self, messages: list[dict]) -> bytes:
+        pairs = _pairs(messages)
+        answered = pairs if len(messages) % 2 == 0 else pairs[:-1]
+        with self._lock:
+            if self._state is None or answered[: len(self._rendered)] != self._rendered:
+                self._state = self._start()
+                self._rendered = []
+            for number, pair in enumerate(
+                answered[len(self._rendered) :], start=len(self._rendered) + 1
+            ):
+                self._append(self._state, number, pair)
+                self._rendered.append(pair)
+            trailing = [(len(pairs), pairs[-1])] if len(answered) < len(pairs) else []
+            return self._output(
+                self._state, trailing, datetime.now().strftime(DATE_FORMAT)
+            )
+
+    @abstractmethod
+    def _start(self):
+        """A new, empty rendering state."""
+
+    @abstractmethod
+    def _append(self, state, number: int, pair: Pair):
+        """Render an answered pair into state."""
+
+    @abstractmethod
+    def _output(self, state, trailing: list[tuple[int, Pair]], date_str: str) -> bytes:
+        """The document of state plus the trailing pairs, state is left as it is."""
+
+
+class TextReport(IncrementalReport):
+    def _section(self, number: int, pair: Pair) -> str:
+        return "\n".join(
+            f"{'User' if role == 'user' else 'Assistant'}: {content}"
+            for role, content in filter(None, pair)
+        )
+
+    def _start(self) -> list[str]:
+        return []
+
+    def _append(self, state: list[str], number: int, pair: Pair):
+        state.append(self._section(number, pair))
+
+    def _output(self, state, trailing, date_str) -> bytes:
+        sections = state + [self._section(number, pair) for number, pair in trailing]
+        return "\n".join(sections).encode("utf-8")
+
+
+class MarkdownReport(TextReport):
+    def _section(self, number: int, pair: Pair) -> str:
+        user_msg, assistant_msg = pair
+        formatted = []
+        if user_msg[0] == "user":
+            formatted.append(f"## Question {number}\n{user_msg[1]}")
+        if assistant_msg is not None and assistant_msg[0] == "assistant":
+            formatted.append(f"### Response\n{assistant_msg[1]}")
+        formatted.append("\n")
+        return "\n".join(formatted)
+
+    def _output(self, state, trailing, date_str) -> bytes:
+        header = ["# Chat History Report", f"**Date:** {date_str}", "\n"]
+        sections = state + [self._section(number, pair) for number, pair in trailing]
+        return "\n".join(header + sections).encode("utf-8")
+
+
+class PdfReport(IncrementalReport):
+    """The summary report, laid out pair by pair into one open FPDF document.
+
+    An export closes a copy of the document, so the next pair is appended to the
+    open one instead of laying out the whole history again.
+    """
+
+    # digits are equally wide in Arial, the centered date replaces this at export
+    DATE_PLACEHOLDER = "Date: 0000-00-00 00:00:00"
+
+    def _start(self):
+        from fpdf import FPDF
+
+        pdf = FPDF()
+        pdf.add_page()
+        pdf.set_auto_page_break(auto=True, margin=15)
+
+        # Set font for the header
+        pdf.set_font("Arial", "B", 16)
+        pdf.cell(0, 10, "Summary Report", ln=True, align="C")
+
+        # Add date
+        pdf.set_font("Arial", size=12)
+        pdf.cell(0, 10, self.DATE_PLACEHOLDER, ln=True, align="C")
+        pdf.ln(10)  # Add some space after the date
+        return pdf
+
+    def _append(self, pdf, number: int, pair: Pair):
+        user_msg, assistant_msg = pair
+        if user_msg[0] == "user":
+            pdf.set_font("Arial", "B", 14)
+            pdf.cell(0, 10, f"Question {number}:", ln=True)
+            pdf.set_font("Arial", size=12)
+            pdf.multi_cell(0, 10, user_msg[1])
+            pdf.ln(5)
+
+        # Ensure there's a corresponding assistant response
+        if assistant_msg is not None and assistant_msg[0] == "assistant":
+            pdf.set_font("Arial", "B", 14)
+            pdf.cell(0, 10, "Summary:", ln=True)
+            pdf.set_font("Arial", size=12)
+            pdf.multi_cell(0, 10, assistant_msg[1])
+            pdf.ln(10)
+
+    def _output(self, pdf, trailing, date_str) -> bytes:
+        pdf = copy.deepcopy(pdf)
+        pdf.pages[1] = pdf.pages[1].replace(self.DATE_PLACEHOLDER, f"Date: {date_str}")
+        for number, pair in trailing:
+            self._append(pdf, number, pair)
+        return pdf.output(dest="S").encode("latin1")
+
+
+@dataclass(frozen=True)
+class ExportFormat:
+    label: str
+    file_name: str
+    mime: str
+    report: type[IncrementalReport]
+
+
+EXPORT_FORMATS = {
+    "PDF": ExportFormat(
+        "Download Summary Report", "chat_history.pdf", "application/pdf", PdfReport
+    ),
+    "Markdown": ExportFormat(
+        "Download Chat History as Markdown File",
+        "chat_history.md",
+        "text/markdown",
+        MarkdownReport,
+    ),
+    "Text": ExportFormat(
+        "Download Chat History as Text File", "chat_history.txt", "text/plain", TextReport
+    ),
+}
+
+_executor_lock = threading.Lock()
+_executor: ThreadPoolExecutor | None = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=EXPORT_WORKERS, thread_name_prefix="report-export"
+            )
+        return _executor
+
+
+class ReportExporter:
+    """The chat history exports of one session, rendered off the Streamlit script thread.
+
+    Nothing is rendered until an export is asked for. From then on, a change to
+    the history brings the formats asked for up to date in the background, so the
+    download is usually ready by the next rerun.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reports = {name: fmt.report() for name, fmt in EXPORT_FORMATS.items()}
+        self._exports: dict[str, tuple[tuple, Future[bytes]]] = {}
+
+    def export(self, name: str, messages: list[dict]) -> Future[bytes]:
+        """Future of the export of messages, a render only starts when the history changed."""
+        history = tuple((message["role"], message["content"]) for message in messages)
+        with self._lock:
+            cached = self._exports.get(name)
+            # a failed render is retried
+            if (
+                cached is None
+                or cached[0] != history
+                or (cached[1].done() and cached[1].exception() is not None)
+            ):
+                # a copy, the script keeps appending to its list
+                messages = [dict(message) for message in messages]
+                cached = (
+                    history,
+                    _get_executor().submit(self._reports[name].render, messages),
+                )
+                self._exports[name] = cached
+            return cached[1]
+
+    def ready(self, name: str, messages: list[dict]) -> bytes | None:
+        """The export of messages when it has been rendered, without waiting."""
+        future = self.export(name, messages) if name in self._exports else None
+        if future is None or not future.done() or future.exception() is not None:
+            return None
+        return future.result()
+
+    def refresh(self, messages: list[dict]):
+        """Start re-rendering the formats asked for so far when the history changed."""
+        for name in list(self._exports):
+            self.export(name, messages)
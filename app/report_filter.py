@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import weakref
+from dataclasses import dataclass
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from graphrag.model import CommunityReport
+
+from artifact_store import IndexArtifacts
+from clients import get_text_embedder
+from embedding_cache import get_cached_text_embedder
+from memory_vector_store import normalize_rows
+from metrics import incr
+
+log = logging.getLogger(__name__)
+
+# with "1" global search only maps the reports most similar to the question
+GLOBAL_REPORT_FILTER = os.environ.get("GRAPHRAG_GLOBAL_REPORT_FILTER", "0") == "1"
+# the most similar reports always go to map ...
+REPORT_FILTER_TOP_K = int(os.environ.get("GRAPHRAG_GLOBAL_REPORT_TOP_K", 20))
+# ... and so does every report at least this similar
+REPORT_FILTER_MIN_SCORE = float(
+    os.environ.get("GRAPHRAG_GLOBAL_REPORT_MIN_SCORE", 0.8)
+)
+# at most this many reports are mapped, the lowest ranked selections are dropped
+REPORT_FILTER_MAX_REPORTS = int(
+    os.environ.get("GRAPHRAG_GLOBAL_REPORT_MAX_REPORTS", 50)
+)
+
+REPORT_EMBEDDING_FILE = "community_report_embeddings.parquet"
+
+
+def report_filter_params() -> dict | None:
+    """The filter settings that change global answers, None when the filter is off."""
+    if not GLOBAL_REPORT_FILTER:
+        return None
+    return {
+        "top_k": REPORT_FILTER_TOP_K,
+        "min_score": REPORT_FILTER_MIN_SCORE,
+        "max_reports": REPORT_FILTER_MAX_REPORTS,
+        "embedding_model": get_text_embedder().model,
+    }
+
+
+@dataclass
+class ReportIndex:
+    """Unit-length summary embeddings of the embedded reports global search maps, in artifacts.reports order."""
+
+    ids: list[str]
+    rank: np.ndarray
+    vectors: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + self.rank.nbytes + sys.getsizeof(self.ids)
+
+    def select(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int = REPORT_FILTER_TOP_K,
+        min_score: float = REPORT_FILTER_MIN_SCORE,
+        max_reports: int = REPORT_FILTER_MAX_REPORTS,
+    ) -> frozenset[str]:
+        scores = self.vectors @ normalize_rows(query_embedding)
+        keep = scores >= min_score
+        k = min(top_k, len(scores))
+        if k > 0:
+            keep[np.argpartition(-scores, k - 1)[:k]] = True
+        rows = np.flatnonzero(keep)
+        if max_reports > 0 and len(rows) > max_reports:
+            # highest rank first, similarity breaks ties
+            rows = rows[np.lexsort((-scores[rows], -self.rank[rows]))[:max_reports]]
+        return frozenset(self.ids[row] for row in rows)
+
+
+def report_embedding_text(report: CommunityReport) -> str:
+    return report.summary or report.full_content
+
+
+def _sidecar_path(artifacts: IndexArtifacts) -> str:
+    return os.path.join(artifacts.input_dir, REPORT_EMBEDDING_FILE)
+
+
+def _sidecar_metadata(artifacts: IndexArtifacts, model: str) -> dict[str, str]:
+    return {
+        "artifact_hash": artifacts.content_hash,
+        "community_level": str(artifacts.community_level),
+        "model": model,
+    }
+
+
+def write_report_embeddings(
+    artifacts: IndexArtifacts, model: str, ids: list[str], vectors: np.ndarray
+):
+    table = pa.table(
+        {
+            "id": pa.array(ids, type=pa.string()),
+            "vector": pa.FixedSizeListArray.from_arrays(
+                pa.array(vectors.ravel(), type=pa.float32()), vectors.shape[1]
+            ),
+        }
+    ).replace_schema_metadata(_sidecar_metadata(artifacts, model))
+    path = _sidecar_path(artifacts)
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_report_embeddings(
+    artifacts: IndexArtifacts, model: str
+) -> tuple[list[str], np.ndarray] | None:
+    """Vectors from the sidecar file, or None when it is missing or belongs to another run, level or model."""
+    path = _sidecar_path(artifacts)
+    if not os.path.exists(path):
+        return None
+    table = pq.read_table(path)
+    metadata = {
+        key.decode(): value.decode()
+        for key, value in (table.schema.metadata or {}).items()
+    }
+    if metadata != _sidecar_metadata(artifacts, model):
+        return None
+    vectors = table.column("vector").combine_chunks()
+    matrix = vectors.values.to_numpy().reshape(len(vectors), -1)
+    return table.column("id").to_pylist(), matrix
+
+
+async def _embed_reports(reports: list[CommunityReport]) -> dict[str, np.ndarray]:
+    """Summary vectors by report id, a report whose embedding failed is left out."""
+    # the cached embedder batches these into a few requests
+    embedder = get_cached_text_embedder()
+    vectors = await asyncio.gather(
+        *[embedder.aembed(report_embedding_text(report)) for report in reports],
+        return_exceptions=True,
+    )
+    embedded = {
+        report.id: np.asarray(vector, dtype=np.float32)
+        for report, vector in zip(reports, vectors)
+        if isinstance(vector, list) and vector
+    }
+    if len(embedded) < len(reports):
+        log.warning(
+            "Could not embed %d community report summaries, they are not selected"
+            " until the next load",
+            len(reports) - len(embedded),
+        )
+    return embedded
+
+
+async def build_report_index(artifacts: IndexArtifacts) -> ReportIndex:
+    """Report embeddings from the sidecar next to the artifacts, embedding the summaries missing from it.
+
+    Only embedded reports are written to the sidecar and selectable, the others
+    are embedded again the next time the index is loaded.
+    """
+    reports = artifacts.reports
+    model = get_text_embedder().model
+    stored = await asyncio.to_thread(read_report_embeddings, artifacts, model)
+    vectors = {}
+    if stored is not None:
+        # sidecars written before failed embeddings were left out hold zero vectors
+        vectors = {
+            report_id: vector
+            for report_id, vector in zip(*stored)
+            if np.any(vector)
+        }
+    missing = [report for report in reports if report.id not in vectors]
+    if missing:
+        vectors.update(await _embed_reports(missing))
+    reports = [report for report in reports if report.id in vectors]
+    if not reports:
+        raise RuntimeError("Could not embed any community report summary")
+    ids = [report.id for report in reports]
+    matrix = np.stack([vectors[report_id] for report_id in ids])
+    if stored is None or stored[0] != ids:
+        try:
+            await asyncio.to_thread(
+                write_report_embeddings, artifacts, model, ids, matrix
+            )
+        except OSError:
+            log.warning("Could not write %s", _sidecar_path(artifacts), exc_info=True)
+    return ReportIndex(
+        ids=ids,
+        rank=np.array([report.rank or 0.0 for report in reports], dtype=np.float32),
+        vectors=normalize_rows(matrix),
+    )
+
+
+_lock = threading.Lock()
+_indexes: dict[tuple[str, int], tuple[str, ReportIndex]] = {}
+# one build per index at a time on each event loop
+_build_locks: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, asyncio.Lock
+] = weakref.WeakKeyDictionary()
+
+
+async def get_report_index(artifacts: IndexArtifacts) -> ReportIndex:
+    key = (artifacts.input_dir, artifacts.community_level)
+    cached = _indexes.get(key)
+    if cached is not None and cached[0] == artifacts.version:
+        return cached[1]
+
+    build_lock = _build_locks.setdefault(asyncio.get_running_loop(), asyncio.Lock())
+    async with build_lock:
+        cached = _indexes.get(key)
+        if cached is None or cached[0] != artifacts.version:
+            cached = (artifacts.version, await build_report_index(artifacts))
+            with _lock:
+                _indexes[key] = cached
+        return cached[1]
+
+
+async def select_reports(
+    artifacts: IndexArtifacts, question: str
+) -> frozenset[str] | None:
+    """Ids of the reports worth mapping for question, None to map every report."""
+    try:
+        report_index = await get_report_index(artifacts)
+    except Exception:
+        log.warning("Report filter unavailable, mapping every report", exc_info=True)
+        return None
+    try:
+        query_embedding = await get_cached_text_embedder().aembed(question)
+    except Exception:
+        log.warning("Could not embed question, mapping every report", exc_info=True)
+        return None
+    if not query_embedding or report_index.vectors.shape[1] != len(query_embedding):
+        return None
+    report_ids = report_index.select(np.asarray(query_embedding, dtype=np.float32))
+    if not report_ids:
+        return None
+    incr("reports_filtered", len(artifacts.reports) - len(report_ids))
+    return report_ids
+
+
+def report_index_nbytes(input_dir: str, community_level: int) -> int:
+    with _lock:
+        cached = _indexes.get((input_dir, community_level))
+    return cached[1].nbytes if cached is not None else 0
+
+
+def evict_report_index(input_dir: str, community_level: int):
+    with _lock:
+        _indexes.pop((input_dir, community_level), None)
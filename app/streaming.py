@@ -0,0 +1,85 @@
+import asyncio
+from collections.abc import AsyncIterator, Iterator
+
+from graphrag.query.structured_search.base import BaseSearch, SearchResult
+from graphrag.query.structured_search.global_search.callbacks import (
+    GlobalSearchLLMCallback,
+)
+
+from metrics import QueryMetrics
+
+
+class TokenQueueCallback(GlobalSearchLLMCallback):
+    """Forwards streamed completion tokens to an asyncio queue.
+
+    Subclasses the global search callback so the same object also satisfies the
+    map-phase hooks GlobalSearch calls on every registered callback.
+    """
+
+    def __init__(self, queue: asyncio.Queue):
+        super().__init__()
+        self.queue = queue
+
+    def on_llm_new_token(self, token: str):
+        super().on_llm_new_token(token)
+        if token:
+            self.queue.put_nowait(token)
+
+
+async def stream_search(
+    search_engine: BaseSearch,
+    question: str,
+    result_holder: list | None = None,
+    metrics: QueryMetrics | None = None,
+    **kwargs,
+) -> AsyncIterator[str]:
+    """Run search_engine.asearch and yield completion tokens as the LLM produces them.
+
+    The finished SearchResult is appended to result_holder when one is given. With
+    metrics, the search reports its stages there and the first token is marked.
+    kwargs are passed on to asearch.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    search_engine.callbacks = [
+        *(search_engine.callbacks or []),
+        TokenQueueCallback(queue),
+    ]
+
+    search = search_engine.asearch(question, **kwargs)
+    if metrics is not None:
+        # the search task gets its own context, so nested stages land in metrics
+        search = metrics.run(search)
+    task = asyncio.create_task(search)
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+
+    streamed = False
+    try:
+        while (token := await queue.get()) is not None:
+            if not streamed and metrics is not None:
+                metrics.mark("first_token")
+            streamed = True
+            yield token
+    finally:
+        if not task.done():
+            task.cancel()
+
+    result: SearchResult = task.result()
+    # answers that skip the LLM (e.g. global search with no relevant map output) arrive in one piece
+    if not streamed and result.response:
+        yield str(result.response)
+    if result_holder is not None:
+        result_holder.append(result)
+
+
+def iter_stream(stream: AsyncIterator[str]) -> Iterator[str]:
+    """Drive an async token stream from synchronous code such as a Streamlit script."""
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(stream.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(stream.aclose())
+        loop.close()
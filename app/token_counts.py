@@ -0,0 +1,246 @@
+import hashlib
+import logging
+import os
+import sys
+import threading
+from dataclasses import replace
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import tiktoken
+
+from graphrag.query.context_builder.community_context import build_community_context
+from graphrag.query.context_builder.local_context import (
+    build_entity_context,
+    build_relationship_context,
+)
+from graphrag.query.context_builder.source_context import build_text_unit_context
+
+from artifact_store import IndexArtifacts
+from clients import get_token_encoder
+
+log = logging.getLogger(__name__)
+
+TOKEN_COUNT_FILE = "token_counts.parquet"
+
+# counts learned at query time are kept in memory up to this many extra rows
+MAX_RUNTIME_COUNTS = 100_000
+
+# large enough that the builders emit every record instead of stopping at a budget
+_NO_BUDGET = 10**9
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+# a digest key and its int count, besides the dict slot
+_COUNT_BYTES = sys.getsizeof(_digest("")) + sys.getsizeof(1000)
+
+
+class RecordingTokenEncoder:
+    """Encodes with the real tokenizer and remembers the token count of every string it sees."""
+
+    def __init__(self, token_encoder: tiktoken.Encoding):
+        self.token_encoder = token_encoder
+        self.counts: dict[bytes, int] = {}
+
+    def encode(self, text: str, **kwargs) -> list[int]:
+        tokens = self.token_encoder.encode(text, **kwargs)
+        self.counts[_digest(text)] = len(tokens)
+        return tokens
+
+    def __getattr__(self, name):
+        return getattr(self.token_encoder, name)
+
+
+class PrecountedTokenEncoder:
+    """Token encoder for context budget packing that answers from precomputed counts.
+
+    The context builders only ever take len() of what encode returns, so a known
+    string gets a range of the right length and skips tiktoken entirely. Unknown
+    strings are encoded for real and their counts are remembered.
+    """
+
+    def __init__(self, token_encoder: tiktoken.Encoding, counts: dict[bytes, int]):
+        self.token_encoder = token_encoder
+        self.counts = counts
+        self._runtime_counts = 0
+
+    def encode(self, text: str, **kwargs):
+        key = _digest(text)
+        count = self.counts.get(key)
+        if count is not None:
+            return range(count)
+        tokens = self.token_encoder.encode(text, **kwargs)
+        if self._runtime_counts < MAX_RUNTIME_COUNTS:
+            self.counts[key] = len(tokens)
+            self._runtime_counts += 1
+        return tokens
+
+    @property
+    def nbytes(self) -> int:
+        return sys.getsizeof(self.counts) + _COUNT_BYTES * len(self.counts)
+
+    def __getattr__(self, name):
+        return getattr(self.token_encoder, name)
+
+
+def compute_token_counts(
+    artifacts: IndexArtifacts,
+    token_encoder: tiktoken.Encoding,
+    column_delimiter: str = "|",
+) -> dict[bytes, int]:
+    """Token-count every report, entity, relationship and text unit row as the context builders format it."""
+    recorder = RecordingTokenEncoder(token_encoder)
+    entities = artifacts.entities
+
+    for include_entity_rank in (True, False):
+        build_entity_context(
+            selected_entities=entities,
+            token_encoder=recorder,
+            max_tokens=_NO_BUDGET,
+            include_entity_rank=include_entity_rank,
+            column_delimiter=column_delimiter,
+        )
+
+    # with every entity selected, every relationship is in-network
+    for include_relationship_weight in (True, False):
+        build_relationship_context(
+            selected_entities=entities,
+            relationships=artifacts.relationships,
+            token_encoder=recorder,
+            include_relationship_weight=include_relationship_weight,
+            max_tokens=_NO_BUDGET,
+            top_k_relationships=len(artifacts.relationships),
+            column_delimiter=column_delimiter,
+        )
+
+    build_text_unit_context(
+        text_units=list(artifacts.text_units),
+        token_encoder=recorder,
+        column_delimiter=column_delimiter,
+        shuffle_data=False,
+        max_tokens=_NO_BUDGET,
+    )
+
+    for use_community_summary in (True, False):
+        for include_community_rank in (True, False):
+            # local search reports carry no weight, global search adds the occurrence weight
+            for reports, report_entities in (
+                (artifacts.reports, None),
+                (artifacts.global_reports(), entities),
+            ):
+                build_community_context(
+                    community_reports=[replace(report) for report in reports],
+                    entities=report_entities,
+                    token_encoder=recorder,
+                    use_community_summary=use_community_summary,
+                    column_delimiter=column_delimiter,
+                    shuffle_data=False,
+                    include_community_rank=include_community_rank,
+                    community_weight_name="occurrence weight",
+                    max_tokens=_NO_BUDGET,
+                    single_batch=False,
+                )
+
+    return recorder.counts
+
+
+def _sidecar_path(artifacts: IndexArtifacts) -> str:
+    return os.path.join(artifacts.input_dir, TOKEN_COUNT_FILE)
+
+
+def write_token_counts(
+    artifacts: IndexArtifacts, token_encoder: tiktoken.Encoding, counts: dict[bytes, int]
+):
+    table = pa.table(
+        {
+            "digest": pa.array(list(counts.keys()), type=pa.binary(16)),
+            "n_tokens": pa.array(list(counts.values()), type=pa.int32()),
+        }
+    ).replace_schema_metadata(
+        {"artifact_hash": artifacts.content_hash, "encoding": token_encoder.name}
+    )
+    path = _sidecar_path(artifacts)
+    tmp_path = f"{path}.tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_token_counts(
+    artifacts: IndexArtifacts, token_encoder: tiktoken.Encoding
+) -> dict[bytes, int] | None:
+    """Counts from the sidecar file, or None when it is missing or belongs to another index run."""
+    path = _sidecar_path(artifacts)
+    if not os.path.exists(path):
+        return None
+    table = pq.read_table(path)
+    metadata = table.schema.metadata or {}
+    if (
+        metadata.get(b"artifact_hash", b"").decode() != artifacts.content_hash
+        or metadata.get(b"encoding", b"").decode() != token_encoder.name
+    ):
+        return None
+    return dict(
+        zip(table.column("digest").to_pylist(), table.column("n_tokens").to_pylist())
+    )
+
+
+def prepare_token_counts(
+    artifacts: IndexArtifacts, token_encoder: tiktoken.Encoding
+) -> dict[bytes, int]:
+    counts = read_token_counts(artifacts, token_encoder)
+    if counts is None:
+        counts = compute_token_counts(artifacts, token_encoder)
+        try:
+            write_token_counts(artifacts, token_encoder, counts)
+        except OSError:
+            log.warning("Could not write %s", _sidecar_path(artifacts), exc_info=True)
+    return counts
+
+
+_lock = threading.Lock()
+_encoders: dict[tuple[str, int], tuple[str, PrecountedTokenEncoder]] = {}
+
+
+def get_precounted_encoder(artifacts: IndexArtifacts) -> PrecountedTokenEncoder:
+    """Process-wide precounted encoder for an artifact version."""
+    key = (artifacts.input_dir, artifacts.community_level)
+    with _lock:
+        cached = _encoders.get(key)
+        if cached is None or cached[0] != artifacts.version:
+            token_encoder = get_token_encoder()
+            counts = prepare_token_counts(artifacts, token_encoder)
+            cached = (artifacts.version, PrecountedTokenEncoder(token_encoder, counts))
+            _encoders[key] = cached
+        return cached[1]
+
+
+def precounted_encoder_nbytes(input_dir: str, community_level: int) -> int:
+    with _lock:
+        cached = _encoders.get((input_dir, community_level))
+    return cached[1].nbytes if cached is not None else 0
+
+
+def evict_precounted_encoder(input_dir: str, community_level: int):
+    with _lock:
+        _encoders.pop((input_dir, community_level), None)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from artifact_store import COMMUNITY_LEVEL, INPUT_DIR, load_artifacts
+
+    parser = argparse.ArgumentParser(
+        description="precompute context token counts for an index run"
+    )
+    parser.add_argument("--input-dir", dest="input_dir", default=INPUT_DIR)
+    args = parser.parse_args()
+
+    artifacts = load_artifacts(args.input_dir, COMMUNITY_LEVEL)
+    token_encoder = get_token_encoder()
+    counts = compute_token_counts(artifacts, token_encoder)
+    write_token_counts(artifacts, token_encoder, counts)
+    print(f"Wrote {len(counts)} token counts to {_sidecar_path(artifacts)}")
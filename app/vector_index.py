@@ -0,0 +1,252 @@
+import logging
+import os
+import threading
+from datetime import timedelta
+
+import numpy as np
+
+from graphrag.vector_stores import BaseVectorStore, VectorStoreDocument
+from graphrag.vector_stores.lancedb import LanceDBVectorStore
+
+from artifact_store import ENTITY_EMBEDDING_TABLE, IndexArtifacts
+from memory_vector_store import InMemoryVectorStore, normalize_rows, write_npy
+
+log = logging.getLogger(__name__)
+
+ENTITY_DESCRIPTION_COLLECTION = "entity_description_embeddings"
+
+# "memory" searches a float32 matrix in this process, "lancedb" the persisted table
+VECTOR_STORE = os.environ.get("GRAPHRAG_VECTOR_STORE", "memory")
+# with "1" the memory store maps its matrix from a .npy sidecar next to the artifacts
+VECTOR_STORE_MMAP = os.environ.get("GRAPHRAG_VECTOR_STORE_MMAP", "0") == "1"
+
+_lock = threading.Lock()
+_stores: dict[str, tuple[str, LanceDBVectorStore]] = {}
+
+
+def _embedding_version(input_dir: str) -> str:
+    stat = os.stat(f"{input_dir}/{ENTITY_EMBEDDING_TABLE}.parquet")
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def _stamp_path(db_uri: str, collection_name: str) -> str:
+    return os.path.join(db_uri, f"{collection_name}.version")
+
+
+def _read_stamp(db_uri: str, collection_name: str) -> str | None:
+    try:
+        with open(_stamp_path(db_uri, collection_name)) as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _write_stamp(db_uri: str, collection_name: str, version: str):
+    path = _stamp_path(db_uri, collection_name)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        file.write(version)
+    os.replace(tmp_path, path)
+
+
+def _compact(store: LanceDBVectorStore):
+    # every overwrite leaves a manifest, a transaction file and data fragments
+    # behind, so fold the table into as few files as possible and drop history
+    table = store.document_collection
+    try:
+        table.compact_files()
+        table.cleanup_old_versions(older_than=timedelta(0))
+    except Exception:
+        log.warning("Could not compact %s", store.collection_name, exc_info=True)
+
+
+def build_entity_vector_store(
+    artifacts: IndexArtifacts,
+    db_uri: str,
+    collection_name: str = ENTITY_DESCRIPTION_COLLECTION,
+) -> LanceDBVectorStore:
+    """(Re)write the entity description embeddings table and stamp it with the artifact version."""
+    version = _embedding_version(artifacts.input_dir)
+    store = LanceDBVectorStore(collection_name=collection_name)
+    store.connect(db_uri=db_uri)
+    # same documents as store_entity_semantic_embeddings, with the vectors taken
+    # from the float32 matrix since the entities no longer carry them
+    embeddings = artifacts.columns.entities.description_embeddings
+    has_embedding = artifacts.columns.entities.has_description_embedding
+    store.load_documents(
+        documents=[
+            VectorStoreDocument(
+                id=entity.id,
+                text=entity.description,
+                vector=embeddings[row].tolist() if has_embedding[row] else None,
+                attributes={"title": entity.title, **(entity.attributes or {})},
+            )
+            for row, entity in enumerate(artifacts.entities)
+        ]
+    )
+    _compact(store)
+    _write_stamp(db_uri, collection_name, version)
+    return store
+
+
+def lancedb_uri(input_dir: str) -> str:
+    return f"{input_dir}/lancedb"
+
+
+def get_entity_vector_store(
+    artifacts: IndexArtifacts,
+    db_uri: str,
+    collection_name: str = ENTITY_DESCRIPTION_COLLECTION,
+) -> LanceDBVectorStore:
+    """Open the persistent entity embedding table, building it only when create_final_entities changed."""
+    version = _embedding_version(artifacts.input_dir)
+    key = f"{os.path.abspath(db_uri)}/{collection_name}"
+    cached = _stores.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with _lock:
+        cached = _stores.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        store = None
+        if _read_stamp(db_uri, collection_name) == version:
+            store = LanceDBVectorStore(collection_name=collection_name)
+            store.connect(db_uri=db_uri)
+            try:
+                store.document_collection = store.db_connection.open_table(
+                    collection_name
+                )
+            except (FileNotFoundError, ValueError):
+                log.warning("Stamped table %s is missing, rebuilding", collection_name)
+                store = None
+
+        if store is None:
+            store = build_entity_vector_store(artifacts, db_uri, collection_name)
+
+        _stores[key] = (version, store)
+        return store
+
+
+def evict_entity_vector_store(
+    db_uri: str, collection_name: str = ENTITY_DESCRIPTION_COLLECTION
+):
+    """Drop the open table for db_uri, it is reopened from disk on next use."""
+    with _lock:
+        _stores.pop(f"{os.path.abspath(db_uri)}/{collection_name}", None)
+
+
+_memory_stores: dict[tuple[str, int], tuple[str, InMemoryVectorStore]] = {}
+
+
+def embedding_sidecar_path(
+    input_dir: str, collection_name: str = ENTITY_DESCRIPTION_COLLECTION
+) -> str:
+    return os.path.join(input_dir, f"{collection_name}.npy")
+
+
+def _sidecar_matrix(artifacts: IndexArtifacts, collection_name: str) -> np.ndarray:
+    """Memory map the normalized embeddings, rewriting the sidecar when the index changed."""
+    path = embedding_sidecar_path(artifacts.input_dir, collection_name)
+    version = _embedding_version(artifacts.input_dir)
+    n_entities = len(artifacts.columns.entities.ids)
+    if _read_stamp(artifacts.input_dir, f"{collection_name}.npy") == version:
+        try:
+            matrix = np.load(path, mmap_mode="r")
+            if matrix.shape[0] == n_entities:
+                return matrix
+        except (FileNotFoundError, ValueError):
+            pass
+        log.warning("Sidecar %s is missing or stale, rewriting", path)
+    write_npy(path, normalize_rows(artifacts.columns.entities.description_embeddings))
+    _write_stamp(artifacts.input_dir, f"{collection_name}.npy", version)
+    return np.load(path, mmap_mode="r")
+
+
+def build_memory_vector_store(
+    artifacts: IndexArtifacts,
+    collection_name: str = ENTITY_DESCRIPTION_COLLECTION,
+    mmap: bool = VECTOR_STORE_MMAP,
+) -> InMemoryVectorStore:
+    """Entity description embeddings as an in-process store, straight from the columnar arrays."""
+    columns = artifacts.columns.entities
+    rows = np.flatnonzero(columns.has_description_embedding)
+    if mmap:
+        vectors = _sidecar_matrix(artifacts, collection_name)
+        if len(rows) < len(columns.ids):
+            vectors = np.asarray(vectors[rows])
+    else:
+        vectors = normalize_rows(columns.description_embeddings[rows])
+    store = InMemoryVectorStore(collection_name=collection_name)
+    store.load_arrays(
+        ids=[columns.ids[row] for row in rows],
+        texts=[artifacts.entities[row].description for row in rows],
+        attributes=[
+            {
+                "title": artifacts.entities[row].title,
+                **(artifacts.entities[row].attributes or {}),
+            }
+            for row in rows
+        ],
+        vectors=vectors,
+        normalized=True,
+    )
+    return store
+
+
+def get_memory_vector_store(
+    artifacts: IndexArtifacts, collection_name: str = ENTITY_DESCRIPTION_COLLECTION
+) -> InMemoryVectorStore:
+    key = (artifacts.input_dir, artifacts.community_level)
+    with _lock:
+        cached = _memory_stores.get(key)
+        if cached is None or cached[0] != artifacts.version:
+            store = build_memory_vector_store(artifacts, collection_name)
+            cached = (artifacts.version, store)
+            _memory_stores[key] = cached
+        return cached[1]
+
+
+def get_entity_store(artifacts: IndexArtifacts) -> BaseVectorStore:
+    """The entity description embedding store local search uses, per GRAPHRAG_VECTOR_STORE."""
+    if VECTOR_STORE == "lancedb":
+        return get_entity_vector_store(
+            artifacts, db_uri=lancedb_uri(artifacts.input_dir)
+        )
+    return get_memory_vector_store(artifacts)
+
+
+def memory_vector_store_nbytes(input_dir: str, community_level: int) -> int:
+    with _lock:
+        cached = _memory_stores.get((input_dir, community_level))
+    return cached[1].nbytes if cached is not None else 0
+
+
+def evict_memory_vector_store(input_dir: str, community_level: int):
+    with _lock:
+        _memory_stores.pop((input_dir, community_level), None)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from artifact_store import COMMUNITY_LEVEL, INPUT_DIR, load_artifacts
+
+    parser = argparse.ArgumentParser(
+        description="build the entity description embedding table for an index run"
+    )
+    parser.add_argument("--input-dir", dest="input_dir", default=INPUT_DIR)
+    parser.add_argument(
+        "--npy",
+        action="store_true",
+        help="also write the .npy sidecar used with GRAPHRAG_VECTOR_STORE_MMAP=1",
+    )
+    args = parser.parse_args()
+
+    artifacts = load_artifacts(args.input_dir, COMMUNITY_LEVEL)
+    build_entity_vector_store(artifacts, db_uri=lancedb_uri(args.input_dir))
+    print(f"Built {ENTITY_DESCRIPTION_COLLECTION} for {args.input_dir}")
+    if args.npy:
+        build_memory_vector_store(artifacts, mmap=True)
+        print(f"Wrote {embedding_sidecar_path(args.input_dir)}")
@@ -0,0 +1,128 @@
+import os
+import sys
+
+# the app modules import each other as top-level modules, as under `streamlit run app/myapp.py`
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "app"))
+
+
+import hashlib
+from dataclasses import dataclass
+
+import numpy as np
+import pytest
+
+from graphrag.model import CommunityReport, Entity, Relationship, TextUnit
+
+from memory_vector_store import InMemoryVectorStore
+
+EMBEDDING_DIM = 8
+
+
+class WordTokenEncoder:
+    """Counts words as tokens, the context builders only take len() of an encoding."""
+
+    def encode(self, text: str, **kwargs) -> list[str]:
+        return text.split()
+
+    def decode(self, tokens: list[str]) -> str:
+        return " ".join(tokens)
+
+
+def text_vector(text: str) -> list[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(EMBEDDING_DIM).tolist()
+
+
+class HashTextEmbedder:
+    def embed(self, text: str, **kwargs) -> list[float]:
+        return text_vector(text)
+
+
+@dataclass
+class Graph:
+    entities: list[Entity]
+    relationships: list[Relationship]
+    text_units: list[TextUnit]
+    reports: list[CommunityReport]
+
+    def entity_store(self) -> InMemoryVectorStore:
+        store = InMemoryVectorStore(collection_name="entities")
+        store.load_arrays(
+            ids=[entity.id for entity in self.entities],
+            texts=[entity.description for entity in self.entities],
+            attributes=[{"title": entity.title} for entity in self.entities],
+            vectors=np.array([text_vector(entity.title) for entity in self.entities]),
+        )
+        return store
+
+
+# (source, target, weight, rank) between the entities A..K, K only links to A
+EDGES = [
+    ("A", "B", 3.0, 9), ("A", "C", 1.0, 7), ("B", "C", 2.0, 7), ("C", "D", 1.0, 6),
+    ("D", "E", 4.0, 5), ("E", "F", 1.0, 5), ("F", "G", 2.0, 4), ("G", "H", 1.0, 3),
+    ("H", "I", 5.0, 3), ("I", "J", 1.0, 2), ("A", "J", 2.0, 8), ("B", "H", 1.0, 6),
+    ("C", "G", 3.0, 6), ("D", "I", 1.0, 4), ("E", "J", 2.0, 5), ("F", "A", 1.0, 7),
+    ("K", "A", 1.0, 8),
+]
+
+
+@pytest.fixture
+def graph():
+    """A new small patient graph on every call, the objects of one call are never shared."""
+
+    def _build() -> Graph:
+        titles = "ABCDEFGHIJK"
+        entities = [
+            Entity(
+                id=f"entity-{i}",
+                short_id=str(i),
+                title=title,
+                type="PERSON",
+                description=f"{title} is entity number {i} of the patient record",
+                community_ids=[str(i % 3), str(3 + i % 2)],
+                text_unit_ids=[f"unit-{i % 4}", f"unit-{(i * 3) % 5}"],
+                rank=(i * 7) % 5 + 1,
+            )
+            for i, title in enumerate(titles)
+        ]
+        relationships = [
+            Relationship(
+                id=f"rel-{i}",
+                short_id=str(i),
+                source=source,
+                target=target,
+                weight=weight,
+                description=f"{source} relates to {target}",
+                text_unit_ids=[f"unit-{i % 5}"],
+                attributes={"rank": rank},
+            )
+            for i, (source, target, weight, rank) in enumerate(EDGES)
+        ]
+        text_units = [
+            TextUnit(
+                id=f"unit-{i}",
+                short_id=str(i),
+                text=f"session note {i} " + " ".join(titles[i : i + 4]),
+                entity_ids=[e.id for e in entities if f"unit-{i}" in e.text_unit_ids],
+                relationship_ids=[
+                    r.id for r in relationships if f"unit-{i}" in r.text_unit_ids
+                ],
+                n_tokens=10,
+            )
+            for i in range(5)
+        ]
+        reports = [
+            CommunityReport(
+                id=f"report-{i}",
+                short_id=str(i),
+                title=f"Community {i}",
+                community_id=str(i),
+                summary=f"summary of community {i}",
+                full_content=f"full report of community {i} " * 3,
+                rank=float(5 - i % 3),
+            )
+            for i in range(5)
+        ]
+        return Graph(entities, relationships, text_units, reports)
+
+    return _build
@@ -0,0 +1,63 @@
+import asyncio
+import sqlite3
+
+from graphrag.query.structured_search.base import SearchResult
+
+import answer_cache
+from answer_cache import AnswerCache
+
+
+def _result(response: str) -> SearchResult:
+    return SearchResult(
+        response=response,
+        context_data={},
+        context_text="",
+        completion_time=0.0,
+        llm_calls=1,
+        prompt_tokens=0,
+    )
+
+
+class _SameEmbedding:
+    """Every text embeds to the same vector, so every question is a paraphrase."""
+
+    async def aembed(self, text: str) -> list[float]:
+        return [1.0, 0.0]
+
+
+def test_semantic_tier_is_off_by_default(tmp_path):
+    cache = AnswerCache(path=str(tmp_path / "answers.sqlite"))
+    assert cache.semantic_threshold == 0
+
+
+def test_semantic_false_keys_only_match_exactly(tmp_path, monkeypatch):
+    monkeypatch.setattr(answer_cache, "get_cached_text_embedder", _SameEmbedding)
+    cache = AnswerCache(path=str(tmp_path / "answers.sqlite"), semantic_threshold=0.5)
+
+    async def _run():
+        await cache.aset("ns", '["And the dosage?", "q1"]', _result("a"), semantic=False)
+        assert await cache.aget("ns", '["And the dosage?", "q1"]', semantic=False)
+        assert await cache.aget("ns", '["And the dose?", "q1"]', semantic=False) is None
+        # nor does a semantic lookup find the exact-only entry
+        assert await cache.aget("ns", "And the dosage?") is None
+
+        await cache.aset("ns", "Is the patient on medication X?", _result("b"))
+        paraphrase = await cache.aget("ns", "Was the patient taken off medication X?")
+        assert paraphrase.response == "b"
+
+    asyncio.run(_run())
+
+
+def test_answers_are_stored_without_their_context(tmp_path):
+    cache = AnswerCache(path=str(tmp_path / "answers.sqlite"))
+    result = _result("a")
+    result.context_data = {"sources": "patient notes"}
+    result.context_text = "patient notes"
+    cache.set("ns", "q", result)
+
+    cached = cache.get("ns", "q")
+    assert (cached.response, cached.llm_calls) == ("a", 1)
+    assert cached.context_data == {} and cached.context_text == ""
+    with sqlite3.connect(cache.path) as conn:
+        (stored,) = conn.execute("SELECT result FROM answer_results").fetchone()
+    assert "patient notes" not in stored
@@ -0,0 +1,39 @@
+import pytest
+
+from graphrag.model import CommunityReport
+from graphrag.query.context_builder.community_context import (
+    _compute_community_weights,
+)
+
+from columnar import compact_artifacts
+from global_context import _community_weights
+
+
+def _reports(graph) -> list[CommunityReport]:
+    # a community no entity belongs to weighs 0
+    return [
+        *graph.reports,
+        CommunityReport(id="report-9", short_id="9", title="Empty", community_id="9"),
+    ]
+
+
+@pytest.mark.parametrize("normalize", [True, False])
+def test_community_weights_match_upstream(graph, normalize):
+    upstream = graph()
+    # an entity citing a text unit that is not in the text unit table
+    upstream.entities[0].text_unit_ids.append("unit-missing")
+    expected = _compute_community_weights(
+        _reports(upstream), upstream.entities, "occurrence", normalize
+    )
+
+    columnar = graph()
+    columnar.entities[0].text_unit_ids.append("unit-missing")
+    columns = compact_artifacts(
+        columnar.entities, columnar.relationships, columnar.text_units
+    )
+    weights = _community_weights(_reports(columnar), columns, "occurrence", normalize)
+
+    assert [report.attributes for report in weights] == [
+        report.attributes for report in expected
+    ]
+    assert any(report.attributes["occurrence"] != 0 for report in weights)
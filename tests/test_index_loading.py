@@ -0,0 +1,41 @@
+import asyncio
+import threading
+import time
+
+import index_registry
+
+
+def test_indexes_load_off_the_loop_one_at_a_time(monkeypatch):
+    loading = []
+    overlaps = []
+
+    def load_index(index_id):
+        loading.append(threading.current_thread())
+        overlaps.append(len(loading))
+        time.sleep(0.2)
+        loading.pop()
+        return index_id
+
+    monkeypatch.setattr(index_registry, "load_index", load_index)
+
+    async def main():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        results = await asyncio.gather(
+            index_registry.aget_index("a"), index_registry.aget_index("a")
+        )
+        ticker.cancel()
+        return results, ticks
+
+    results, ticks = asyncio.run(main())
+    assert results == ["a", "a"]
+    assert max(overlaps) == 1
+    # the loop kept running through both 0.2s loads
+    assert ticks > 20
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+import index_registry
+from index_registry import IndexRegistry
+from local_context import LocalSessionCache
+from memory_size import approx_size
+
+
+def test_session_cache_counts_its_tables():
+    session = LocalSessionCache(max_entries=1)
+    table = pd.DataFrame({"text": ["x" * 1000] * 10})
+    session.get_or_build(("a",), lambda: ("context", table))
+    assert session.nbytes > 10_000
+    session.get_or_build(("b",), lambda: "")
+    assert session.nbytes < 1000
+
+
+def test_series_and_frames_are_sized():
+    series = pd.Series(["x" * 1000] * 10)
+    assert approx_size(series) > 10_000
+    assert approx_size(series.to_frame()) > 10_000
+
+
+def test_cache_growth_evicts_least_recently_used_index(monkeypatch):
+    cache_bytes = {}
+    monkeypatch.setattr(
+        index_registry,
+        "artifact_store",
+        SimpleNamespace(
+            get=lambda input_dir, level: SimpleNamespace(version="1"),
+            evict=lambda input_dir, level: None,
+        ),
+    )
+    monkeypatch.setattr(index_registry, "estimate_artifact_bytes", lambda a: 100)
+    monkeypatch.setattr(
+        index_registry,
+        "estimate_cache_bytes",
+        lambda input_dir, level: cache_bytes.get(input_dir, 0),
+    )
+    dropped = []
+    monkeypatch.setattr(IndexRegistry, "_drop", lambda self, r: dropped.append(r.index_id))
+
+    registry = IndexRegistry(max_bytes=1000, max_indexes=8, community_level=2)
+    registry.get("a")
+    registry.get("b")
+    assert dropped == []
+
+    # queries on a filled its caches past the bound
+    cache_bytes[index_registry.index_input_dir("a")] = 2000
+    registry.get("b")
+    assert dropped == ["a"]
+    assert registry.memory_usage() == {"b": 100}
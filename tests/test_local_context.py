@@ -0,0 +1,85 @@
+import pandas as pd
+import pytest
+
+from graphrag.query.structured_search.local_search.mixed_context import (
+    LocalSearchMixedContext,
+)
+
+from columnar import compact_artifacts
+from conftest import HashTextEmbedder, WordTokenEncoder
+from local_context import LocalSearchContext, LocalSessionCache
+
+QUESTIONS = ["What medication is the patient on?", "Who is the social worker?"]
+
+
+def _upstream(graph) -> LocalSearchMixedContext:
+    return LocalSearchMixedContext(
+        entities=graph.entities,
+        entity_text_embeddings=graph.entity_store(),
+        text_embedder=HashTextEmbedder(),
+        text_units=graph.text_units,
+        community_reports=graph.reports,
+        relationships=graph.relationships,
+        token_encoder=WordTokenEncoder(),
+    )
+
+
+def _columnar(graph) -> LocalSearchContext:
+    store = graph.entity_store()
+    columns = compact_artifacts(graph.entities, graph.relationships, graph.text_units)
+    return LocalSearchContext(
+        entities=graph.entities,
+        entity_text_embeddings=store,
+        text_embedder=HashTextEmbedder(),
+        text_units=graph.text_units,
+        community_reports=graph.reports,
+        relationships=graph.relationships,
+        token_encoder=WordTokenEncoder(),
+        columns=columns,
+    )
+
+
+def _assert_same_context(context, expected):
+    assert context[0] == expected[0]
+    assert context[1].keys() == expected[1].keys()
+    for key, table in expected[1].items():
+        pd.testing.assert_frame_equal(
+            context[1][key].reset_index(drop=True), table.reset_index(drop=True)
+        )
+
+
+@pytest.mark.parametrize("question", QUESTIONS)
+@pytest.mark.parametrize("max_tokens", [8000, 400])
+@pytest.mark.parametrize("include_entity_names", [None, ["K", "A"]])
+def test_context_matches_upstream(graph, question, max_tokens, include_entity_names):
+    params = {
+        "top_k_mapped_entities": 4,
+        "top_k_relationships": 2,
+        "max_tokens": max_tokens,
+        "include_entity_names": include_entity_names,
+    }
+    expected = _upstream(graph()).build_context(question, **params)
+    context = _columnar(graph()).build_context(question, **params)
+    _assert_same_context(context, expected)
+
+
+def test_earlier_questions_do_not_change_the_context(graph):
+    # K's only relationship is out of network for the first question and in
+    # network for the second, which never counts its links
+    first = {"top_k_mapped_entities": 2, "include_entity_names": ["A"]}
+    second = {"top_k_mapped_entities": 2, "include_entity_names": ["K", "A"]}
+    expected = _columnar(graph()).build_context(QUESTIONS[1], **second)
+    context_builder = _columnar(graph())
+    context_builder.build_context(QUESTIONS[0], **first)
+    _assert_same_context(context_builder.build_context(QUESTIONS[1], **second), expected)
+
+
+def test_session_turns_build_the_context_of_a_new_conversation(graph):
+    first = {"top_k_mapped_entities": 2, "include_entity_names": ["A"]}
+    second = {"top_k_mapped_entities": 2, "include_entity_names": ["K", "A"]}
+    expected = _columnar(graph()).build_context(QUESTIONS[1], **second)
+    context_builder, session = _columnar(graph()), LocalSessionCache()
+    context_builder.build_context(QUESTIONS[0], session=session, **first)
+    context_builder.build_context(QUESTIONS[1], session=session, **second)
+    context = context_builder.build_context(QUESTIONS[1], session=session, **second)
+    _assert_same_context(context, expected)
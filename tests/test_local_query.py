@@ -0,0 +1,16 @@
+import asyncio
+
+import pytest
+
+import local_query
+
+
+class _FailedEmbedding:
+    async def aembed(self, text: str) -> list[float]:
+        return []
+
+
+def test_failed_question_embedding_is_reported(monkeypatch):
+    monkeypatch.setattr(local_query, "get_cached_text_embedder", _FailedEmbedding)
+    with pytest.raises(RuntimeError, match="Embedding the question failed"):
+        asyncio.run(local_query.embed_question("Which medications?"))
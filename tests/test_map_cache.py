@@ -0,0 +1,19 @@
+import json
+
+from map_cache import _cacheable
+
+
+def test_parsed_points_are_cached():
+    response = json.dumps({"points": [{"description": "CBT weekly", "score": 80}]})
+    assert _cacheable(response, [{"answer": "CBT weekly", "score": 80}])
+
+
+def test_empty_points_answer_is_cached():
+    assert _cacheable(json.dumps({"points": []}), [{"answer": "", "score": 0}])
+
+
+def test_failed_or_unparseable_replies_are_not_cached():
+    assert not _cacheable("", [{"answer": "", "score": 0}])
+    assert not _cacheable("The patient attends CBT.", [{"answer": "", "score": 0}])
+    # points without the fields parse_search_response needs
+    assert not _cacheable(json.dumps({"points": [{"text": "CBT"}]}), [])
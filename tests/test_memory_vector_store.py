@@ -0,0 +1,29 @@
+import numpy as np
+
+from memory_vector_store import InMemoryVectorStore
+
+
+def _store() -> InMemoryVectorStore:
+    store = InMemoryVectorStore(collection_name="entities")
+    store.load_arrays(
+        ids=["a", "b", "c"],
+        texts=["A", "B", "C"],
+        attributes=[{}, {}, {}],
+        vectors=np.array([[1.0, 0.0], [0.9, 0.1], [0.0, 1.0]]),
+    )
+    return store
+
+
+def test_include_ids_only_filters_its_own_search():
+    store = _store()
+    filtered = store.similarity_search_by_vector([1.0, 0.0], k=3, include_ids=["c"])
+    assert [result.document.id for result in filtered] == ["c"]
+    unfiltered = store.similarity_search_by_vector([1.0, 0.0], k=3)
+    assert [result.document.id for result in unfiltered] == ["a", "b", "c"]
+
+
+def test_filter_by_id_leaves_the_store_unfiltered():
+    store = _store()
+    assert store.filter_by_id(["b"]).tolist() == [False, True, False]
+    results = store.similarity_search_by_text("q", lambda text: [0.0, 1.0], k=1)
+    assert [result.document.id for result in results] == ["c"]
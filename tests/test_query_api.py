@@ -0,0 +1,39 @@
+import json
+
+from tornado.testing import AsyncHTTPTestCase
+
+import query_api
+
+
+def test_only_loopback_hosts_are_served_without_a_token():
+    assert query_api.is_loopback("127.0.0.1")
+    assert query_api.is_loopback("localhost")
+    assert query_api.is_loopback("::1")
+    assert not query_api.is_loopback("0.0.0.0")
+    assert not query_api.is_loopback("example.org")
+
+
+class BearerTokenTest(AsyncHTTPTestCase):
+    def get_app(self):
+        return query_api.make_app(api_token="secret")
+
+    def test_requests_without_the_token_are_rejected(self):
+        assert self.fetch("/indexes").code == 401
+        response = self.fetch("/indexes", headers={"Authorization": "Bearer wrong"})
+        assert response.code == 401
+
+    def test_requests_with_the_token_are_served(self):
+        response = self.fetch("/indexes", headers={"Authorization": "Bearer secret"})
+        assert response.code == 200
+
+    def test_health_is_served_without_the_token(self):
+        assert self.fetch("/health").code == 200
+
+    def test_batch_items_must_be_objects(self):
+        response = self.fetch(
+            "/query/batch",
+            method="POST",
+            body=json.dumps({"queries": ["Which medications?"]}),
+            headers={"Authorization": "Bearer secret"},
+        )
+        assert response.code == 400
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+
+import pytest
+
+from graphrag.query.structured_search.base import SearchResult
+from graphrag.query.structured_search.global_search.search import NO_DATA_ANSWER
+
+import query_router
+from metrics import QueryMetrics
+
+
+def _result(response: str) -> SearchResult:
+    return SearchResult(
+        response=response,
+        context_data={},
+        context_text="",
+        completion_time=0.0,
+        llm_calls=1,
+        prompt_tokens=0,
+    )
+
+
+def _fake_search(monkeypatch, outcomes: dict[str, tuple[float, object]]):
+    """Replace the engines, each sleeps and then returns or raises its outcome."""
+
+    def _search(search_type, *args, **kwargs):
+        delay, outcome = outcomes[search_type]
+
+        async def _run():
+            await asyncio.sleep(delay)
+            if isinstance(outcome, BaseException):
+                raise outcome
+            return outcome
+
+        return _run()
+
+    monkeypatch.setattr(query_router, "_search", _search)
+    monkeypatch.setattr(query_router, "ROUTER_HEDGE_DELAY_MS", 10)
+
+
+def _hedged() -> tuple[SearchResult, str, QueryMetrics]:
+    metrics = QueryMetrics()
+    result, winner = asyncio.run(
+        query_router._hedged_query("q", False, False, None, metrics, [])
+    )
+    return result, winner, metrics
+
+
+def test_local_answer_after_empty_global_answer(monkeypatch):
+    _fake_search(
+        monkeypatch,
+        {"local": (0.3, _result("Local answer.")), "global": (0.02, _result(""))},
+    )
+    result, winner, metrics = _hedged()
+    assert (result.response, winner) == ("Local answer.", "local")
+    assert metrics.counters["hedge_global_started"] == 1
+
+
+def test_local_answer_after_global_error(monkeypatch):
+    _fake_search(
+        monkeypatch,
+        {
+            "local": (0.3, _result("Local answer.")),
+            "global": (0.02, RuntimeError("map failed")),
+        },
+    )
+    result, winner, _ = _hedged()
+    assert (result.response, winner) == ("Local answer.", "local")
+
+
+def test_global_no_data_answer_does_not_beat_local(monkeypatch):
+    _fake_search(
+        monkeypatch,
+        {
+            "local": (0.3, _result("Local answer.")),
+            "global": (0.02, _result(NO_DATA_ANSWER)),
+        },
+    )
+    result, winner, _ = _hedged()
+    assert winner == "local"
+
+
+def test_global_answer_cancels_slow_local(monkeypatch):
+    _fake_search(
+        monkeypatch,
+        {"local": (5, _result("Local answer.")), "global": (0.02, _result("Global."))},
+    )
+    result, winner, metrics = _hedged()
+    assert winner == "global"
+    assert metrics.counters["hedge_local_cancelled"] == 1
+
+
+def test_unhelpful_local_falls_back_to_global(monkeypatch):
+    _fake_search(
+        monkeypatch,
+        {
+            "local": (0, _result("I don't know.")),
+            "global": (0.02, _result("Global answer.")),
+        },
+    )
+    result, winner, _ = _hedged()
+    assert (result.response, winner) == ("Global answer.", "global")
+
+
+def test_local_reply_kept_when_neither_answers(monkeypatch):
+    _fake_search(
+        monkeypatch,
+        {
+            "local": (0, _result("I don't know.")),
+            "global": (0.02, RuntimeError("map failed")),
+        },
+    )
+    result, winner, _ = _hedged()
+    assert (result.response, winner) == ("I don't know.", "local")
+
+
+def test_raises_local_error_when_both_fail(monkeypatch):
+    _fake_search(
+        monkeypatch,
+        {
+            "local": (0.05, ValueError("local failed")),
+            "global": (0.02, RuntimeError("global failed")),
+        },
+    )
+    with pytest.raises(ValueError, match="local failed"):
+        _hedged()
+
+
+def test_logs_do_not_carry_the_question(caplog):
+    question = "Is Jane Doe still on warfarin?"
+    metrics = QueryMetrics(search_type="auto", question=question)
+    route = query_router.Route("local", 0.5)
+    with caplog.at_level(logging.INFO):
+        query_router._record_route(metrics, question, route)
+        metrics.finish()
+    assert len(caplog.records) == 2
+    assert "Jane Doe" not in caplog.text
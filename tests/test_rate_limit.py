@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+from graphrag.query.llm.oai.typing import OPENAI_RETRY_ERROR_TYPES
+
+from rate_limit import (
+    MemoryBucketStore,
+    RateLimitedTransport,
+    RateLimiter,
+    RateLimitExceeded,
+    SqliteBucketStore,
+    on_event_loop,
+)
+
+
+def _limiter() -> RateLimiter:
+    return RateLimiter(
+        "test",
+        requests_per_minute=0,
+        tokens_per_minute=0,
+        max_concurrency=32,
+        store=MemoryBucketStore(),
+    )
+
+
+def _rate_limited(retry_after: str = "0.01") -> httpx.Response:
+    return httpx.Response(429, headers={"retry-after": retry_after})
+
+
+def test_burst_of_429s_halves_the_limit_once():
+    limiter = _limiter()
+    for _ in range(10):
+        limiter.on_response(_rate_limited())
+    assert limiter.limit == 16
+
+
+def test_429_after_the_window_halves_again():
+    limiter = _limiter()
+    limiter.on_response(_rate_limited())
+    limiter._decreased_until = time.time()
+    limiter.on_response(_rate_limited())
+    assert limiter.limit == 8
+
+
+def test_sync_acquire_fails_fast_on_an_event_loop():
+    limiter = _limiter()
+    limiter.on_response(_rate_limited(retry_after="30"))
+
+    async def acquire():
+        limiter.acquire_sync(1)
+
+    started = time.monotonic()
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(acquire())
+    assert time.monotonic() - started < 1
+    assert limiter.in_flight == 0
+
+
+def test_sync_acquire_waits_off_the_event_loop():
+    limiter = _limiter()
+    # the pause is measured on the wall clock from the 429
+    started = time.time()
+    limiter.on_response(_rate_limited(retry_after="0.05"))
+    limiter.acquire_sync(1)
+    assert time.time() - started >= 0.05
+    assert limiter.in_flight == 1
+
+
+def test_async_acquire_takes_from_a_shared_store_off_the_event_loop(tmp_path):
+    limiter = RateLimiter(
+        "test",
+        requests_per_minute=60,
+        tokens_per_minute=0,
+        max_concurrency=32,
+        store=SqliteBucketStore(str(tmp_path / "buckets.sqlite")),
+    )
+    threads = []
+    take = limiter.store.take
+
+    def recording_take(*args):
+        threads.append(on_event_loop())
+        return take(*args)
+
+    limiter.store.take = recording_take
+    asyncio.run(limiter.acquire(1))
+    assert threads == [False]
+    assert limiter.in_flight == 1
+
+
+def test_exhausted_budget_on_an_event_loop_is_not_retried():
+    limiter = _limiter()
+    limiter.on_response(_rate_limited(retry_after="30"))
+    sent = []
+    client = openai.OpenAI(
+        api_key="test",
+        base_url="http://llm.test/v1",
+        max_retries=20,
+        http_client=httpx.Client(
+            transport=RateLimitedTransport(
+                httpx.MockTransport(lambda request: sent.append(request)), limiter
+            )
+        ),
+    )
+
+    async def embed():
+        client.embeddings.create(input="question", model="test")
+
+    started = time.monotonic()
+    with pytest.raises(openai.APIStatusError) as raised:
+        asyncio.run(embed())
+    assert time.monotonic() - started < 1
+    assert not isinstance(raised.value, OPENAI_RETRY_ERROR_TYPES)
+    assert not sent
+    assert limiter.in_flight == 0
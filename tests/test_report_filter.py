@@ -0,0 +1,64 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import report_filter
+from report_filter import build_report_index, read_report_embeddings, select_reports
+
+
+class _Embedder:
+    """Embeds every text except those in failing, which raise."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+
+    async def aembed(self, text: str) -> list[float]:
+        self.calls.append(text)
+        if text in self.failing:
+            raise RuntimeError("embedding failed")
+        return [1.0, float(len(text))]
+
+
+@pytest.fixture
+def embedder(monkeypatch):
+    embedder = _Embedder()
+    monkeypatch.setattr(report_filter, "get_cached_text_embedder", lambda: embedder)
+    monkeypatch.setattr(
+        report_filter, "get_text_embedder", lambda: SimpleNamespace(model="test")
+    )
+    return embedder
+
+
+def _artifacts(tmp_path):
+    return SimpleNamespace(
+        input_dir=str(tmp_path),
+        content_hash="hash",
+        community_level=2,
+        version="1",
+        reports=[
+            SimpleNamespace(id=str(i), summary=f"report {i}", rank=1.0)
+            for i in range(3)
+        ],
+    )
+
+
+def test_failed_report_embeddings_are_left_out_and_retried(tmp_path, embedder):
+    artifacts = _artifacts(tmp_path)
+    embedder.failing = {"report 1"}
+    index = asyncio.run(build_report_index(artifacts))
+    assert index.ids == ["0", "2"]
+    assert read_report_embeddings(artifacts, "test")[0] == ["0", "2"]
+
+    embedder.failing, embedder.calls = set(), []
+    index = asyncio.run(build_report_index(artifacts))
+    assert index.ids == ["0", "1", "2"]
+    assert embedder.calls == ["report 1"]
+    assert read_report_embeddings(artifacts, "test")[0] == ["0", "1", "2"]
+
+
+def test_failed_question_embedding_maps_every_report(tmp_path, embedder):
+    artifacts = _artifacts(tmp_path)
+    embedder.failing = {"question"}
+    assert asyncio.run(select_reports(artifacts, "question")) is None